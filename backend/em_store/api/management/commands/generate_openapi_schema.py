@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from em_store import schema
+
+
+class Command(BaseCommand):
+    help = 'Write the OpenAPI schema artifacts served by /swagger.json, /swagger/ and /redoc/ for this code version'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-old', action='store_true', help='Keep the artifacts of other code versions')
+
+    def handle(self, *args, **options):
+        version = schema.code_version()
+        for fmt in schema.CODECS:
+            started = time.perf_counter()
+            path = schema.write_artifact(fmt, version)
+            self.stdout.write(f"Wrote {path} in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+        if not options['keep_old']:
+            current = {schema.artifact_path(fmt, version).name for fmt in schema.CODECS}
+            for path in schema.artifact_path('json', version).parent.glob('openapi-*'):
+                if path.name not in current:
+                    path.unlink()
+                    self.stdout.write(f"Removed {path}")
+        self.stdout.write(self.style.SUCCESS(f"OpenAPI schema generated for version {version}"))
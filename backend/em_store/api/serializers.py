@@ -8,6 +8,8 @@ class CampaignEmailAttachmentSerializer(serializers.ModelSerializer):
         model = CampaignEmailAttachment
         fields = ['id', 'original_filename', 'content_type', 'file_size', 'created_at', 'download_url']
         read_only_fields = ['id', 'created_at', 'download_url']
+        # Distinct from campaigns.serializers.CampaignEmailAttachmentSerializer in the OpenAPI schema
+        ref_name = 'ApiCampaignEmailAttachment'
 
 class EmailCampaignSerializer(serializers.ModelSerializer):
     attachments = CampaignEmailAttachmentSerializer(many=True, read_only=True)
@@ -25,6 +27,7 @@ class EmailCampaignSerializer(serializers.ModelSerializer):
             'updated_at', 'attachments', 'files'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
+        ref_name = 'ApiEmailCampaign'
         extra_kwargs = {
             'password': {'write_only': True, 'required': True},
             'use_ssl': {'default': True}
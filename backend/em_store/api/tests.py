@@ -1,3 +1,59 @@
-from django.test import TestCase
+import io
+import json
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from em_store import schema
+
+
+class PrecomputedSchemaTests(TestCase):
+    def setUp(self):
+        self.schema_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.schema_dir)
+        settings_override = override_settings(OPENAPI_SCHEMA_DIR=self.schema_dir, CODE_VERSION='build-1')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        schema._artifacts.clear()
+        self.addCleanup(schema._artifacts.clear)
+
+    def test_schema_is_generated_once_and_revalidated_with_etag(self):
+        with mock.patch.object(schema, 'generate', wraps=schema.generate) as generate:
+            response = self.client.get('/swagger.json')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('/api/campaigns/', json.loads(response.content)['paths'])
+            etag = response['ETag']
+
+            self.assertEqual(self.client.get('/swagger.json', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            # The UI's own spec URL is answered from the same artifact
+            self.assertEqual(self.client.get('/swagger/?format=openapi')['ETag'], etag)
+        generate.assert_called_once_with('json')
+        self.assertTrue((schema.artifact_path('json')).exists())
+
+    def test_new_code_version_regenerates(self):
+        etag = self.client.get('/swagger.json')['ETag']
+        with override_settings(CODE_VERSION='build-2'), mock.patch.object(schema, 'generate', return_value=b'{}') as generate:
+            response = self.client.get('/swagger.json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'{}')
+        generate.assert_called_once_with('json')
+
+    def test_ui_pages_load_the_artifact(self):
+        with mock.patch.object(schema, 'generate') as generate:
+            for url in ('/swagger/', '/redoc/'):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, '/swagger.json')
+        generate.assert_not_called()
+
+    def test_command_writes_artifacts_and_removes_stale_ones(self):
+        stale = schema.artifact_path('json', 'build-0')
+        stale.parent.mkdir(parents=True, exist_ok=True)
+        stale.write_text('{}')
+        call_command('generate_openapi_schema', stdout=io.StringIO())
+        self.assertTrue(schema.artifact_path('json').exists())
+        self.assertTrue(schema.artifact_path('yaml').exists())
+        self.assertFalse(stale.exists())
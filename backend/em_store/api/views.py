@@ -80,9 +80,8 @@ class EmailCampaignViewSet(
         if not email:
             return EmailCampaign.objects.none()
             
-        # Simple check if email exists in the table
-        exists = EmailCampaign.objects.filter(email__iexact=email).exists()
-        return EmailCampaign.objects.filter(pk=-1) if not exists else EmailCampaign.objects.filter(email__iexact=email)
+        # Served by the UPPER(email) index; empty when the email doesn't exist
+        return EmailCampaign.objects.filter(email__iexact=email).prefetch_related('attachments')
 
     def _validate_file(self, file):
         """Validate file size and type."""
@@ -271,6 +270,9 @@ class CampaignEmailAttachmentViewSet(
         Return only attachments that belong to the current user's campaigns.
         Also supports filtering by campaign ID and file type.
         """
+        if getattr(self, 'swagger_fake_view', False):
+            # Schema generation: no user to filter by
+            return CampaignEmailAttachment.objects.none()
         queryset = CampaignEmailAttachment.objects.filter(
             email_campaign__created_by=self.request.user
         )
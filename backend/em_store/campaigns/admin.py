@@ -183,6 +183,7 @@ class CampaignEmailAttachmentAdmin(ImportExportModelAdmin, admin.ModelAdmin):
         'original_filename', 'get_campaign_name', 'content_type', 
         'get_file_size_display', 'created_at', 'download_link'
     )
+    list_select_related = ('email_campaign',)
     list_filter = ('content_type', 'created_at', 'email_campaign__provider')
     search_fields = ('original_filename', 'email_campaign__name', 'email_campaign__email')
     readonly_fields = (
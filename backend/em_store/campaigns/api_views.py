@@ -4,11 +4,12 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from django.shortcuts import get_object_or_404
-from django.http import FileResponse, Http404
+from django.http import Http404
 from django.conf import settings
 from rest_framework.exceptions import ValidationError
 
 from campaigns.models import CampaignEmailAttachment, EmailCampaign
+from em_store.downloads import serve_stored_file
 from .serializers import CampaignEmailAttachmentSerializer
 
 logger = logging.getLogger(__name__)
@@ -20,10 +21,14 @@ class CampaignEmailAttachmentViewSet(viewsets.ModelViewSet):
     queryset = CampaignEmailAttachment.objects.all()
     serializer_class = CampaignEmailAttachmentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    ordering = ('-created_at', '-id')
     parser_classes = (MultiPartParser, FormParser)
 
     def get_queryset(self):
         """Filter attachments by campaign and user permissions."""
+        if getattr(self, 'swagger_fake_view', False):
+            # Schema generation: no user to filter by
+            return self.queryset.none()
         queryset = super().get_queryset()
         campaign_id = self.request.query_params.get('campaign_id')
         
@@ -54,7 +59,7 @@ class CampaignEmailAttachmentViewSet(viewsets.ModelViewSet):
         serializer.save(email_campaign=campaign)
 
     @action(detail=True, methods=['get'])
-    def download(self, request, pk=None):
+    def download(self, request, pk=None, campaign_pk=None):
         """Download the attachment file from R2."""
         attachment = self.get_object()
         
@@ -65,17 +70,15 @@ class CampaignEmailAttachmentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Get the file from R2
+        # Stream the file from R2
         try:
-            file = attachment.file
-            response = FileResponse(file)
-            
-            # Set content type and disposition
-            response['Content-Type'] = attachment.content_type or 'application/octet-stream'
-            response['Content-Disposition'] = f'attachment; filename="{attachment.original_filename}"'
-            
-            return response
+            return serve_stored_file(request, attachment.file, attachment.original_filename, attachment.content_type)
             
+        except FileNotFoundError:
+            return Response(
+                {"detail": "File not found."},
+                status=status.HTTP_404_NOT_FOUND
+            )
         except Exception as e:
             logger.error(f"Error serving file {attachment.file.name}: {str(e)}", exc_info=True)
             return Response(
@@ -0,0 +1,59 @@
+"""
+Creation of campaign attachments from uploaded files.
+"""
+import logging
+import os
+
+from em_store.storage_utils import upload_files_to_r2
+
+from .cache import campaign_list_cache
+from .models import CampaignEmailAttachment
+
+logger = logging.getLogger(__name__)
+
+
+def create_attachments(campaign, files):
+    """
+    Upload ``files`` to R2 concurrently and create an attachment for each.
+
+    Files are streamed from the request's upload handlers, so large uploads
+    are never held in memory. Every row is inserted with its final key and
+    URL in a single bulk INSERT once the uploads have finished. Files that
+    fail to upload are logged and skipped. Returns the created
+    CampaignEmailAttachment objects.
+    """
+    files = list(files)
+    if not files:
+        return []
+
+    results = upload_files_to_r2([
+        {
+            'file_obj': file,
+            'file_name': os.path.basename(file.name),
+            'content_type': file.content_type or 'application/octet-stream',
+            'folder': f'campaigns/{campaign.id}/attachments',
+        }
+        for file in files
+    ])
+
+    attachments = []
+    for file, result in zip(files, results):
+        if not result['success']:
+            logger.error(f"Failed to upload {file.name} to R2: {result.get('error')}")
+            continue
+        attachments.append(CampaignEmailAttachment(
+            email_campaign=campaign,
+            client=campaign,
+            file=result['key'],
+            original_filename=file.name,
+            content_type=file.content_type or 'application/octet-stream',
+            file_size=file.size,
+            download_url=result['url'],
+        ))
+    if attachments:
+        CampaignEmailAttachment.objects.bulk_create(attachments)
+        # bulk_create sends no post_save
+        if campaign.created_by_id:
+            campaign_list_cache.invalidate(campaign.created_by_id)
+        logger.info(f"Created {len(attachments)} attachment(s) for campaign {campaign.id}")
+    return attachments
@@ -0,0 +1,11 @@
+"""
+Per-user cache of the campaign list responses.
+
+Entries are invalidated by the signal receivers in ``campaigns.signals`` and
+by ``create_attachments``, whose bulk INSERT sends no signals; writes that
+bypass both (``QuerySet.update()``) are picked up within
+CAMPAIGN_LIST_CACHE_SECONDS.
+"""
+from em_store.cache import VersionedCache
+
+campaign_list_cache = VersionedCache('campaign-list', 'CAMPAIGN_LIST_CACHE_SECONDS', 300)
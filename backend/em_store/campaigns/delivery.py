@@ -0,0 +1,460 @@
+"""
+SMTP delivery engine for email campaigns.
+
+Messages are sent over persistent, authenticated SMTP connections that are
+kept open and reused for many messages, and recipients are fanned out over a
+bounded pool of worker threads. Message bytes are assembled by
+``campaigns.mime``: the shared body and attachment parts are encoded once
+per run and each recipient only adds its own headers.
+"""
+import logging
+import queue
+import smtplib
+import socket
+import ssl
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formataddr, formatdate, make_msgid
+
+from django.conf import settings
+from django.utils.html import strip_tags
+
+from .hostcontrol import DEFERRED, HostUnavailable, classify, get_controller
+from .ledger import SendLedger
+from .mime import MessageTemplate, send_chunks
+from .models import SendLog
+from .ratelimit import AccountThrottle, RateLimited
+
+logger = logging.getLogger(__name__)
+
+# SMTP defaults used when a campaign leaves smtp_host/smtp_port blank
+PROVIDER_SMTP_DEFAULTS = {
+    'gmail': ('smtp.gmail.com', 587),
+    'yahoo': ('smtp.mail.yahoo.com', 465),
+    'outlook': ('smtp.office365.com', 587),
+}
+
+# Cap on the number of per-recipient errors kept in a send summary
+MAX_REPORTED_ERRORS = 100
+
+
+def get_smtp_settings(campaign):
+    """
+    Return the (host, port, use_ssl) triple used to reach the campaign's SMTP server.
+    Falls back to the provider defaults when host or port are not set.
+    """
+    default_host, default_port = PROVIDER_SMTP_DEFAULTS.get(
+        (campaign.provider or '').lower(), (None, None)
+    )
+    host = campaign.smtp_host or default_host
+    port = campaign.smtp_port or default_port or (465 if campaign.use_ssl else 25)
+    if not host:
+        raise ValueError(f"No SMTP host configured for campaign {campaign.pk}")
+    return host, int(port), bool(campaign.use_ssl)
+
+
+class DeliveryAborted(Exception):
+    """Raised when a send run is stopped because the sending account cannot be used."""
+
+
+class AlreadyAttempted(Exception):
+    """Reported for a recipient skipped because an earlier run already tried to send to it."""
+
+
+class SMTPConnectionPool:
+    """
+    Pool of open SMTP connections keyed by (host, port, use_ssl, username).
+
+    The login is part of the key because a connection is authenticated as a
+    single account. Idle connections stay open and are handed to the next
+    caller until they reach ``max_messages_per_connection`` or the server
+    drops them.
+    """
+
+    def __init__(self, max_connections_per_host=None, max_messages_per_connection=None, timeout=30):
+        self.max_connections_per_host = max_connections_per_host or getattr(
+            settings, 'CAMPAIGN_SMTP_MAX_CONNECTIONS_PER_HOST', 4
+        )
+        self.max_messages_per_connection = max_messages_per_connection or getattr(
+            settings, 'CAMPAIGN_SMTP_MESSAGES_PER_CONNECTION', 500
+        )
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = defaultdict(list)
+        self._slots = {}
+
+    def _get_slots(self, key):
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.max_connections_per_host)
+            return self._slots[key]
+
+    def _open(self, key, password):
+        host, port, use_ssl, username = key
+        if use_ssl and port == 465:
+            conn = smtplib.SMTP_SSL(host, port, timeout=self.timeout, context=ssl.create_default_context())
+        else:
+            conn = smtplib.SMTP(host, port, timeout=self.timeout)
+            if use_ssl:
+                conn.starttls(context=ssl.create_default_context())
+        # Messages are written in several pieces (see mime.send_chunks); don't let Nagle delay them
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if username and password:
+            conn.login(username, password)
+        logger.debug("Opened SMTP connection to %s:%s for %s", host, port, username)
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.quit()
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def acquire(self, host, port, use_ssl, username, password):
+        """Return ``(key, entry)`` where entry is ``[connection, messages_sent]``."""
+        key = (host, port, use_ssl, username)
+        self._get_slots(key).acquire()
+        try:
+            with self._lock:
+                idle = self._idle[key]
+                entry = idle.pop() if idle else None
+            if entry is None:
+                entry = [self._open(key, password), 0]
+            return key, entry
+        except Exception:
+            self._get_slots(key).release()
+            raise
+
+    def release(self, key, entry, discard=False):
+        """Return a connection to the pool, closing it if it is worn out or broken."""
+        try:
+            if discard or entry[1] >= self.max_messages_per_connection:
+                self._close(entry[0])
+            else:
+                with self._lock:
+                    self._idle[key].append(entry)
+        finally:
+            self._get_slots(key).release()
+
+    def close_all(self):
+        """Close every idle connection held by the pool."""
+        with self._lock:
+            idle, self._idle = self._idle, defaultdict(list)
+        for entries in idle.values():
+            for conn, _ in entries:
+                self._close(conn)
+
+
+class CampaignSender:
+    """
+    Send an EmailCampaign to its recipients over pooled SMTP connections.
+
+    Recipients are read from the database in the calling thread and handed to
+    the workers through a bounded queue, so memory stays flat for large lists.
+    Each worker checks out one connection and streams messages over it until
+    the queue is drained, so open connections never exceed the worker count.
+    Every message also takes a slot from the SMTP host's HostController, so
+    fewer workers send at once while the host is slow or deferring.
+    """
+
+    def __init__(
+        self, campaign, max_workers=None, pool=None, attachments=None,
+        rate_limit=True, max_rate_wait=None, max_host_wait=None,
+    ):
+        self.campaign = campaign
+        self.max_workers = max_workers or getattr(settings, 'CAMPAIGN_SEND_WORKERS', 8)
+        self.pool = pool or SMTPConnectionPool(max_connections_per_host=self.max_workers)
+        self._owns_pool = pool is None
+        self.host, self.port, self.use_ssl = get_smtp_settings(campaign)
+        self.username = campaign.email
+        self.password = campaign.get_decrypted_password() if campaign.password else None
+        self._text_body = strip_tags(campaign.body or '')
+        self._lock = threading.Lock()
+        self._abort = None
+        self._on_result = None
+        self._throttle = None
+        self._ledger = None
+        self._claimed = set()
+        self.rate_limit = rate_limit
+        self.max_rate_wait = max_rate_wait
+        self.max_host_wait = max_host_wait
+        self.host_control = get_controller(
+            self.host, self.port, min(self.max_workers, self.pool.max_connections_per_host),
+        )
+        self._prepare_body(attachments)
+
+    def get_recipients(self):
+        """Return an iterator over the subscribed EmailEntry rows of the campaign."""
+        return (
+            self.campaign.email_entries
+            .filter(unsubscribe=False)
+            .only('id', 'name', 'email')
+            .order_by('id')
+            .iterator(chunk_size=2000)
+        )
+
+    def _prepare_body(self, attachments=None):
+        """
+        Encode the parts shared by every recipient once per run, attachments
+        included (the campaign's own unless ``attachments`` is given).
+        Per-recipient messages only add their own To/Message-ID/Date headers
+        and, for campaigns with merge fields, their rendered subject and body.
+        """
+        self.template = MessageTemplate.for_campaign(self.campaign, self._text_body, attachments)
+        self._msgid_domain = self.campaign.email.rpartition('@')[2] or None
+
+    def _recipient_headers(self, entry):
+        name = (entry.name or '').replace('\r', ' ').replace('\n', ' ')
+        # formataddr RFC 2047-encodes non-ASCII names, so no folding is needed here
+        return (
+            f"To: {formataddr((name, entry.email))}\r\n"
+            + f"Date: {formatdate()}\r\n"
+            + f"Message-ID: {make_msgid(domain=self._msgid_domain)}\r\n"
+        ).encode('utf-8')
+
+    def build_message(self, entry):
+        """Return the raw message bytes for a single recipient, as sent on the wire (dot-stuffed)."""
+        return self.template.render(self._recipient_headers(entry), entry)
+
+    def _send_one(self, entry, conn_entry):
+        chunks = self.template.chunks(self._recipient_headers(entry), entry)
+        send_chunks(conn_entry[0], self.campaign.email, [entry.email], chunks)
+        conn_entry[1] += 1
+
+    def _record_success(self, summary, entry):
+        with self._lock:
+            summary['sent'] += 1
+        self._log(entry, SendLog.STATUS_SENT)
+        if self._on_result:
+            self._on_result(entry, None)
+
+    def _record_failure(self, summary, entry, error):
+        logger.warning("Failed to send campaign %s to %s: %s", self.campaign.pk, entry.email, error)
+        with self._lock:
+            summary['failed'] += 1
+            if len(summary['errors']) < MAX_REPORTED_ERRORS:
+                summary['errors'].append({'email': entry.email, 'error': str(error)})
+        self._log(entry, SendLog.STATUS_DEFERRED if classify(error) == DEFERRED else SendLog.STATUS_FAILED)
+        if self._on_result:
+            self._on_result(entry, error)
+
+    def _log(self, entry, status):
+        if self._ledger is not None:
+            with self._lock:
+                self._claimed.discard(entry.id)
+            self._ledger.record(entry.id, status)
+
+    def _claim(self, recipients, summary):
+        """
+        Yield the recipients the ledger lets this run send, claiming them in
+        batches of CAMPAIGN_LEDGER_BATCH (and writing the outcomes recorded
+        since the previous batch). Skipped recipients are reported to
+        ``on_result``: as sent if the earlier run delivered to them, with
+        AlreadyAttempted otherwise.
+        """
+        if self._ledger is None:
+            yield from recipients
+            return
+        batch_size = getattr(settings, 'CAMPAIGN_LEDGER_BATCH', 500)
+        batch = []
+        for entry in recipients:
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                yield from self._claim_batch(batch, summary)
+                batch = []
+        if batch:
+            yield from self._claim_batch(batch, summary)
+
+    def _claim_batch(self, batch, summary):
+        self._ledger.flush()
+        claimed, previous = self._ledger.claim([entry.id for entry in batch])
+        with self._lock:
+            self._claimed.update(claimed)
+        for entry in batch:
+            if entry.id in claimed:
+                # A recipient listed twice is sent to once
+                claimed.discard(entry.id)
+                yield entry
+                continue
+            with self._lock:
+                summary['skipped'] += 1
+            if self._on_result:
+                status = previous.get(entry.id)
+                self._on_result(entry, None if status == SendLog.STATUS_SENT else AlreadyAttempted(
+                    f"An earlier run already tried to send campaign {self.campaign.pk} to {entry.email}"
+                ))
+
+    def _close_ledger(self):
+        """Write the outstanding outcomes and release the claims of recipients that were never attempted."""
+        with self._lock:
+            unsent, self._claimed = self._claimed, set()
+        try:
+            self._ledger.flush()
+            self._ledger.release(unsent)
+        except Exception:
+            # The claims stay SENDING: those recipients are skipped by later runs, never sent twice
+            logger.exception("Failed to write the send ledger of campaign %s", self.campaign.pk)
+
+    def _connect(self):
+        """Check out a pooled connection, aborting the run if the server refuses the session."""
+        try:
+            return self.pool.acquire(self.host, self.port, self.use_ssl, self.username, self.password)
+        except (smtplib.SMTPAuthenticationError, smtplib.SMTPNotSupportedError, smtplib.SMTPHeloError) as e:
+            # Every other recipient would fail the same way (and hammer the login)
+            self._stop(DeliveryAborted(f"SMTP session setup failed for {self.username}: {e}"))
+            raise self._abort from e
+
+    def _next(self, work):
+        """Return the next recipient, or None once the queue is closed or the run aborted."""
+        while self._abort is None:
+            try:
+                return work.get(timeout=1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _stop(self, error):
+        """Stop the run: workers finish the message in hand and ``send`` raises ``error``."""
+        if self._abort is None:
+            self._abort = error
+        if self._throttle is not None:
+            self._throttle.stop()
+
+    def _worker(self, work, summary):
+        """Check out one connection and stream recipients over it until none are left."""
+        key = conn_entry = None
+        try:
+            while True:
+                entry = self._next(work)
+                if entry is None:
+                    return
+                for attempt in (1, 2):
+                    try:
+                        probe = self.host_control.acquire(self.max_host_wait, cancelled=lambda: self._abort is not None)
+                    except HostUnavailable as e:
+                        # The recipient is left unsent, like those still queued
+                        self._stop(e)
+                        return
+                    started, error = time.monotonic(), None
+                    try:
+                        if conn_entry is None:
+                            key, conn_entry = self._connect()
+                        self._send_one(entry, conn_entry)
+                        self._record_success(summary, entry)
+                        break
+                    except DeliveryAborted:
+                        return
+                    except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as e:
+                        # Per-recipient rejection; smtplib has already reset the session.
+                        # Caught first: SMTPException is a subclass of OSError
+                        error = e
+                        self._record_failure(summary, entry, e)
+                        break
+                    except (smtplib.SMTPServerDisconnected, OSError) as e:
+                        # Broken connection: drop it and retry the recipient once on a fresh one
+                        error = e
+                        if conn_entry is not None:
+                            self.pool.release(key, conn_entry, discard=True)
+                            conn_entry = None
+                        if attempt == 2:
+                            self._record_failure(summary, entry, e)
+                    except Exception as e:
+                        self._record_failure(summary, entry, e)
+                        break
+                    finally:
+                        self.host_control.release(classify(error), time.monotonic() - started, probe)
+                if conn_entry is not None and conn_entry[1] >= self.pool.max_messages_per_connection:
+                    self.pool.release(key, conn_entry)
+                    conn_entry = None
+        finally:
+            if conn_entry is not None:
+                self.pool.release(key, conn_entry)
+
+    def _put(self, work, item):
+        while self._abort is None:
+            try:
+                work.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def send(self, recipients=None, progress=None, progress_interval=2.0, on_result=None, step=None):
+        """
+        Send the campaign and return a summary dict with sent/failed counts,
+        a bounded list of errors and the elapsed time in seconds.
+
+        ``progress`` is called from the calling thread with the current
+        sent/failed counters at most every ``progress_interval`` seconds.
+        ``on_result(entry, error)`` is called after every recipient, with
+        ``error`` set to None when the message was sent.
+        Raises DeliveryAborted if the SMTP server rejects the sending account.
+
+        With a ``step`` (0 for the campaign itself, the drip step otherwise),
+        every message is claimed in the send ledger first (see
+        campaigns/ledger.py), and recipients an earlier run of the same step
+        already attempted are skipped and counted as 'skipped'. Only
+        deferred recipients are tried again.
+
+        Messages are paced to the account's provider limits (see
+        campaigns/ratelimit.py): the run waits for tokens, or raises
+        RateLimited once the wait would exceed ``max_rate_wait`` seconds.
+        Concurrency follows the SMTP host's health (see
+        campaigns/hostcontrol.py): while its circuit is open the run waits,
+        or raises HostUnavailable if it would not close within
+        ``max_host_wait`` seconds. Either way, recipients not yet sent by
+        then are not attempted.
+        """
+        recipients = recipients if recipients is not None else self.get_recipients()
+        work = queue.Queue(maxsize=self.max_workers * 100)
+        summary = {'sent': 0, 'failed': 0, 'skipped': 0, 'errors': []}
+        self._abort = None
+        self._on_result = on_result
+        self._ledger = SendLedger(self.campaign.pk, step) if step is not None and self.campaign.pk else None
+        if self.rate_limit:
+            self._throttle = AccountThrottle(self.username, self.campaign.provider, max_wait=self.max_rate_wait)
+        started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='campaign-send') as executor:
+                futures = [executor.submit(self._worker, work, summary) for _ in range(self.max_workers)]
+                last_report = time.monotonic()
+                try:
+                    for entry in self._claim(recipients, summary):
+                        if self._throttle is not None:
+                            self._throttle.wait()
+                        self._put(work, entry)
+                        if self._abort is not None:
+                            break
+                        if progress and time.monotonic() - last_report >= progress_interval:
+                            progress(sent=summary['sent'], failed=summary['failed'])
+                            last_report = time.monotonic()
+                finally:
+                    for _ in futures:
+                        self._put(work, None)
+                for future in futures:
+                    future.result()
+        except RateLimited:
+            if self._abort is None:
+                raise
+        finally:
+            if self._owns_pool:
+                self.pool.close_all()
+            if self._ledger is not None:
+                self._close_ledger()
+                summary['ledger'] = round(self._ledger.seconds, 3)
+            if self._throttle is not None:
+                self._throttle.close()
+                summary['throttled'] = round(self._throttle.throttled_seconds, 3)
+        if self._abort is not None:
+            raise self._abort
+        summary['elapsed'] = round(time.monotonic() - started, 3)
+        logger.info(
+            "Campaign %s delivery finished: %s sent, %s failed, %s skipped in %.1fs",
+            self.campaign.pk, summary['sent'], summary['failed'], summary['skipped'], summary['elapsed'],
+        )
+        return summary
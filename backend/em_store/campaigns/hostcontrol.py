@@ -0,0 +1,201 @@
+"""
+Adaptive concurrency and circuit breaking per SMTP host.
+
+Every SMTP host (host, port) has a HostController, shared by all senders in
+the process. A sender takes a slot from it for every message and returns it
+with the outcome:
+
+* Concurrency is adjusted AIMD-style: each message that goes through
+  quickly raises the host's limit by 1/limit (about one more connection per
+  round of messages), while a 4xx deferral, a timeout or broken connection,
+  or a message slower than CAMPAIGN_SMTP_SLOW_SECONDS halves it (at most
+  once per second). The limit stays between 1 and the pool's per-host
+  connection cap.
+* When at least half of the recent messages failed (deferred, timed out or
+  disconnected), the circuit opens: no more messages go to the host for a
+  backoff that starts at CAMPAIGN_SMTP_BREAKER_BACKOFF seconds and doubles
+  every time the host fails again, up to CAMPAIGN_SMTP_BREAKER_MAX_BACKOFF.
+  After the backoff a single probe message is let through; if it is
+  delivered the circuit closes again, starting from one connection.
+
+A broken host thus only slows the campaigns that send through it; their
+senders wait for the circuit to close, or give up with HostUnavailable.
+"""
+import logging
+import smtplib
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+OK = 'ok'
+DEFERRED = 'deferred'
+ERROR = 'error'
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Recent outcomes the failure rate is computed over, and how many are needed first
+WINDOW = 20
+MIN_SAMPLES = 5
+FAILURE_RATE = 0.5
+DECREASE_INTERVAL = 1.0
+
+
+class HostUnavailable(Exception):
+    """Raised when a host's circuit is open and the caller will not wait for it to close."""
+
+    def __init__(self, host, retry_in):
+        super().__init__(f"SMTP host {host} is failing; retrying it in {retry_in:.0f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+def classify(error):
+    """
+    Return the outcome (OK, DEFERRED or ERROR) of a message that raised
+    ``error``; None means it was sent. Permanent 5xx rejections are OK: the
+    host answered, and the problem was the message or recipient.
+    """
+    if error is None:
+        return OK
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return DEFERRED if codes and all(400 <= code < 500 for code in codes) else OK
+    code = getattr(error, 'smtp_code', None)
+    if code is not None:
+        return DEFERRED if 400 <= code < 500 else OK
+    if isinstance(error, (smtplib.SMTPServerDisconnected, OSError)):
+        return ERROR
+    return OK
+
+
+class HostController:
+    """Concurrency limit and circuit breaker for one SMTP host."""
+
+    def __init__(self, host, max_concurrency, slow_seconds=None, backoff=None, max_backoff=None):
+        self.host = host
+        self.max_concurrency = max(1, max_concurrency)
+        self.slow_seconds = slow_seconds or getattr(settings, 'CAMPAIGN_SMTP_SLOW_SECONDS', 5.0)
+        self.backoff = backoff or getattr(settings, 'CAMPAIGN_SMTP_BREAKER_BACKOFF', 30.0)
+        self.max_backoff = max_backoff or getattr(settings, 'CAMPAIGN_SMTP_BREAKER_MAX_BACKOFF', 1800.0)
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=WINDOW)
+        self._opened_until = 0.0
+        self._opens = 0
+        self._probing = False
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None, cancelled=None):
+        """
+        Wait for a slot to send one message. Returns True if the message is
+        the probe of a half-open circuit; pass that on to ``release``.
+
+        Raises HostUnavailable if the circuit is open and would not close
+        within ``timeout`` seconds (None waits as long as it takes), or once
+        ``cancelled()`` returns True.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if cancelled is not None and cancelled():
+                    raise HostUnavailable(self.host, max(self._opened_until - now, 0))
+                if self.state == OPEN and now >= self._opened_until:
+                    self.state = HALF_OPEN
+                    logger.info("SMTP host %s: sending a probe message", self.host)
+                if self.state == OPEN:
+                    if deadline is not None and self._opened_until > deadline:
+                        raise HostUnavailable(self.host, self._opened_until - now)
+                    self._cond.wait(min(self._opened_until - now, 1.0))
+                    continue
+                if self.state == HALF_OPEN:
+                    if not self._probing:
+                        self._probing = True
+                        self.in_flight += 1
+                        return True
+                elif self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return False
+                self._cond.wait(1.0)
+
+    def release(self, outcome, seconds, probe=False):
+        """Return a slot with the outcome of its message and how long it took."""
+        now = time.monotonic()
+        with self._cond:
+            self.in_flight -= 1
+            failed = outcome != OK
+            if probe:
+                self._probing = False
+                if failed:
+                    self._open(now)
+                else:
+                    logger.info("SMTP host %s recovered; closing its circuit", self.host)
+                    self.state = CLOSED
+                    self._opens = 0
+                    self._outcomes.clear()
+                    self.limit = 1.0
+            elif self.state == CLOSED:
+                self._outcomes.append(failed)
+                if failed and len(self._outcomes) >= MIN_SAMPLES and (
+                    sum(self._outcomes) / len(self._outcomes) >= FAILURE_RATE
+                ):
+                    self._open(now)
+                elif failed or seconds > self.slow_seconds:
+                    self._decrease(now)
+                else:
+                    self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def _decrease(self, now):
+        if now - self._last_decrease >= DECREASE_INTERVAL:
+            self._last_decrease = now
+            self.limit = max(1.0, self.limit / 2)
+
+    def _open(self, now):
+        backoff = min(self.max_backoff, self.backoff * 2 ** self._opens)
+        self._opens += 1
+        self._opened_until = now + backoff
+        self._outcomes.clear()
+        self.limit = 1.0
+        self.state = OPEN
+        logger.warning("SMTP host %s is failing; pausing sends to it for %.0fs", self.host, backoff)
+
+    def snapshot(self):
+        """Return the controller's current state as a dict."""
+        with self._cond:
+            return {
+                'host': self.host,
+                'state': self.state,
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'failure_rate': round(sum(self._outcomes) / len(self._outcomes), 2) if self._outcomes else 0.0,
+                'retry_in': round(max(self._opened_until - time.monotonic(), 0), 1) if self.state == OPEN else 0,
+            }
+
+
+_controllers = {}
+_lock = threading.Lock()
+
+
+def get_controller(host, port, max_concurrency):
+    """Return the process-wide controller of ``host:port``."""
+    key = f'{host}:{port}'
+    with _lock:
+        controller = _controllers.get(key)
+        if controller is None:
+            controller = _controllers[key] = HostController(key, max_concurrency)
+        return controller
+
+
+def reset():
+    """Forget every host's state."""
+    with _lock:
+        _controllers.clear()
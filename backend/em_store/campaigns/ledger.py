@@ -0,0 +1,116 @@
+"""
+Send ledger: the ``send_log`` table.
+
+Every message a campaign sends has a row keyed by (campaign_id, entry_id,
+step). Before a batch of recipients is handed to the SMTP workers it is
+claimed with one multi-row ``INSERT ... ON CONFLICT ... RETURNING``: only
+recipients with no row yet, or whose last attempt was deferred with a 4xx,
+come back and are sent. Outcomes are buffered and written back with one
+multi-row upsert per flush, not one write per message.
+
+A retried job, or a drip chunk whose transaction was rolled back, therefore
+never sends a message twice. Claims a run never got to are released when it
+stops; rows left SENDING by a process that died are not retried, since their
+message may have gone out.
+
+The ledger writes on the thread's autocommit side connection
+(``em_store.db.autocommit_connection``), so a claim is committed before its
+message is sent even when the caller holds a transaction open.
+"""
+import threading
+import time
+
+from em_store.db import autocommit_connection
+
+from .models import SendLog
+
+STEP_CAMPAIGN = 0
+
+TABLE = SendLog._meta.db_table
+
+# One statement per batch: the ids (and statuses) are bound as arrays and
+# expanded into rows with unnest(), which binds far faster than a VALUES
+# tuple per row
+CLAIM_SQL = (
+    f'INSERT INTO {TABLE} (campaign_id, entry_id, step, status, updated_at) '
+    f'SELECT %s, unnest(%s::integer[]), %s, {SendLog.STATUS_SENDING}, now() '
+    'ON CONFLICT (campaign_id, entry_id, step) DO UPDATE SET '
+    'status = EXCLUDED.status, updated_at = EXCLUDED.updated_at '
+    f'WHERE {TABLE}.status = {SendLog.STATUS_DEFERRED} '
+    'RETURNING entry_id'
+)
+
+RECORD_SQL = (
+    f'INSERT INTO {TABLE} (campaign_id, entry_id, step, status, updated_at) '
+    'SELECT %s, entry_id, %s, status, now() FROM unnest(%s::integer[], %s::smallint[]) AS t (entry_id, status) '
+    'ON CONFLICT (campaign_id, entry_id, step) DO UPDATE SET '
+    'status = EXCLUDED.status, updated_at = EXCLUDED.updated_at'
+)
+
+
+class SendLedger:
+    """The ledger rows of one campaign step. ``seconds`` is the time spent writing them."""
+
+    def __init__(self, campaign_id, step=STEP_CAMPAIGN):
+        self.campaign_id = campaign_id
+        self.step = step
+        self.seconds = 0.0
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def claim(self, entry_ids):
+        """
+        Claim ``entry_ids`` for sending. Returns ``(claimed, previous)``: the set
+        of ids that may be sent now, and the ledger status of every other id.
+        """
+        # ON CONFLICT DO UPDATE may only touch a row once per statement
+        entry_ids = list(dict.fromkeys(entry_ids))
+        previous = {}
+        if not entry_ids:
+            return set(), previous
+        started = time.monotonic()
+        wrapper = autocommit_connection()
+        with wrapper.wrap_database_errors, wrapper.connection.cursor() as cursor:
+            cursor.execute(CLAIM_SQL, [self.campaign_id, entry_ids, self.step])
+            claimed = {row[0] for row in cursor.fetchall()}
+            skipped = [entry_id for entry_id in entry_ids if entry_id not in claimed]
+            if skipped:
+                cursor.execute(
+                    f'SELECT entry_id, status FROM {TABLE} '
+                    'WHERE campaign_id = %s AND step = %s AND entry_id = ANY(%s)',
+                    [self.campaign_id, self.step, skipped],
+                )
+                previous = dict(cursor.fetchall())
+        self.seconds += time.monotonic() - started
+        return claimed, previous
+
+    def record(self, entry_id, status):
+        """Buffer the outcome of a claimed message. Safe to call from any thread."""
+        with self._lock:
+            self._pending.append((entry_id, status))
+
+    def flush(self):
+        """Write the buffered outcomes."""
+        with self._lock:
+            pending, self._pending = dict(self._pending), []
+        if not pending:
+            return
+        started = time.monotonic()
+        wrapper = autocommit_connection()
+        with wrapper.wrap_database_errors, wrapper.connection.cursor() as cursor:
+            cursor.execute(RECORD_SQL, [self.campaign_id, self.step, list(pending), list(pending.values())])
+        self.seconds += time.monotonic() - started
+
+    def release(self, entry_ids):
+        """Drop the claims of ``entry_ids`` whose message was never attempted, so a later run sends it."""
+        entry_ids = list(entry_ids)
+        if not entry_ids:
+            return
+        started = time.monotonic()
+        wrapper = autocommit_connection()
+        with wrapper.wrap_database_errors, wrapper.connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {TABLE} WHERE campaign_id = %s AND step = %s AND entry_id = ANY(%s) AND status = %s',
+                [self.campaign_id, self.step, entry_ids, SendLog.STATUS_SENDING],
+            )
+        self.seconds += time.monotonic() - started
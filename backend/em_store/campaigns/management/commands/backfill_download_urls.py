@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from campaigns.models import CampaignEmailAttachment
+from em_store.storage_utils import public_url
+from unread_emails.models import UnreadEmailAttachment
+
+
+class Command(BaseCommand):
+    help = 'Store the public download URL on campaign and unread email attachments in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows updated per statement')
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Rewrite every stored URL, e.g. after changing R2_PUBLIC_BASE_URL',
+        )
+
+    def _backfill(self, model, batch_size, rewrite):
+        queryset = model.objects.exclude(file='').exclude(file__isnull=True)
+        if not rewrite:
+            queryset = queryset.filter(Q(download_url__isnull=True) | Q(download_url=''))
+
+        updated, batch = 0, []
+        for attachment in queryset.only('id', 'file', 'download_url').order_by('id').iterator(chunk_size=batch_size):
+            url = public_url(attachment.file.name)
+            if url == attachment.download_url:
+                continue
+            attachment.download_url = url
+            batch.append(attachment)
+            if len(batch) >= batch_size:
+                updated += model.objects.bulk_update(batch, ['download_url'])
+                batch = []
+        if batch:
+            updated += model.objects.bulk_update(batch, ['download_url'])
+
+        self.stdout.write(f'{model._meta.label}: updated {updated} attachment URLs')
+        return updated
+
+    def handle(self, *args, **options):
+        total = sum(
+            self._backfill(model, options['batch_size'], options['all'])
+            for model in (CampaignEmailAttachment, UnreadEmailAttachment)
+        )
+        self.stdout.write(self.style.SUCCESS(f'Successfully updated {total} attachment URLs'))
@@ -0,0 +1,103 @@
+import time
+
+import boto3
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from campaigns.models import CampaignEmailAttachment
+from em_store.storage_backends import R2MediaStorage
+
+BUCKET = 'bench-attachments'
+
+
+class _Rollback(Exception):
+    pass
+
+
+class BenchR2Storage(R2MediaStorage):
+    """R2 media storage backed by moto, with a fixed delay added to every S3 request."""
+    bucket_name = BUCKET
+    endpoint_url = None
+    region_name = 'us-east-1'
+    access_key = 'testing'
+    secret_key = 'testing'
+    latency = 0.0
+
+    def _create_session(self):
+        session = super()._create_session()
+        session.events.register('before-sign.s3', lambda **kwargs: time.sleep(self.latency))
+        return session
+
+
+class Command(BaseCommand):
+    help = 'Measure campaign create latency with attachments uploaded serially and in parallel (moto S3 stand-in)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=10, help='Attachments per request')
+        parser.add_argument('--size-kb', type=int, default=256, help='Size of each attachment in KB')
+        parser.add_argument('--latency-ms', type=float, default=80, help='Simulated round trip per S3 request')
+        parser.add_argument('--requests', type=int, default=5, help='Timed requests per mode, after one warm-up')
+
+    def _files(self, count, size):
+        return [
+            SimpleUploadedFile(f'bench-{i}.pdf', b'%PDF' + b'x' * size, content_type='application/pdf')
+            for i in range(count)
+        ]
+
+    def _post(self, client, options):
+        data = {
+            'name': 'benchmark', 'subject': 'Benchmark', 'body': '<p>Benchmark</p>',
+            'email': 'sender@example.com',
+            'uploaded_files': self._files(options['files'], options['size_kb'] * 1024),
+        }
+        started = time.perf_counter()
+        response = client.post('/api/campaigns/', data, format='multipart')
+        elapsed = time.perf_counter() - started
+        if response.status_code != 201:
+            raise CommandError(f"Campaign create failed: {response.status_code} {response.content[:500]!r}")
+        created = CampaignEmailAttachment.objects.filter(email_campaign_id=response.data['id']).count()
+        if created != options['files']:
+            raise CommandError(f"Expected {options['files']} attachments, got {created}")
+        return elapsed
+
+    def _measure(self, label, workers, options):
+        # Every run happens in a transaction that is rolled back, leaving no rows behind
+        try:
+            with override_settings(R2_UPLOAD_MAX_WORKERS=workers), transaction.atomic():
+                user = get_user_model().objects.create_user(username=f'bench-{time.time_ns()}', password='x')
+                client = APIClient(HTTP_HOST='localhost')
+                client.force_authenticate(user)
+                self._post(client, options)  # warm-up: opens the R2 clients
+                timings = sorted(self._post(client, options) for _ in range(options['requests']))
+                raise _Rollback
+        except _Rollback:
+            pass
+        median = timings[len(timings) // 2]
+        self.stdout.write(
+            f"{label:<24} {options['files']:>3} attachments  median {median * 1000:8.1f} ms  "
+            f"max {timings[-1] * 1000:8.1f} ms"
+        )
+        return median
+
+    def handle(self, *args, **options):
+        try:
+            from moto import mock_aws
+        except ImportError:
+            raise CommandError("This benchmark requires moto (pip install 'moto[s3]')")
+
+        BenchR2Storage.latency = options['latency_ms'] / 1000
+        storages = {
+            'default': {'BACKEND': f'{__name__}.BenchR2Storage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        }
+        with mock_aws(), override_settings(STORAGES=storages):
+            boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET)
+            workers = getattr(settings, 'R2_UPLOAD_MAX_WORKERS', 4)
+            serial = self._measure('serial (1 worker)', 1, options)
+            parallel = self._measure(f'parallel ({workers} workers)', workers, options)
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {serial / parallel:.1f}x"))
@@ -0,0 +1,83 @@
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.utils import timezone
+
+from campaigns import mime
+from campaigns.delivery import CampaignSender
+from campaigns.models import CampaignEmailAttachment, EmailCampaign, SendLog
+from campaigns.smtp_sink import LocalSMTPSink
+from email_entry.models import EmailEntry
+
+
+class Command(BaseCommand):
+    help = 'Benchmark campaign delivery against a local SMTP sink and report messages/second'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=5000, help='Number of recipients to send to')
+        parser.add_argument('--workers', type=int, default=8, help='Number of sender worker threads')
+        parser.add_argument('--body-size', type=int, default=4096, help='Approximate HTML body size in bytes')
+        parser.add_argument('--attachments', type=int, default=0, help='Number of attachments per message')
+        parser.add_argument('--attachment-size', type=int, default=256 * 1024, help='Size of each attachment in bytes')
+        parser.add_argument('--ledger', action='store_true', help='Record every message in the send ledger')
+
+    def _attachments(self, directory, count, size):
+        """Write ``count`` files into ``directory`` and return unsaved attachment rows for them."""
+        attachments = []
+        for i in range(count):
+            name = f'attachment{i}.bin'
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(os.urandom(size))
+            attachments.append(CampaignEmailAttachment(
+                id=i, file=name, original_filename=name, content_type='application/octet-stream',
+                file_size=size, updated_at=timezone.now(),
+            ))
+        return attachments
+
+    def handle(self, *args, **options):
+        count = options['messages']
+        body = '<p>' + ('Lorem ipsum dolor sit amet. ' * (options['body_size'] // 28 + 1)) + '</p>'
+
+        directory = tempfile.TemporaryDirectory()
+        # Attachments are read from a local directory instead of R2
+        storages = override_settings(MEDIA_ROOT=directory.name, STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        with directory, storages, LocalSMTPSink() as sink:
+            attachments = self._attachments(directory.name, options['attachments'], options['attachment_size'])
+            # Unsaved objects: apart from the ledger, the benchmark never touches the database
+            campaign = EmailCampaign(
+                name='benchmark', subject='Benchmark message', body=body,
+                email='sender@example.com', provider='custom',
+                smtp_host=sink.host, smtp_port=sink.port, use_ssl=False,
+            )
+            recipients = (
+                EmailEntry(id=i, name=f'Recipient {i}', email=f'user{i}@example.com')
+                for i in range(count)
+            )
+            # Measures the delivery engine itself, so provider rate limits are off
+            sender = CampaignSender(
+                campaign, max_workers=options['workers'], attachments=attachments, rate_limit=False,
+            )
+            if options['ledger']:
+                # No campaign has a negative id, so the benchmark's rows can't collide with real ones
+                campaign.id = -os.getpid()
+            try:
+                summary = sender.send(recipients, step=0 if options['ledger'] else None)
+            finally:
+                if options['ledger']:
+                    SendLog.objects.filter(campaign_id=campaign.id).delete()
+
+        elapsed = summary['elapsed'] or 1e-9
+        self.stdout.write(f"Sent:     {summary['sent']}")
+        self.stdout.write(f"Failed:   {summary['failed']}")
+        self.stdout.write(f"Received: {sink.handler.messages}")
+        self.stdout.write(f"Elapsed:  {elapsed:.2f}s")
+        if 'ledger' in summary:
+            self.stdout.write(f"Ledger:   {summary['ledger']:.2f}s ({summary['ledger'] / elapsed:.1%} of send time)")
+        self.stdout.write(f"Message:  {sender.template.shared_size / 1024:.0f} KiB shared, "
+                          f"{mime.part_cache.size / 1024:.0f} KiB of encoded attachments cached")
+        self.stdout.write(self.style.SUCCESS(f"Throughput: {summary['sent'] / elapsed:.0f} messages/second"))
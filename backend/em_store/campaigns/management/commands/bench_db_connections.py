@@ -0,0 +1,85 @@
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import RequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from campaigns.models import EmailCampaign
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare p50/p99 latency of GET /api/campaigns/ with a new database connection per request '
+        '(CONN_MAX_AGE=0) and with persistent connections'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Timed requests per mode')
+        parser.add_argument('--campaigns', type=int, default=20, help='Campaigns owned by the benchmark user')
+        parser.add_argument('--max-age', type=int, default=600, help='CONN_MAX_AGE for the persistent mode')
+
+    def _percentile(self, timings, fraction):
+        return timings[min(len(timings) - 1, int(len(timings) * fraction))] * 1000
+
+    def _run(self, handler, environ, count, max_age, health_checks):
+        """Send ``count`` requests through the WSGI handler, as gunicorn would."""
+        settings_dict = connections.settings['default']
+        settings_dict['CONN_MAX_AGE'] = max_age
+        settings_dict['CONN_HEALTH_CHECKS'] = health_checks
+        connections['default'].close()
+
+        def request():
+            response = handler(environ(), lambda status, headers: None)
+            # Closing the response sends request_finished, which closes or keeps the connection
+            response.close()
+            if response.status_code != 200:
+                raise CommandError(f"GET /api/campaigns/ failed: {response.status_code}")
+
+        for _ in range(20):  # warm-up
+            request()
+        timings = []
+        for _ in range(count):
+            started = time.perf_counter()
+            request()
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        return self._percentile(timings, 0.5), self._percentile(timings, 0.99)
+
+    def handle(self, *args, **options):
+        original = dict(connections.settings['default'])
+        user = User.objects.create_user(username=f'bench-{uuid.uuid4().hex[:12]}', password=uuid.uuid4().hex)
+        try:
+            EmailCampaign.objects.bulk_create([
+                EmailCampaign(
+                    name=f'Bench {i}', subject='Hi', body='<p>Hi</p>',
+                    email=f'bench{i}@example.com', created_by=user,
+                )
+                for i in range(options['campaigns'])
+            ])
+            token = str(RefreshToken.for_user(user).access_token)
+            factory = RequestFactory()
+
+            def environ():
+                return factory.get('/api/campaigns/', HTTP_AUTHORIZATION=f'Bearer {token}', HTTP_HOST='localhost').environ
+
+            handler = WSGIHandler()
+            modes = (
+                ('new connection per request', 0, False),
+                (f'persistent (CONN_MAX_AGE={options["max_age"]})', options['max_age'], False),
+                ('persistent + health checks', options['max_age'], True),
+            )
+            self.stdout.write(f"{options['requests']} requests per mode, {options['campaigns']} campaigns")
+            for label, max_age, health_checks in modes:
+                p50, p99 = self._run(handler, environ, options['requests'], max_age, health_checks)
+                self.stdout.write(f"{label:<32} p50 {p50:7.2f} ms   p99 {p99:7.2f} ms")
+        finally:
+            connections['default'].close()
+            connections.settings['default'].clear()
+            connections.settings['default'].update(original)
+            EmailCampaign.objects.filter(created_by=user).delete()
+            user.delete()
+        self.stdout.write(self.style.SUCCESS('Done'))
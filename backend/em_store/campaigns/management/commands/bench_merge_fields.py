@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from campaigns.merge import MergeTemplate
+from email_entry.models import EmailEntry
+
+
+class Command(BaseCommand):
+    help = 'Benchmark merge-field rendering of a campaign subject and body and report renders/second'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=100000, help='Number of recipients to render for')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Recipients per render_many call')
+        parser.add_argument('--body-size', type=int, default=4096, help='Approximate HTML body size in bytes')
+
+    def handle(self, *args, **options):
+        count, batch_size = options['recipients'], options['batch_size']
+        paragraph = '<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * (options['body_size'] // 60 + 1)
+        subject = MergeTemplate('{{ first_name|default:"Hello" }}, your weekly update')
+        body = MergeTemplate(
+            '<p>Hi {{ first_name|default:"there" }},</p>' + paragraph
+            + '<p>You are receiving this as {{ email }}. Not {{ name }}?</p>',
+            html=True,
+        )
+        # Unsaved entries: the benchmark never touches the database
+        entries = [EmailEntry(id=i, name=f'Recipient {i} Example', email=f'user{i}@example.com') for i in range(count)]
+
+        started = time.perf_counter()
+        for entry in entries:
+            subject.render(entry)
+            body.render(entry)
+        single = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            batch = entries[offset:offset + batch_size]
+            subject.render_many(batch)
+            body.render_many(batch)
+        batched = time.perf_counter() - started
+
+        self.stdout.write(f"Recipients: {count}, body {len(body.source)} characters, {len(body.fields)} fields")
+        self.stdout.write(f"render:      {count / single:10.0f} renders/second (subject + body)")
+        self.stdout.write(self.style.SUCCESS(
+            f"render_many: {count / batched:10.0f} renders/second (subject + body, batches of {batch_size})"
+        ))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from campaigns import ratelimit
+from campaigns.models import SendBucket
+
+
+class Command(BaseCommand):
+    help = 'Show how far each sending account is from its provider send limits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', help='Only show this sending address')
+
+    def handle(self, *args, **options):
+        accounts = SendBucket.objects.values_list('account', 'provider').distinct().order_by('account', 'provider')
+        if options['account']:
+            accounts = accounts.filter(account=options['account'].lower())
+        rows = 0
+        for account, provider in accounts:
+            for limit in ratelimit.headroom(account, provider):
+                rows += 1
+                self.stdout.write(
+                    f"{account:<40} {provider:<10} {limit['used']:>6}/{limit['limit']:<6} per {limit['period']:<6} "
+                    f"{limit['available']:>6} left, full in {limit['full_in']:.0f}s"
+                )
+        if not rows:
+            self.stdout.write('No account has sent yet')
+        self.stdout.write(self.style.SUCCESS('Done'))
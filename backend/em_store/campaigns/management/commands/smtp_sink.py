@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from campaigns.smtp_sink import FaultInjectingHandler, LocalSMTPSink
+
+
+class Command(BaseCommand):
+    help = 'Run a local SMTP server that accepts and counts messages (for development)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+        parser.add_argument('--port', type=int, default=1025, help='Port to listen on')
+        parser.add_argument('--delay', type=float, default=0.0, help='Seconds to wait before answering each message')
+        parser.add_argument('--defer-rate', type=float, default=0.0, help='Fraction of messages to defer with a 451')
+
+    def handle(self, *args, **options):
+        handler = None
+        if options['delay'] or options['defer_rate']:
+            handler = FaultInjectingHandler(delay=options['delay'], defer_rate=options['defer_rate'])
+        sink = LocalSMTPSink(host=options['host'], port=options['port'], handler=handler).start()
+        self.stdout.write(self.style.SUCCESS(f"SMTP sink listening on {sink.host}:{sink.port} (Ctrl+C to stop)"))
+        try:
+            while True:
+                time.sleep(5)
+                self.stdout.write(f"Received {sink.handler.messages} messages")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sink.stop()
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:18
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0006_campaignemailattachment_client'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emailcampaign',
+            index=models.Index(django.db.models.functions.text.Upper('email'), name='campaign_email_upper_idx'),
+        ),
+    ]
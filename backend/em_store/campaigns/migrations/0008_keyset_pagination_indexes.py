@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0007_email_upper_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='campaignemailattachment',
+            index=models.Index(fields=['email_campaign', 'created_at', 'id'], name='campaign_att_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emailcampaign',
+            index=models.Index(fields=['created_by', 'created_at', 'id'], name='campaign_owner_created_idx'),
+        ),
+    ]
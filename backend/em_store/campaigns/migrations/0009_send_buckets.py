@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0008_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SendBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(help_text='Sending email address (lowercased)', max_length=254)),
+                ('provider', models.CharField(help_text='Provider the limits come from', max_length=50)),
+                ('period', models.PositiveIntegerField(help_text='Refill period in seconds')),
+                ('capacity', models.PositiveIntegerField(help_text='Messages allowed per period')),
+                ('tokens', models.FloatField(help_text='Messages available as of updated_at')),
+                ('updated_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Send Bucket',
+                'verbose_name_plural': 'Send Buckets',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='sendbucket',
+            constraint=models.UniqueConstraint(fields=('account', 'provider', 'period'), name='send_bucket_unique'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0009_send_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SendLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('campaign_id', models.BigIntegerField()),
+                ('entry_id', models.IntegerField()),
+                ('step', models.SmallIntegerField()),
+                ('status', models.SmallIntegerField(choices=[(1, 'Sending'), (2, 'Sent'), (3, 'Failed'), (4, 'Deferred')])),
+                ('updated_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Send Log Entry',
+                'verbose_name_plural': 'Send Log',
+                'db_table': 'send_log',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='sendlog',
+            constraint=models.UniqueConstraint(fields=('campaign_id', 'entry_id', 'step'), name='send_log_unique'),
+        ),
+    ]
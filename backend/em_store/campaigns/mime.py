@@ -0,0 +1,262 @@
+"""
+Message assembly for campaign sends.
+
+Everything in a campaign message that is the same for every recipient (the
+Subject/From headers, the text/HTML alternative unless it uses merge fields,
+and the attachments) is encoded once per send run into a MessageTemplate. A recipient's message is
+then their own To/Date/Message-ID header block followed by those shared
+bytes. The shared part is CRLF-normalised and dot-stuffed once, and
+``send_chunks`` writes it to the SMTP socket as it is, so per recipient only
+the small header block is built; attachment bytes are never copied again.
+
+Attachments are read from storage and base64-encoded in fixed-size chunks.
+The encoded MIME parts are kept in ``part_cache``, an LRU bounded to
+CAMPAIGN_MIME_CACHE_BYTES, so a drip tick or a retried run in the same
+worker does not fetch them again. Memory therefore grows with the size of
+the attachments, never with the number of recipients.
+"""
+import base64
+import logging
+import re
+import smtplib
+import threading
+import uuid
+from collections import OrderedDict
+from email import policy
+from email.message import EmailMessage, MIMEPart
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .merge import MergeTemplate
+
+logger = logging.getLogger(__name__)
+
+CRLF = b'\r\n'
+# base64 line length is 76 characters, i.e. 57 input bytes; read whole lines at a time
+ENCODE_CHUNK_SIZE = 57 * 1024
+
+# Columns read from CampaignEmailAttachment
+ATTACHMENT_FIELDS = ('id', 'email_campaign', 'file', 'original_filename', 'content_type', 'file_size', 'updated_at')
+
+
+def _dot_stuff(data):
+    """Apply SMTP transparency (RFC 5321 4.5.2): double a leading '.' on every line."""
+    data = re.sub(rb'(?:\r\n|\n|\r(?!\n))', CRLF, data)
+    return re.sub(rb'(?m)^\.', b'..', data)
+
+
+def _fold(name, value):
+    """Fold and RFC 2047-encode one header for the wire."""
+    return policy.SMTP.header_factory(name, value).fold(policy=policy.SMTP).encode('utf-8')
+
+
+def encode_attachment(fileobj, filename, content_type):
+    """Return the complete base64 MIME part (headers and body) for an attachment stream."""
+    headers = EmailMessage(policy=policy.SMTP)
+    headers['Content-Type'] = content_type or 'application/octet-stream'
+    headers.set_param('name', filename)
+    headers['Content-Disposition'] = 'attachment'
+    headers.set_param('filename', filename, header='Content-Disposition')
+    headers['Content-Transfer-Encoding'] = 'base64'
+
+    encoded = bytearray(b''.join(policy.SMTP.fold_binary(name, value) for name, value in headers.items()))
+    encoded += CRLF
+    while True:
+        chunk = fileobj.read(ENCODE_CHUNK_SIZE)
+        if not chunk:
+            break
+        encoded += base64.encodebytes(chunk).replace(b'\n', CRLF)
+    return bytes(encoded)
+
+
+class PartCache:
+    """
+    Process-wide LRU of encoded attachment parts, bounded by their total size.
+
+    Entries are keyed on the storage key, size and update time of the
+    attachment, so a replaced file is fetched again. Parts bigger than the
+    whole cache are returned without being cached.
+    """
+
+    def __init__(self, max_bytes=None):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes or getattr(settings, 'CAMPAIGN_MIME_CACHE_BYTES', 64 * 1024 * 1024)
+
+    @staticmethod
+    def _key(attachment):
+        return (attachment.file.name, attachment.file_size, attachment.updated_at)
+
+    def get_part(self, attachment):
+        """Return the encoded MIME part of ``attachment``, fetching it from storage on a miss."""
+        from em_store import metrics
+
+        key = self._key(attachment)
+        with self._lock:
+            part = self._entries.get(key)
+            if part is not None:
+                self._entries.move_to_end(key)
+                metrics.CACHE_REQUESTS.inc(('mime_parts', 'hit'))
+                return part
+        metrics.CACHE_REQUESTS.inc(('mime_parts', 'miss'))
+
+        with default_storage.open(attachment.file.name, 'rb') as fileobj:
+            part = encode_attachment(fileobj, attachment.original_filename, attachment.content_type)
+        logger.debug("Encoded attachment %s (%d bytes as MIME)", attachment.file.name, len(part))
+
+        if len(part) <= self.max_bytes:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = part
+                    self._size += len(part)
+                while self._size > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._size -= len(evicted)
+        return part
+
+    @property
+    def size(self):
+        """Total bytes of the cached parts."""
+        return self._size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+part_cache = PartCache()
+
+
+class MessageTemplate:
+    """
+    The pre-encoded, recipient-independent parts of a campaign message.
+
+    ``chunks(headers, entry)`` returns the byte strings making up one
+    recipient's message, ready for ``send_chunks``; ``render`` joins them.
+    When the subject or body use merge fields (see campaigns/merge.py), the
+    subject and text/HTML body are rendered and encoded per recipient; the
+    attachment parts are still shared.
+    """
+
+    def __init__(self, subject, from_addr, text, html, attachment_parts=()):
+        self.subject = MergeTemplate(subject)
+        self.text = MergeTemplate(text)
+        self.html = MergeTemplate(html, html=True)
+        self.personalized = not (self.subject.is_static and self.text.is_static and self.html.is_static)
+        self.from_header = _fold('From', from_addr)
+
+        if attachment_parts:
+            boundary = f'=_{uuid.uuid4().hex}'
+            self._mime_head = (
+                b'MIME-Version: 1.0\r\n'
+                + f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n\r\n--{boundary}\r\n'.encode()
+            )
+            delimiter = f'\r\n--{boundary}\r\n'.encode()
+            self.attachments = []
+            for part in attachment_parts:
+                # Base64 lines never start with '.', so the parts need no stuffing
+                self.attachments.append(delimiter)
+                self.attachments.append(part)
+            self.attachments.append(f'\r\n--{boundary}--\r\n'.encode())
+        else:
+            self._mime_head = b'MIME-Version: 1.0\r\n'
+            self.attachments = []
+
+        self._body = None if self.personalized else self._encode(subject, text, html)
+        self.shared_size = len(self._body or b'') + sum(len(chunk) for chunk in self.attachments)
+
+    def _encode(self, subject, text, html):
+        """Return the Subject/From headers and the encoded body, ready to follow the recipient headers."""
+        body = MIMEPart(policy=policy.SMTP)
+        body.set_content(text)
+        if html:
+            body.add_alternative(html, subtype='html')
+        encoded = _dot_stuff(self._mime_head + body.as_bytes())
+        if not self.attachments and not encoded.endswith(CRLF):
+            encoded += CRLF
+        return _fold('Subject', subject or '') + self.from_header + encoded
+
+    @classmethod
+    def for_campaign(cls, campaign, text, attachments=None):
+        """
+        Build the template of ``campaign``. ``attachments`` defaults to the
+        campaign's stored attachments (none for an unsaved campaign).
+        """
+        if attachments is None:
+            attachments = (
+                campaign.attachments.only(*ATTACHMENT_FIELDS).order_by('created_at', 'id')
+                if campaign.pk else []
+            )
+        parts = [part_cache.get_part(attachment) for attachment in attachments]
+        return cls(campaign.subject, campaign.email, text, campaign.body, parts)
+
+    def chunks(self, headers, entry=None):
+        """
+        Return the chunks of one message; ``headers`` is the recipient's header
+        block and ``entry`` the EmailEntry merge fields are read from.
+        """
+        if self.personalized:
+            body = self._encode(self.subject.render(entry), self.text.render(entry), self.html.render(entry))
+        else:
+            body = self._body
+        # The text/HTML body is small: send it in the same write as the headers
+        return [headers + body, *self.attachments]
+
+    def render(self, headers, entry=None):
+        return b''.join(self.chunks(headers, entry))
+
+
+def send_chunks(conn, from_addr, to_addrs, chunks):
+    """
+    ``smtplib.SMTP.sendmail`` for a message given as chunks that are already
+    CRLF-terminated and dot-stuffed. The chunks are written to the socket one
+    by one instead of being joined and re-scanned (the connection should
+    have TCP_NODELAY set, as the pool's connections do). Returns the dict of refused
+    recipients and raises the same exceptions as ``sendmail``.
+    """
+    conn.ehlo_or_helo_if_needed()
+    options = []
+    if conn.does_esmtp and conn.has_extn('size'):
+        options.append(f'size={sum(len(chunk) for chunk in chunks)}')
+    code, resp = conn.mail(from_addr, options)
+    if code != 250:
+        if code == 421:
+            conn.close()
+        else:
+            conn._rset()
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+
+    refused = {}
+    for addr in to_addrs:
+        code, resp = conn.rcpt(addr)
+        if code not in (250, 251):
+            refused[addr] = (code, resp)
+        if code == 421:
+            conn.close()
+            raise smtplib.SMTPRecipientsRefused(refused)
+    if len(refused) == len(to_addrs):
+        conn._rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    conn.putcmd('data')
+    code, resp = conn.getreply()
+    if code != 354:
+        raise smtplib.SMTPDataError(code, resp)
+    for chunk in chunks:
+        conn.send(chunk)
+    conn.send(b'.\r\n')
+    code, resp = conn.getreply()
+    if code != 250:
+        if code == 421:
+            conn.close()
+        else:
+            conn._rset()
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
@@ -1,31 +1,17 @@
 import os
 import uuid
 import logging
-import base64
-from django.db import models, connection
+from django.db import models
+from django.db.models.functions import Upper
 from django.conf import settings
 from django.core.validators import EmailValidator
-from cryptography.fernet import Fernet, InvalidToken
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from django.utils import timezone
+from em_store import crypto
 from em_store.storage_utils import upload_file_to_r2, delete_file_from_r2
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-def get_fernet_key():
-    salt = settings.SECRET_KEY[:16].encode()
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=100000,
-    )
-    key = base64.urlsafe_b64encode(kdf.derive(settings.SECRET_KEY.encode()))
-    return key
-
-
 def campaign_attachment_path(instance, filename):
     """Generate file path for campaign attachments"""
     ext = filename.split('.')[-1].lower()
@@ -118,6 +104,12 @@ class EmailCampaign(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Email Campaign'
         verbose_name_plural = 'Email Campaigns'
+        indexes = [
+            # Serves case-insensitive (email__iexact) lookups
+            models.Index(Upper('email'), name='campaign_email_upper_idx'),
+            # Keyset pagination of a user's campaigns (see em_store/pagination.py)
+            models.Index(fields=['created_by', 'created_at', 'id'], name='campaign_owner_created_idx'),
+        ]
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -131,8 +123,7 @@ class EmailCampaign(models.Model):
         # Encrypt password if it's new or changed
         if self.password and (not self.pk or self.password != self._password):
             try:
-                f = Fernet(get_fernet_key())
-                self.password = f.encrypt(self.password.encode()).decode()
+                self.password = crypto.encrypt(self.password)
             except Exception as e:
                 logger.error(f"Error encrypting password: {e}")
                 raise
@@ -143,8 +134,7 @@ class EmailCampaign(models.Model):
         if not self.password:
             return None
         try:
-            f = Fernet(get_fernet_key())
-            return f.decrypt(self.password.encode()).decode()
+            return crypto.credential_cache.get_password(self)
         except Exception as e:
             logger.error(f"Error decrypting password: {e}")
             return None
@@ -203,6 +193,9 @@ class CampaignEmailAttachment(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Campaign Attachment'
         verbose_name_plural = 'Campaign Attachments'
+        indexes = [
+            models.Index(fields=['email_campaign', 'created_at', 'id'], name='campaign_att_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.original_filename} (Campaign: {self.email_campaign.name})"
@@ -210,14 +203,14 @@ class CampaignEmailAttachment(models.Model):
     def save(self, *args, **kwargs):
         """Save the file to Cloudflare R2 and update file metadata."""
         is_new = not self.pk
-        file_changed = False
         
         # Set client_id to campaign ID if not set
         if not self.client_id and self.email_campaign_id:
             self.client_id = self.email_campaign_id
         
-        # Handle file upload to R2 for new attachments
-        if is_new and self.file:
+        # Handle file upload to R2 for new attachments (files already uploaded by
+        # create_attachments arrive as committed storage keys and are skipped)
+        if is_new and self.file and not self.file._committed:
             self.original_filename = os.path.basename(str(self.file))
             
             # Get content type from file if not set
@@ -230,24 +223,23 @@ class CampaignEmailAttachment(models.Model):
                     logger.error(f"Error detecting content type: {e}")
                     self.content_type = 'application/octet-stream'
             
-            # Read the file content
+            # Stream the file to R2 without reading it into memory
             try:
-                file_content = self.file.read()
-                self.file_size = len(file_content)
+                self.file_size = self.file.size
                 
                 # Upload to R2 with enhanced URL generation
                 upload_result = upload_file_to_r2(
-                    file_content,
+                    self.file.file,
                     file_name=os.path.basename(self.file.name),
                     content_type=self.content_type,
                     folder=f'campaigns/{self.email_campaign_id}/attachments'
                 )
                 
                 if upload_result['success']:
-                    # Store the R2 key and URL
-                    self.file.name = upload_result['key']
+                    # Store the R2 key and URL before the INSERT; assigning the key marks
+                    # the file as committed so the FileField doesn't upload it again
+                    self.file = upload_result['key']
                     self.download_url = upload_result['url']
-                    file_changed = True
                     logger.info(f"Successfully uploaded file to R2: {upload_result['key']}")
                     logger.info(f"Generated download URL: {upload_result['url']}")
                 else:
@@ -260,18 +252,6 @@ class CampaignEmailAttachment(models.Model):
         
         # Save the model
         super().save(*args, **kwargs)
-        
-        # Ensure sequence is in sync after saving
-        if is_new and self.pk:
-            self._ensure_sequence_sync()
-            
-        # If file was changed, update the URL in the database
-        if file_changed and self.pk:
-            CampaignEmailAttachment.objects.filter(pk=self.pk).update(
-                file=self.file.name,
-                download_url=self.download_url
-            )
-            logger.info(f"Updated attachment {self.pk} with download URL: {self.download_url}")
     
     def _generate_download_url(self):
         """Generate a download URL for this attachment from R2."""
@@ -295,41 +275,14 @@ class CampaignEmailAttachment(models.Model):
             return ""
         
     def get_download_url(self):
-        """Return the stored download URL or generate a new one."""
-        if not self.download_url and self.pk:
-            self.download_url = self._generate_download_url()
-            if self.download_url:
-                self.save(update_fields=['download_url'])
-                logger.info(f"Generated and stored download URL for attachment {self.pk}: {self.download_url}")
-        return self.download_url
-    
-    def _ensure_sequence_sync(self):
-        """Ensure the sequence is in sync with the max ID"""
-        try:
-            with connection.cursor() as cursor:
-                # Get current max ID
-                cursor.execute("SELECT MAX(id) FROM campaigns_campaignemailattachment;")
-                max_id = cursor.fetchone()[0] or 0
-                
-                # Get current sequence value
-                cursor.execute("SELECT last_value FROM campaigns_campaignemailattachment_id_seq;")
-                current_sequence = cursor.fetchone()[0]
-                
-                if max_id > current_sequence:
-                    new_sequence = max_id + 1
-                    logger.info(f"Updating sequence from {current_sequence} to {new_sequence}")
-                    
-                    # Set the sequence to max_id + 1
-                    cursor.execute(
-                        "SELECT setval('campaigns_campaignemailattachment_id_seq', %s, false);",
-                        [new_sequence]
-                    )
-                    return True
-                return False
-                    
-        except Exception as e:
-            logger.error(f"Error syncing sequence: {e}", exc_info=True)
-            return False
+        """
+        Return the public download URL, resolved from the file key.
+        Never writes: rows are backfilled with the backfill_download_urls command.
+        """
+        if self.file:
+            from em_store.storage_utils import public_url
+            return public_url(self.file.name)
+        return self.download_url or ""
     
     def delete(self, *args, **kwargs):
         """Delete the file from R2 when the model instance is deleted"""
@@ -343,6 +296,76 @@ class CampaignEmailAttachment(models.Model):
                 
         # Delete the model instance
         super().delete(*args, **kwargs)
-        
-        # Ensure sequence is still in sync after deletion
-        self._ensure_sequence_sync()
+
+        # Not a post_delete receiver: one would stop cascades from deleting attachments in bulk
+        from .cache import campaign_list_cache
+        owner_id = EmailCampaign.objects.filter(pk=self.email_campaign_id).values_list('created_by_id', flat=True).first()
+        if owner_id:
+            campaign_list_cache.invalidate(owner_id)
+
+
+class SendBucket(models.Model):
+    """
+    Token bucket limiting how fast one sending account may send (see campaigns/ratelimit.py).
+
+    An account has one row per limit of its provider, e.g. one per-minute and
+    one per-day bucket. ``tokens`` is the number of messages that could be
+    sent as of ``updated_at``; it refills at ``capacity`` per ``period``
+    seconds.
+    """
+    account = models.CharField(max_length=254, help_text="Sending email address (lowercased)")
+    provider = models.CharField(max_length=50, help_text="Provider the limits come from")
+    period = models.PositiveIntegerField(help_text="Refill period in seconds")
+    capacity = models.PositiveIntegerField(help_text="Messages allowed per period")
+    tokens = models.FloatField(help_text="Messages available as of updated_at")
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Send Bucket'
+        verbose_name_plural = 'Send Buckets'
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'provider', 'period'], name='send_bucket_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.account} ({self.provider}): {self.tokens:.1f}/{self.capacity} per {self.period}s"
+
+
+class SendLog(models.Model):
+    """
+    One row per message a campaign has attempted (see campaigns/ledger.py).
+
+    ``step`` is 0 for a campaign send and the 1-based drip step otherwise.
+    A row is claimed (SENDING) before its message is sent and never claimed
+    again unless the previous attempt was deferred, so a retried send skips
+    every recipient that may already have received it.
+    """
+    STATUS_SENDING = 1
+    STATUS_SENT = 2
+    STATUS_FAILED = 3
+    STATUS_DEFERRED = 4
+    STATUS_CHOICES = [
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_DEFERRED, 'Deferred'),
+    ]
+
+    # Plain ids rather than foreign keys: rows are written in bulk from the
+    # send path and must not slow down or block deleting campaigns and entries
+    campaign_id = models.BigIntegerField()
+    entry_id = models.IntegerField()
+    step = models.SmallIntegerField()
+    status = models.SmallIntegerField(choices=STATUS_CHOICES)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'send_log'
+        verbose_name = 'Send Log Entry'
+        verbose_name_plural = 'Send Log'
+        constraints = [
+            models.UniqueConstraint(fields=['campaign_id', 'entry_id', 'step'], name='send_log_unique'),
+        ]
+
+    def __str__(self):
+        return f"Campaign {self.campaign_id} entry {self.entry_id} step {self.step}: {self.get_status_display()}"
@@ -0,0 +1,235 @@
+"""
+Per-account send rate limits.
+
+Providers lock accounts that send faster than they allow, and every provider
+allows something different. Each sending account (email address + provider)
+gets one token bucket per limit of its provider, e.g. 20 per minute and 500
+per day for Gmail. A message may only be sent with a token from every one
+of the account's buckets.
+
+The buckets are rows of SendBucket, so every worker process and the drip
+scheduler draw from the same budget. Updates to one account's buckets are
+serialised with a Postgres transaction-level advisory lock. Senders take
+tokens in small batches (``AccountThrottle``) rather than one query per
+message, and give back what they did not use when the run ends, so an
+account is driven right up to its limit but never past it.
+
+Limits come from DEFAULT_RATE_LIMITS, overridden per provider by the
+CAMPAIGN_RATE_LIMITS setting. ``headroom()`` reports how far an account is
+from each of its ceilings.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from em_store.db import autocommit_connection
+
+from .models import SendBucket
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+
+# Messages per period, by provider. Conservative published/observed limits
+# for personal accounts; override them with CAMPAIGN_RATE_LIMITS.
+DEFAULT_RATE_LIMITS = {
+    'gmail': {'minute': 20, 'day': 500},
+    'yahoo': {'minute': 10, 'day': 500},
+    'outlook': {'minute': 30, 'day': 300},
+    'cpanel': {'hour': 100, 'day': 1000},
+    'default': {'minute': 60},
+}
+
+
+class RateLimited(Exception):
+    """Raised when an account has no tokens left and the caller will not wait for them."""
+
+    def __init__(self, account, wait):
+        super().__init__(f"Send rate limit reached for {account}; next message allowed in {wait:.0f}s")
+        self.account = account
+        self.wait = wait
+
+
+def normalize_provider(provider):
+    return (provider or '').strip().lower() or 'default'
+
+
+def get_limits(provider):
+    """Return ``[(period_seconds, capacity), ...]`` for ``provider``."""
+    provider = normalize_provider(provider)
+    configured = {**DEFAULT_RATE_LIMITS, **getattr(settings, 'CAMPAIGN_RATE_LIMITS', {})}
+    limits = configured.get(provider, configured.get('default', {}))
+    return sorted((PERIODS[period], int(capacity)) for period, capacity in limits.items() if capacity)
+
+
+def _lock_id(account, provider):
+    # pg_advisory_xact_lock takes a signed 64-bit key
+    digest = hashlib.blake2b(f'send-bucket:{provider}:{account}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def _refill(tokens, updated_at, capacity, period, now):
+    elapsed = max((now - updated_at).total_seconds(), 0.0)
+    return min(float(capacity), tokens + elapsed * capacity / period)
+
+
+def _change(account, provider, update):
+    """
+    Lock the account's buckets, bring them up to date and apply ``update``,
+    a function of ``({period: tokens}, limits)`` returning the new tokens
+    and a result, which is returned.
+    """
+    account, provider = account.lower(), normalize_provider(provider)
+    limits = get_limits(provider)
+    # Not the default connection: callers such as the drip scheduler send inside a
+    # long transaction, and bucket changes must be visible to other processes (and
+    # the advisory lock released) as soon as they are made
+    wrapper = autocommit_connection()
+    with wrapper.wrap_database_errors, wrapper.connection.transaction(), wrapper.connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s), clock_timestamp()', [_lock_id(account, provider)])
+        now = cursor.fetchone()[1]
+        cursor.execute(
+            f'SELECT period, tokens, updated_at FROM {SendBucket._meta.db_table} WHERE account = %s AND provider = %s',
+            [account, provider],
+        )
+        stored = {period: (tokens, updated_at) for period, tokens, updated_at in cursor.fetchall()}
+        tokens = {
+            period: _refill(*stored[period], capacity, period, now) if period in stored else float(capacity)
+            for period, capacity in limits
+        }
+        tokens, result = update(tokens, limits)
+        if limits:
+            cursor.executemany(
+                f'INSERT INTO {SendBucket._meta.db_table} (account, provider, period, capacity, tokens, updated_at) '
+                'VALUES (%s, %s, %s, %s, %s, %s) '
+                'ON CONFLICT (account, provider, period) DO UPDATE SET '
+                'capacity = EXCLUDED.capacity, tokens = EXCLUDED.tokens, updated_at = EXCLUDED.updated_at',
+                [(account, provider, period, capacity, tokens[period], now) for period, capacity in limits],
+            )
+    return result
+
+
+def acquire(account, provider, count=1):
+    """
+    Take up to ``count`` tokens from every bucket of the account.
+
+    Returns ``(granted, wait)``: the number of messages that may be sent now
+    and, when none may, the seconds until the next one can.
+    """
+    def take(tokens, limits):
+        granted = min(count, math.floor(min(tokens.values(), default=count)))
+        if granted <= 0:
+            wait = max(
+                (1 - tokens[period]) * period / capacity
+                for period, capacity in limits if tokens[period] < 1
+            )
+            return tokens, (0, wait)
+        return {period: value - granted for period, value in tokens.items()}, (granted, 0.0)
+
+    return _change(account, provider, take)
+
+
+def release(account, provider, count):
+    """Give back ``count`` tokens taken with ``acquire`` but not used."""
+    if count <= 0:
+        return
+
+    def give_back(tokens, limits):
+        capacities = dict(limits)
+        return {period: min(float(capacities[period]), value + count) for period, value in tokens.items()}, None
+
+    _change(account, provider, give_back)
+
+
+def headroom(account, provider):
+    """
+    Return how far the account is from each of its limits, as a list of
+    ``{period, limit, available, used, full_in}`` dicts (``full_in`` is the
+    seconds until the bucket is full again). Reads only.
+    """
+    account, provider = account.lower(), normalize_provider(provider)
+    stored = {
+        bucket.period: bucket
+        for bucket in SendBucket.objects.filter(account=account, provider=provider)
+    }
+    now = timezone.now()
+    names = {seconds: name for name, seconds in PERIODS.items()}
+    report = []
+    for period, capacity in get_limits(provider):
+        bucket = stored.get(period)
+        available = _refill(bucket.tokens, bucket.updated_at, capacity, period, now) if bucket else float(capacity)
+        report.append({
+            'period': names[period],
+            'limit': capacity,
+            'available': math.floor(available),
+            'used': capacity - math.floor(available),
+            'full_in': round((capacity - available) * period / capacity, 1),
+        })
+    return report
+
+
+class AccountThrottle:
+    """
+    Paces one send run of an account.
+
+    ``wait()`` is called once per message, before it is handed to the
+    sending threads. Tokens are taken from the shared buckets in batches of
+    up to CAMPAIGN_RATE_LIMIT_BATCH, and never more than a tenth of the
+    smallest limit, so concurrent runs share an account fairly; ``close()``
+    gives back the unused ones.
+
+    ``max_wait`` is the longest ``wait()`` sleeps for a token; beyond it,
+    ``wait()`` raises RateLimited. None waits as long as it takes.
+    """
+
+    def __init__(self, account, provider, max_wait=None):
+        self.account = account
+        self.provider = provider
+        self.max_wait = max_wait
+        limits = get_limits(provider)
+        self.unlimited = not limits
+        self.batch_size = max(1, min(
+            getattr(settings, 'CAMPAIGN_RATE_LIMIT_BATCH', 20),
+            min((capacity for _, capacity in limits), default=1) // 10,
+        ))
+        self.throttled_seconds = 0.0
+        self._tokens = 0
+        self._closed = threading.Event()
+
+    def wait(self):
+        """Block until one more message may be sent."""
+        if self.unlimited:
+            return
+        while self._tokens == 0:
+            granted, wait = acquire(self.account, self.provider, self.batch_size)
+            if granted:
+                self._tokens = granted
+                break
+            if self.max_wait is not None and wait > self.max_wait:
+                raise RateLimited(self.account, wait)
+            logger.info("Send rate limit reached for %s; waiting %.1fs", self.account, wait)
+            started = time.monotonic()
+            if self._closed.wait(wait):
+                raise RateLimited(self.account, wait)
+            self.throttled_seconds += time.monotonic() - started
+        self._tokens -= 1
+
+    def stop(self):
+        """Interrupt a ``wait()`` in progress (from another thread); it raises RateLimited."""
+        self._closed.set()
+
+    def close(self):
+        """Give back the unused tokens."""
+        self.stop()
+        unused, self._tokens = self._tokens, 0
+        release(self.account, self.provider, unused)
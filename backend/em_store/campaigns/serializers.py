@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import EmailCampaign, CampaignEmailAttachment
+from .attachments import create_attachments
 
 class CampaignEmailAttachmentSerializer(serializers.ModelSerializer):
     download_url = serializers.SerializerMethodField()
@@ -58,27 +59,8 @@ class EmailCampaignSerializer(serializers.ModelSerializer):
         # Create the campaign first
         campaign = EmailCampaign.objects.create(**validated_data)
         
-        # Process each uploaded file
-        for file in uploaded_files:
-            try:
-                # Get file metadata safely
-                original_filename = getattr(file, 'name', 'unnamed_file')
-                content_type = getattr(file, 'content_type', 'application/octet-stream')
-                
-                # Create the attachment - let the model handle the R2 upload
-                CampaignEmailAttachment.objects.create(
-                    email_campaign=campaign,
-                    file=file,
-                    original_filename=original_filename,
-                    content_type=content_type,
-                    # file_size will be set by the model
-                )
-            except Exception as e:
-                # Log the error but don't fail the entire request
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.error(f"Error processing file {getattr(file, 'name', 'unknown')}: {str(e)}", exc_info=True)
-                # Optionally, you could collect these errors and include them in the response
+        # Upload the files in parallel and create their attachments
+        create_attachments(campaign, uploaded_files)
                 
         return campaign
         
@@ -0,0 +1,27 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from em_store.crypto import credential_cache
+from .cache import campaign_list_cache
+from .models import CampaignEmailAttachment, EmailCampaign
+
+
+@receiver([post_save, post_delete], sender=EmailCampaign)
+def invalidate_cached_credentials(sender, instance, **kwargs):
+    """Forget the decrypted password of a saved or deleted EmailCampaign."""
+    credential_cache.invalidate(instance)
+
+
+@receiver([post_save, post_delete], sender=EmailCampaign)
+def invalidate_campaign_list(sender, instance, **kwargs):
+    """Drop the owner's cached campaign list."""
+    if instance.created_by_id:
+        campaign_list_cache.invalidate(instance.created_by_id)
+
+
+@receiver(post_save, sender=CampaignEmailAttachment)
+def invalidate_campaign_list_for_attachment(sender, instance, **kwargs):
+    """The list nests attachments; deletes are handled in CampaignEmailAttachment.delete."""
+    owner_id = instance.email_campaign.created_by_id
+    if owner_id:
+        campaign_list_cache.invalidate(owner_id)
@@ -0,0 +1,110 @@
+"""
+Local SMTP stand-in for development and benchmarks.
+
+Accepts every message and only counts it, so delivery code can be exercised
+without a real mail server. ``FaultInjectingHandler`` makes it behave like
+an unhealthy server instead: slow, or deferring messages with 4xx replies.
+Requires the optional ``aiosmtpd`` package.
+"""
+import asyncio
+import random
+import socket
+import threading
+import warnings
+
+# aiosmtpd warns about its own internal use of this attribute on every login
+warnings.filterwarnings('ignore', message='Session.login_data is deprecated')
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class CountingHandler:
+    """aiosmtpd handler that discards messages and keeps simple counters."""
+
+    def __init__(self):
+        self.messages = 0
+        self.recipients = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        with self._lock:
+            self.messages += 1
+            self.recipients += len(envelope.rcpt_tos)
+            self.bytes += len(envelope.content or b'')
+        return '250 Message accepted'
+
+
+class FaultInjectingHandler(CountingHandler):
+    """
+    Counting handler that delays every message by ``delay`` seconds and
+    defers a ``defer_rate`` fraction of them with a 451 reply. Both can be
+    changed while the sink is running. Deferred messages are counted in
+    ``deferred`` only.
+    """
+
+    def __init__(self, delay=0.0, defer_rate=0.0):
+        super().__init__()
+        self.delay = delay
+        self.defer_rate = defer_rate
+        self.deferred = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.defer_rate and random.random() < self.defer_rate:
+            with self._lock:
+                self.deferred += 1
+            return '451 4.3.0 Temporary failure, try again later'
+        return await super().handle_DATA(server, session, envelope)
+
+
+def _accept_any_login(server, session, envelope, mechanism, auth_data):
+    from aiosmtpd.smtp import AuthResult
+    return AuthResult(success=True)
+
+
+class LocalSMTPSink:
+    """
+    Run a counting SMTP server on a background thread.
+    Any AUTH LOGIN/PLAIN credentials are accepted.
+
+    Usage::
+
+        with LocalSMTPSink() as sink:
+            ... send to ('127.0.0.1', sink.port) ...
+            print(sink.handler.messages)
+    """
+
+    def __init__(self, host='127.0.0.1', port=None, handler=None):
+        try:
+            from aiosmtpd.controller import Controller
+        except ImportError as e:
+            raise ImportError("The local SMTP sink requires the 'aiosmtpd' package") from e
+        self.host = host
+        self.port = port or _free_port()
+        self.handler = handler or CountingHandler()
+        self._controller = Controller(
+            self.handler,
+            hostname=self.host,
+            port=self.port,
+            authenticator=_accept_any_login,
+            auth_require_tls=False,
+        )
+
+    def start(self):
+        self._controller.start()
+        return self
+
+    def stop(self):
+        self._controller.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,29 @@
+"""
+Background job handlers for campaigns, run by ``manage.py run_workers``.
+"""
+import logging
+
+from jobs.queue import register
+from .delivery import CampaignSender
+from .ledger import STEP_CAMPAIGN
+from .models import EmailCampaign
+
+logger = logging.getLogger(__name__)
+
+
+@register('send_campaign')
+def send_campaign(job):
+    """
+    Deliver a campaign to its subscribed recipients, reporting progress on the job.
+    A retried job skips the recipients an earlier attempt already sent to.
+    """
+    campaign = EmailCampaign.objects.get(pk=job.payload['campaign_id'])
+    sender = CampaignSender(campaign)
+    job.update_progress(
+        total=campaign.email_entries.filter(unsubscribe=False).count(),
+        sent=0,
+        failed=0,
+    )
+    summary = sender.send(progress=job.update_progress, step=STEP_CAMPAIGN)
+    job.update_progress(sent=summary['sent'], failed=summary['failed'], skipped=summary['skipped'])
+    return summary
@@ -1,3 +1,864 @@
-from django.test import TestCase
+import email
+import io
+import smtplib
+import threading
+import unittest
+from datetime import timedelta
+from email import policy
+from unittest import mock
 
-# Create your tests here.
+import boto3
+import requests
+from boto3.s3.transfer import TransferConfig
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from em_store.crypto import credential_cache
+from em_store.db import autocommit_connection, close_autocommit_connection
+from em_store.storage_backends import R2MediaStorage
+from em_store.testing import QueryBudgetMixin
+from email_entry.drip import DripScheduler
+from email_entry.models import EmailEntry
+from unread_emails.models import UnreadEmail, UnreadEmailAttachment
+
+from . import hostcontrol, mime, ratelimit
+from .attachments import create_attachments
+from .cache import campaign_list_cache
+from .delivery import AlreadyAttempted, CampaignSender, SMTPConnectionPool
+from .ledger import SendLedger
+from .merge import MergeTemplate
+from .models import CampaignEmailAttachment, EmailCampaign, SendBucket, SendLog
+from .smtp_sink import CountingHandler, FaultInjectingHandler, LocalSMTPSink
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto is a development dependency
+    mock_aws = None
+
+try:
+    import aiosmtpd
+except ImportError:  # aiosmtpd is a development dependency
+    aiosmtpd = None
+
+BUCKET = 'test-attachments'
+
+class MotoR2Storage(R2MediaStorage):
+    """R2 media storage pointed at moto's in-process S3 instead of Cloudflare."""
+    bucket_name = BUCKET
+    endpoint_url = None
+    region_name = 'us-east-1'
+    access_key = 'testing'
+    secret_key = 'testing'
+    transfer_config = TransferConfig(
+        multipart_threshold=5 * 1024 * 1024,
+        multipart_chunksize=5 * 1024 * 1024,
+    )
+
+
+MOTO_STORAGES = {
+    'default': {'BACKEND': 'campaigns.tests.MotoR2Storage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+@unittest.skipIf(mock_aws is None, "moto is not installed")
+@override_settings(STORAGES=MOTO_STORAGES, R2_UPLOAD_MAX_WORKERS=4)
+class CreateAttachmentsTests(TestCase):
+    def setUp(self):
+        mock = mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=BUCKET)
+        self.campaign = EmailCampaign.objects.create(
+            name='Attachments', subject='Hi', body='<p>Hi</p>', email='sender@example.com'
+        )
+
+    def list_objects(self):
+        response = self.s3.list_objects_v2(Bucket=BUCKET)
+        return {item['Key']: item for item in response.get('Contents', [])}
+
+    def test_uploads_every_file_once(self):
+        files = [
+            SimpleUploadedFile(f'doc{i}.txt', f'content {i}'.encode(), content_type='text/plain')
+            for i in range(5)
+        ]
+        attachments = create_attachments(self.campaign, files)
+
+        self.assertEqual(len(attachments), 5)
+        objects = self.list_objects()
+        self.assertEqual(len(objects), 5)
+        for attachment in attachments:
+            attachment.refresh_from_db()
+            self.assertIn(f'media/{attachment.file.name}', objects)
+            self.assertTrue(attachment.download_url.endswith(attachment.file.name))
+            self.assertEqual(attachment.content_type, 'text/plain')
+
+    def test_one_insert_and_no_second_upload(self):
+        owner = get_user_model().objects.create_user(username='owner', password='x')
+        self.campaign.created_by = owner
+        self.campaign.save()
+        files = [
+            SimpleUploadedFile(f'doc{i}.txt', f'content {i}'.encode(), content_type='text/plain')
+            for i in range(5)
+        ]
+        table = CampaignEmailAttachment._meta.db_table
+        with mock.patch.object(MotoR2Storage, 'save', autospec=True, side_effect=MotoR2Storage.save) as save, \
+                mock.patch.object(CampaignEmailAttachment, 'save') as model_save, \
+                mock.patch.object(campaign_list_cache, 'invalidate') as invalidate, \
+                CaptureQueriesContext(connection) as queries:
+            attachments = create_attachments(self.campaign, files)
+
+        self.assertEqual(len(attachments), 5)
+        inserts = [query for query in queries if query['sql'].startswith(f'INSERT INTO "{table}"')]
+        self.assertEqual(len(inserts), 1)
+        # Each file went up once, in the upload step; the INSERT stores the committed keys
+        self.assertEqual(save.call_count, 5)
+        model_save.assert_not_called()
+        invalidate.assert_called_once_with(owner.pk)
+        self.assertEqual(CampaignEmailAttachment.objects.filter(email_campaign=self.campaign).count(), 5)
+
+    def test_large_file_uses_multipart_upload(self):
+        payload = b'x' * (6 * 1024 * 1024)
+        large = SimpleUploadedFile('large.bin', payload, content_type='application/octet-stream')
+        [attachment] = create_attachments(self.campaign, [large])
+
+        head = self.s3.head_object(Bucket=BUCKET, Key=f'media/{attachment.file.name}')
+        self.assertEqual(head['ContentLength'], len(payload))
+        # Multipart ETags carry the part count
+        self.assertTrue(head['ETag'].strip('"').endswith('-2'))
+        self.assertEqual(attachment.file_size, len(payload))
+
+
+@unittest.skipIf(mock_aws is None, "moto is not installed")
+@override_settings(STORAGES=MOTO_STORAGES)
+class AttachmentDownloadTests(TestCase):
+    PAYLOAD = bytes(range(100))
+
+    def setUp(self):
+        mock = mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET)
+        user = get_user_model().objects.create_user(username='owner', password='x')
+        campaign = EmailCampaign.objects.create(
+            name='Downloads', subject='Hi', body='<p>Hi</p>', email='sender@example.com', created_by=user,
+        )
+        [attachment] = create_attachments(campaign, [
+            SimpleUploadedFile('data.bin', self.PAYLOAD, content_type='application/octet-stream'),
+        ])
+        self.url = f'/api/campaigns/{campaign.pk}/attachments/{attachment.pk}/download/'
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def get(self, **headers):
+        return self.client.get(self.url, **headers)
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_full_download(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.content(response), self.PAYLOAD)
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('data.bin', response['Content-Disposition'])
+        self.assertTrue(response['ETag'])
+
+    def test_range_requests(self):
+        response = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.content(response), self.PAYLOAD[10:20])
+
+        response = self.get(HTTP_RANGE='bytes=-5')
+        self.assertEqual((response.status_code, response['Content-Range']), (206, 'bytes 95-99/100'))
+        self.assertEqual(self.content(response), self.PAYLOAD[-5:])
+
+        response = self.get(HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+    def test_conditional_requests(self):
+        etag = self.get()['ETag']
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # The range only applies to the version the client already has
+        response = self.get(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"some-older-version"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.content(response), self.PAYLOAD)
+        response = self.get(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+    @override_settings(ATTACHMENT_DOWNLOAD_REDIRECT=True, ATTACHMENT_SIGNED_URL_EXPIRY=60)
+    def test_redirects_to_a_signed_url(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 302)
+        location = response['Location']
+        self.assertIn(BUCKET, location)
+        self.assertIn('Signature', location)
+        self.assertIn('Expires', location)
+        self.assertIn('response-content-disposition=attachment', location)
+
+        # R2 (moto here) serves the file itself
+        self.assertEqual(requests.get(location).content, self.PAYLOAD)
+
+
+class CapturingHandler(CountingHandler):
+    """Sink handler that also keeps every received message."""
+
+    def __init__(self):
+        super().__init__()
+        self.received = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received.append(email.message_from_bytes(envelope.content, policy=policy.default))
+        return await super().handle_DATA(server, session, envelope)
+
+
+class RejectingHandler(CountingHandler):
+    """Sink handler that refuses recipients whose address starts with 'bad'."""
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('bad'):
+            return '550 5.1.1 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+
+@unittest.skipIf(aiosmtpd is None, "aiosmtpd is not installed")
+class CampaignDeliveryTests(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(hostcontrol.reset)
+
+    def test_rejected_recipient_keeps_the_connection(self):
+        with LocalSMTPSink(handler=RejectingHandler()) as sink:
+            campaign = EmailCampaign(
+                name='Rejects', subject='Hi', body='<p>Hi</p>', email='rejects@example.com',
+                provider='custom', smtp_host=sink.host, smtp_port=sink.port, use_ssl=False,
+            )
+            pool = SMTPConnectionPool()
+            recipients = [
+                EmailEntry(id=i, name='R', email=f'{"bad" if i % 2 else "good"}{i}@example.com')
+                for i in range(6)
+            ]
+            with mock.patch.object(pool, '_open', wraps=pool._open) as opened:
+                summary = CampaignSender(
+                    campaign, max_workers=1, pool=pool, attachments=[], rate_limit=False,
+                ).send(recipients)
+            pool.close_all()
+        self.assertEqual((summary['sent'], summary['failed']), (3, 3))
+        self.assertEqual(sink.handler.messages, 3)
+        # Refused recipients are not retried and don't cost a new connection and login
+        self.assertEqual(opened.call_count, 1)
+        self.assertIn('No such user', summary['errors'][0]['error'])
+
+
+@unittest.skipIf(mock_aws is None or aiosmtpd is None, "moto and aiosmtpd are not installed")
+@override_settings(STORAGES=MOTO_STORAGES, CAMPAIGN_RATE_LIMITS={'default': {}})
+class CampaignMessageAssemblyTests(TestCase):
+    def setUp(self):
+        mock = mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET)
+        mime.part_cache.clear()
+        self.addCleanup(mime.part_cache.clear)
+        self.sink = LocalSMTPSink(handler=CapturingHandler()).start()
+        self.addCleanup(self.sink.stop)
+        self.campaign = EmailCampaign.objects.create(
+            name='Assembly', subject='Héllo', body='<p>Hi</p>\n.hidden line\n',
+            email='sender@example.com', provider='custom',
+            smtp_host=self.sink.host, smtp_port=self.sink.port, use_ssl=False,
+        )
+        self.payloads = {'report.pdf': bytes(range(256)) * 300, 'notes.txt': b'.starts with a dot\n'}
+        create_attachments(self.campaign, [
+            SimpleUploadedFile(name, payload, content_type='application/pdf' if name.endswith('pdf') else 'text/plain')
+            for name, payload in self.payloads.items()
+        ])
+
+    def recipients(self, count):
+        return [EmailEntry(id=i, name=f'R {i}', email=f'r{i}@example.com') for i in range(count)]
+
+    def test_attachments_are_downloaded_once_and_received_intact(self):
+        with mock.patch.object(MotoR2Storage, '_open', autospec=True, side_effect=R2MediaStorage._open) as opened:
+            summary = CampaignSender(self.campaign, max_workers=2).send(self.recipients(20))
+            # A second run in the same process reuses the encoded parts
+            CampaignSender(self.campaign, max_workers=2).send(self.recipients(1))
+        self.assertEqual(summary['sent'], 20)
+        self.assertEqual(opened.call_count, 2)
+
+        self.assertEqual(len(self.sink.handler.received), 21)
+        for message in self.sink.handler.received:
+            self.assertEqual(message['Subject'], 'Héllo')
+            self.assertIn('.hidden line', message.get_body(('html',)).get_content())
+            received = {part.get_filename(): part.get_payload(decode=True) for part in message.iter_attachments()}
+            self.assertEqual(received, self.payloads)
+        self.assertEqual(
+            sorted(message['To'].addresses[0].addr_spec for message in self.sink.handler.received[:20]),
+            sorted(entry.email for entry in self.recipients(20)),
+        )
+
+    def test_replaced_attachment_is_fetched_again(self):
+        CampaignSender(self.campaign, max_workers=1).send(self.recipients(1))
+        attachment = self.campaign.attachments.get(original_filename='notes.txt')
+        attachment.file_size += 1
+        attachment.save()
+        with mock.patch.object(MotoR2Storage, '_open', autospec=True, side_effect=R2MediaStorage._open) as opened:
+            CampaignSender(self.campaign, max_workers=1).send(self.recipients(1))
+        self.assertEqual(opened.call_count, 1)
+
+    @override_settings(CAMPAIGN_MIME_CACHE_BYTES=1024)
+    def test_cache_is_bounded(self):
+        CampaignSender(self.campaign, max_workers=1).send(self.recipients(3))
+        self.assertLessEqual(mime.part_cache.size, 1024)
+        self.assertEqual(len(self.sink.handler.received), 3)
+
+
+class MergeTemplateTests(SimpleTestCase):
+    entry = EmailEntry(id=1, name='  Ada  King Lovelace ', email='ada@example.com')
+
+    def test_fills_known_fields_and_leaves_others(self):
+        template = MergeTemplate('Hi {{first_name}} {{ last_name }} <{{ email }}> {{ unknown }}')
+        self.assertEqual(template.fields, ['first_name', 'last_name', 'email'])
+        self.assertEqual(template.render(self.entry), 'Hi Ada Lovelace <ada@example.com> {{ unknown }}')
+
+    def test_defaults_and_html_escaping(self):
+        template = MergeTemplate('<p>Hi {{ first_name|default:"there & co" }}, {{ name }}</p>', html=True)
+        anonymous = EmailEntry(id=2, name='', email='x@example.com')
+        self.assertEqual(template.render(anonymous), '<p>Hi there &amp; co, </p>')
+        self.assertEqual(
+            template.render(EmailEntry(id=3, name='<b>Bob</b>', email='b@example.com')),
+            '<p>Hi &lt;b&gt;Bob&lt;/b&gt;, &lt;b&gt;Bob&lt;/b&gt;</p>',
+        )
+
+    def test_render_many_matches_render(self):
+        template = MergeTemplate('{{ name }}{{ email }}!')
+        entries = [EmailEntry(id=i, name=f'User {i}', email=f'u{i}@example.com') for i in range(50)]
+        self.assertEqual(template.render_many(entries), [template.render(entry) for entry in entries])
+        self.assertTrue(MergeTemplate('plain').is_static)
+        self.assertEqual(MergeTemplate('plain').render_many(entries[:2]), ['plain', 'plain'])
+
+    def test_personalized_campaign_message(self):
+        campaign = EmailCampaign(
+            name='Merge', subject='Welcome, {{ first_name }}', body='<p>Hi {{ name }}</p>\n.{{ email }}',
+            email='sender@example.com', provider='custom', smtp_host='localhost', smtp_port=25,
+        )
+        sender = CampaignSender(campaign, max_workers=1, attachments=[])
+        raw = sender.build_message(EmailEntry(id=1, name='Zoë Ng', email='zoe@example.com'))
+        # build_message returns wire bytes: undo the dot-stuffing before parsing
+        message = email.message_from_bytes(raw.replace(b'\r\n..', b'\r\n.'), policy=policy.default)
+        self.assertEqual(message['Subject'], 'Welcome, Zoë')
+        html = message.get_body(('html',)).get_content().replace('\r\n', '\n')
+        self.assertEqual(html, '<p>Hi Zoë Ng</p>\n.zoe@example.com\n')
+        self.assertIn(b'\r\n..zoe@example.com', raw)
+
+
+@override_settings(CAMPAIGN_RATE_LIMITS={'gmail': {'minute': 5}, 'slowhost': {'minute': 600, 'day': 3}})
+class SendRateLimitTests(TransactionTestCase):
+    """Buckets are written on their own connection, so these tests commit."""
+
+    def setUp(self):
+        self.addCleanup(close_autocommit_connection)
+
+    def test_tokens_run_out_and_refill(self):
+        self.assertEqual(ratelimit.acquire('Sender@example.com', 'Gmail', 3), (3, 0.0))
+        self.assertEqual(ratelimit.acquire('sender@example.com', 'gmail', 3)[0], 2)
+        granted, wait = ratelimit.acquire('sender@example.com', 'gmail')
+        self.assertEqual(granted, 0)
+        self.assertAlmostEqual(wait, 12, delta=0.5)
+
+        ratelimit.release('sender@example.com', 'gmail', 2)
+        [minute] = ratelimit.headroom('sender@example.com', 'gmail')
+        self.assertEqual((minute['period'], minute['limit'], minute['available'], minute['used']), ('minute', 5, 2, 3))
+        # Another account has its own buckets
+        self.assertEqual(ratelimit.acquire('other@example.com', 'gmail', 5)[0], 5)
+
+    def test_every_limit_applies(self):
+        self.assertEqual(ratelimit.acquire('a@example.com', 'slowhost', 10)[0], 3)
+        granted, wait = ratelimit.acquire('a@example.com', 'slowhost')
+        self.assertEqual(granted, 0)
+        self.assertGreater(wait, 60)
+
+    def test_concurrent_senders_never_exceed_the_limit(self):
+        granted = []
+
+        def take():
+            try:
+                for _ in range(5):
+                    granted.append(ratelimit.acquire('busy@example.com', 'gmail')[0])
+            finally:
+                close_autocommit_connection()
+
+        threads = [threading.Thread(target=take) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(granted), 5)
+
+    @unittest.skipIf(aiosmtpd is None, "aiosmtpd is not installed")
+    def test_sender_stops_at_the_limit_when_it_cannot_wait(self):
+        with LocalSMTPSink() as sink:
+            campaign = EmailCampaign(
+                name='Limited', subject='Hi', body='<p>Hi</p>', email='limited@example.com',
+                provider='gmail', smtp_host=sink.host, smtp_port=sink.port, use_ssl=False,
+            )
+            recipients = [EmailEntry(id=i, name='R', email=f'r{i}@example.com') for i in range(8)]
+            with self.assertRaises(ratelimit.RateLimited):
+                CampaignSender(campaign, max_workers=2, attachments=[], max_rate_wait=1).send(recipients)
+        self.assertEqual(sink.handler.messages, 5)
+        self.assertLess(SendBucket.objects.get(account='limited@example.com').tokens, 1)
+
+    def test_rate_limit_endpoint(self):
+        user = get_user_model().objects.create_user(username='owner', password='x')
+        campaign = EmailCampaign.objects.create(
+            name='Mine', subject='Hi', body='<p>Hi</p>', email='mine@example.com', provider='gmail', created_by=user,
+        )
+        ratelimit.acquire('mine@example.com', 'gmail', 2)
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(f'/api/campaigns/{campaign.pk}/rate_limit/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['provider'], 'gmail')
+        self.assertEqual(response.data['limits'][0]['used'], 2)
+
+
+class HostControllerTests(SimpleTestCase):
+    def test_limit_grows_additively_and_halves_on_trouble(self):
+        controller = hostcontrol.HostController('smtp.example.com:587', 8, slow_seconds=1)
+        controller.acquire()
+        controller.release(hostcontrol.DEFERRED, 0.1)
+        self.assertEqual(controller.limit, 4)
+        for _ in range(4):
+            controller.acquire()
+            controller.release(hostcontrol.OK, 0.1)
+        self.assertEqual(int(controller.limit), 4)
+        self.assertGreater(controller.limit, 4.9)
+
+        slow = hostcontrol.HostController('slow.example.com:587', 8, slow_seconds=1)
+        slow.acquire()
+        slow.release(hostcontrol.OK, 2.5)
+        self.assertEqual(slow.limit, 4)
+
+    def test_circuit_opens_probes_and_closes(self):
+        controller = hostcontrol.HostController('smtp.example.com:587', 4, backoff=0.2)
+        for _ in range(hostcontrol.MIN_SAMPLES):
+            controller.acquire()
+            controller.release(hostcontrol.ERROR, 0.1)
+        self.assertEqual(controller.state, hostcontrol.OPEN)
+        with self.assertRaises(hostcontrol.HostUnavailable):
+            controller.acquire(timeout=0)
+
+        # A failed probe reopens the circuit for twice as long
+        self.assertTrue(controller.acquire(timeout=1))
+        controller.release(hostcontrol.DEFERRED, 0.1, probe=True)
+        self.assertGreater(controller.snapshot()['retry_in'], 0.3)
+
+        self.assertTrue(controller.acquire(timeout=1))
+        controller.release(hostcontrol.OK, 0.1, probe=True)
+        self.assertEqual((controller.state, controller.limit), (hostcontrol.CLOSED, 1))
+
+    def test_classify(self):
+        self.assertEqual(hostcontrol.classify(None), hostcontrol.OK)
+        self.assertEqual(hostcontrol.classify(smtplib.SMTPDataError(451, b'later')), hostcontrol.DEFERRED)
+        self.assertEqual(hostcontrol.classify(smtplib.SMTPDataError(554, b'spam')), hostcontrol.OK)
+        self.assertEqual(
+            hostcontrol.classify(smtplib.SMTPRecipientsRefused({'a@example.com': (450, b'busy')})),
+            hostcontrol.DEFERRED,
+        )
+        self.assertEqual(hostcontrol.classify(TimeoutError()), hostcontrol.ERROR)
+
+
+@unittest.skipIf(aiosmtpd is None, "aiosmtpd is not installed")
+class FaultySMTPHostTests(SimpleTestCase):
+    """Delivery against a local SMTP server that defers or stalls messages."""
+
+    def setUp(self):
+        self.addCleanup(hostcontrol.reset)
+
+    def start_sink(self, **faults):
+        sink = LocalSMTPSink(handler=FaultInjectingHandler(**faults)).start()
+        self.addCleanup(sink.stop)
+        return sink
+
+    def sender(self, sink, **kwargs):
+        campaign = EmailCampaign(
+            name='Faults', subject='Hi', body='<p>Hi</p>', email=f'sender{sink.port}@example.com',
+            provider='custom', smtp_host=sink.host, smtp_port=sink.port, use_ssl=False,
+        )
+        return CampaignSender(campaign, attachments=[], rate_limit=False, **kwargs)
+
+    def recipients(self, count):
+        return [EmailEntry(id=i, name='R', email=f'r{i}@example.com') for i in range(count)]
+
+    def test_failing_host_only_degrades_its_own_sends(self):
+        healthy, failing = self.start_sink(), self.start_sink(defer_rate=1.0)
+        results = {}
+
+        def send_healthy():
+            results['healthy'] = self.sender(healthy, max_workers=4).send(self.recipients(50))
+
+        thread = threading.Thread(target=send_healthy)
+        thread.start()
+        with self.assertRaises(hostcontrol.HostUnavailable):
+            self.sender(failing, max_workers=4, max_host_wait=0).send(self.recipients(50))
+        thread.join()
+
+        # The breaker stopped the failing run after a handful of attempts
+        self.assertLess(failing.handler.deferred, 15)
+        self.assertEqual(failing.handler.messages, 0)
+        self.assertEqual(results['healthy']['sent'], 50)
+        self.assertEqual(healthy.handler.messages, 50)
+        healthy_state = hostcontrol.get_controller(healthy.host, healthy.port, 4).snapshot()
+        self.assertEqual((healthy_state['state'], healthy_state['limit']), (hostcontrol.CLOSED, 4))
+        failing_state = hostcontrol.get_controller(failing.host, failing.port, 4).snapshot()
+        self.assertEqual(failing_state['state'], hostcontrol.OPEN)
+
+    @override_settings(CAMPAIGN_SMTP_SLOW_SECONDS=0.05)
+    def test_slow_host_gets_fewer_connections(self):
+        slow = self.start_sink(delay=0.1)
+        summary = self.sender(slow, max_workers=4).send(self.recipients(12))
+        self.assertEqual(summary['sent'], 12)
+        self.assertLess(hostcontrol.get_controller(slow.host, slow.port, 4).limit, 4)
+
+
+@unittest.skipIf(aiosmtpd is None, "aiosmtpd is not installed")
+@override_settings(CAMPAIGN_LEDGER_BATCH=4, CAMPAIGN_RATE_LIMITS={'default': {}})
+class SendLedgerTests(TransactionTestCase):
+    """The ledger is written on its own connection, so these tests commit."""
+
+    def setUp(self):
+        self.addCleanup(close_autocommit_connection)
+        self.addCleanup(hostcontrol.reset)
+
+    def start_sink(self, **faults):
+        sink = LocalSMTPSink(handler=FaultInjectingHandler(**faults)).start()
+        self.addCleanup(sink.stop)
+        return sink
+
+    def sender(self, sink, **kwargs):
+        # Saved campaigns only: the ledger is keyed by the campaign's id
+        campaign = EmailCampaign(
+            id=7001, name='Ledger', subject='Hi', body='<p>Hi</p>', email='ledger@example.com',
+            provider='custom', smtp_host=sink.host, smtp_port=sink.port, use_ssl=False,
+        )
+        return CampaignSender(campaign, max_workers=2, attachments=[], **kwargs)
+
+    def recipients(self, count):
+        return [EmailEntry(id=i, name='R', email=f'r{i}@example.com') for i in range(1, count + 1)]
+
+    def statuses(self):
+        return dict(SendLog.objects.filter(campaign_id=7001, step=0).values_list('entry_id', 'status'))
+
+    def test_retried_send_skips_attempted_recipients(self):
+        sink = self.start_sink()
+        with CaptureQueriesContext(autocommit_connection()) as queries:
+            summary = self.sender(sink).send(self.recipients(10), step=0)
+        self.assertEqual((summary['sent'], summary['skipped']), (10, 0))
+        self.assertEqual(self.statuses(), {i: SendLog.STATUS_SENT for i in range(1, 11)})
+        # Three claims of 4, 4 and 2 recipients, and at most one outcome write per claim
+        writes = [query for query in queries if query['sql'].startswith('INSERT')]
+        self.assertLessEqual(len(writes), 6)
+
+        ledger = SendLedger(7001, 0)
+        ledger.record(11, SendLog.STATUS_FAILED)
+        ledger.flush()
+        results = {}
+        summary = self.sender(sink).send(
+            self.recipients(12), step=0, on_result=lambda entry, error: results.__setitem__(entry.id, error),
+        )
+        self.assertEqual((summary['sent'], summary['skipped']), (1, 11))
+        self.assertEqual(sink.handler.messages, 11)
+        self.assertIsNone(results[1])
+        self.assertIsInstance(results[11], AlreadyAttempted)
+        self.assertIsNone(results[12])
+
+        # Another step is a different message
+        self.assertEqual(self.sender(sink).send(self.recipients(2), step=1)['sent'], 2)
+
+    def test_deferred_recipients_are_sent_again(self):
+        summary = self.sender(self.start_sink(defer_rate=1.0)).send(self.recipients(3), step=0)
+        self.assertEqual(summary['failed'], 3)
+        self.assertEqual(self.statuses(), {i: SendLog.STATUS_DEFERRED for i in range(1, 4)})
+
+        sink = self.start_sink()
+        summary = self.sender(sink).send(self.recipients(3), step=0)
+        self.assertEqual((summary['sent'], summary['skipped']), (3, 0))
+        self.assertEqual(self.statuses(), {i: SendLog.STATUS_SENT for i in range(1, 4)})
+
+    @override_settings(CAMPAIGN_RATE_LIMITS={'custom': {'minute': 5}})
+    def test_claims_of_unsent_recipients_are_released(self):
+        with self.assertRaises(ratelimit.RateLimited):
+            self.sender(self.start_sink(), max_rate_wait=1).send(self.recipients(8), step=0)
+        self.assertEqual(self.statuses(), {i: SendLog.STATUS_SENT for i in range(1, 6)})
+
+    def test_rolled_back_drip_chunk_is_not_sent_again(self):
+        sink = self.start_sink()
+        campaign = EmailCampaign.objects.create(
+            name='Drip', subject='Hi', body='<p>Hi</p>', email='drip@example.com',
+            provider='custom', smtp_host=sink.host, smtp_port=sink.port, use_ssl=False,
+        )
+        for i in range(3):
+            EmailEntry.objects.create(name='R', email=f'd{i}@example.com', campaign=campaign)
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        self.assertEqual(DripScheduler(today=tomorrow).run_tick(['day_one'])['day_one'], {'sent': 3, 'failed': 0})
+
+        # As if the chunk's transaction had been rolled back after sending
+        EmailEntry.objects.update(day_one=None)
+        self.assertEqual(DripScheduler(today=tomorrow).run_tick(['day_one'])['day_one'], {'sent': 3, 'failed': 0})
+        self.assertEqual(EmailEntry.objects.filter(day_one='sent').count(), 3)
+        self.assertEqual(sink.handler.messages, 3)
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'download-urls'}}
+
+
+@override_settings(R2_PUBLIC_BASE_URL='https://files.example.com', CACHES=LOCMEM_CACHES)
+class DownloadUrlTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='owner', password='x')
+        cls.campaign = EmailCampaign.objects.create(
+            name='URLs', subject='Hi', body='<p>Hi</p>', email='urls@example.com', created_by=cls.user,
+        )
+        CampaignEmailAttachment.objects.bulk_create([
+            CampaignEmailAttachment(
+                email_campaign=cls.campaign, file=f'campaign_attachments/{cls.campaign.pk}/file-{i}.pdf',
+                original_filename=f'file-{i}.pdf', content_type='application/pdf', file_size=1024, download_url=url,
+            )
+            for i, url in enumerate([None, '', 'https://files.example.com/stale.pdf'])
+        ])
+        submission = UnreadEmail.objects.create(name='Inbox', email='inbox@example.com')
+        UnreadEmailAttachment.objects.bulk_create([
+            UnreadEmailAttachment(
+                unread_email=submission, file='unread_emails/1/attachments/note.txt',
+                original_filename='note.txt', content_type='text/plain',
+            ),
+        ])
+
+    def test_list_resolves_urls_without_writing(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/campaigns/')
+        self.assertEqual(response.status_code, 200)
+        writes = [
+            query['sql'] for query in queries
+            if query['sql'].lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE'))
+        ]
+        self.assertEqual(writes, [])
+        [campaign] = response.data['results']
+        self.assertEqual(
+            sorted(attachment['download_url'] for attachment in campaign['attachments']),
+            [f'https://files.example.com/campaign_attachments/{self.campaign.pk}/file-{i}.pdf' for i in range(3)],
+        )
+        self.assertEqual(CampaignEmailAttachment.objects.filter(download_url__isnull=True).count(), 1)
+
+    def test_backfill_fills_missing_urls_once(self):
+        out = io.StringIO()
+        call_command('backfill_download_urls', stdout=out)
+        self.assertIn('Successfully updated 3 attachment URLs', out.getvalue())
+        self.assertEqual(
+            sorted(CampaignEmailAttachment.objects.values_list('download_url', flat=True)), [
+                f'https://files.example.com/campaign_attachments/{self.campaign.pk}/file-0.pdf',
+                f'https://files.example.com/campaign_attachments/{self.campaign.pk}/file-1.pdf',
+                # Only missing URLs are filled in without --all
+                'https://files.example.com/stale.pdf',
+            ],
+        )
+        self.assertEqual(
+            UnreadEmailAttachment.objects.get().download_url,
+            'https://files.example.com/unread_emails/1/attachments/note.txt',
+        )
+
+        call_command('backfill_download_urls', stdout=out)
+        self.assertIn('Successfully updated 0 attachment URLs', out.getvalue())
+
+        call_command('backfill_download_urls', '--all', stdout=out)
+        self.assertIn('Successfully updated 1 attachment URLs', out.getvalue())
+        self.assertFalse(CampaignEmailAttachment.objects.filter(download_url__endswith='stale.pdf').exists())
+
+
+class CampaignQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Campaign endpoints run the same queries for 10 or 1000 campaigns/attachments."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='owner', password='x')
+        cls.campaign = EmailCampaign.objects.create(
+            name='Detail', subject='Hi', body='<p>Hi</p>', email='detail@example.com', created_by=cls.user,
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _attach(self, campaign, count):
+        CampaignEmailAttachment.objects.bulk_create(
+            CampaignEmailAttachment(
+                email_campaign=campaign, file=f'campaign_attachments/{campaign.pk}/file-{i}.pdf',
+                original_filename=f'file-{i}.pdf', content_type='application/pdf', file_size=1024,
+            )
+            for i in range(count)
+        )
+
+    def populate_campaigns(self, count):
+        existing = EmailCampaign.objects.filter(created_by=self.user).count()
+        campaigns = EmailCampaign.objects.bulk_create(
+            EmailCampaign(
+                name=f'Campaign {i}', subject='Hi', body='<p>Hi</p>',
+                email=f'sender{i}@example.com', created_by=self.user,
+            )
+            for i in range(existing, count)
+        )
+        for campaign in campaigns:
+            self._attach(campaign, 2)
+
+    def populate_attachments(self, count):
+        self._attach(self.campaign, count - self.campaign.attachments.count())
+
+    def test_campaign_list(self):
+        self.assertQueryBudget(self.client, '/api/campaigns/?page_size=500', 2, self.populate_campaigns)
+
+    def test_campaign_detail(self):
+        self.assertQueryBudget(self.client, f'/api/campaigns/{self.campaign.pk}/', 2, self.populate_attachments)
+
+    def test_attachment_list(self):
+        url = f'/api/campaigns/{self.campaign.pk}/attachments/?campaign_id={self.campaign.pk}&page_size=500'
+        self.assertQueryBudget(self.client, url, 1, self.populate_attachments)
+
+
+class CampaignListCacheTests(TestCase):
+    """The campaign list is cached per user in the shared cache and dropped on writes."""
+
+    def setUp(self):
+        from em_store import metrics
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.user = get_user_model().objects.create_user(username='owner', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _names(self):
+        return [campaign['name'] for campaign in self.client.get('/api/campaigns/').data['results']]
+
+    def _lookups(self, result):
+        from em_store import metrics
+        return metrics.CACHE_REQUESTS._series.get(('campaign-list', result), 0)
+
+    def test_second_request_is_served_from_cache(self):
+        EmailCampaign.objects.create(name='First', subject='Hi', body='<p>Hi</p>', email='a@example.com', created_by=self.user)
+        self.assertEqual(self._names(), ['First'])
+        # A write that sends no signal is not seen until the entry expires
+        EmailCampaign.objects.filter(created_by=self.user).update(name='Renamed')
+        self.assertEqual(self._names(), ['First'])
+        self.assertEqual((self._lookups('miss'), self._lookups('hit')), (1, 1))
+
+    def test_saves_and_attachment_uploads_invalidate(self):
+        campaign = EmailCampaign.objects.create(
+            name='First', subject='Hi', body='<p>Hi</p>', email='a@example.com', created_by=self.user,
+        )
+        self.assertEqual(self._names(), ['First'])
+        campaign.name = 'Renamed'
+        campaign.save()
+        self.assertEqual(self._names(), ['Renamed'])
+
+        upload = {'success': True, 'url': 'https://cdn.example.com/a.txt', 'key': 'campaigns/a.txt', 'error': None}
+        with mock.patch('campaigns.attachments.upload_files_to_r2', return_value=[upload]):
+            create_attachments(campaign, [SimpleUploadedFile('a.txt', b'a', content_type='text/plain')])
+        [listed] = self.client.get('/api/campaigns/').data['results']
+        self.assertEqual(len(listed['attachments']), 1)
+
+        with mock.patch('campaigns.models.delete_file_from_r2'):
+            campaign.attachments.get().delete()
+        [listed] = self.client.get('/api/campaigns/').data['results']
+        self.assertEqual(listed['attachments'], [])
+
+    def test_entries_are_per_user(self):
+        EmailCampaign.objects.create(name='Mine', subject='Hi', body='<p>Hi</p>', email='a@example.com', created_by=self.user)
+        self.assertEqual(self._names(), ['Mine'])
+        other = get_user_model().objects.create_user(username='other', password='x')
+        self.client.force_authenticate(other)
+        self.assertEqual(self._names(), [])
+
+    @override_settings(CAMPAIGN_LIST_CACHE_SECONDS=0)
+    def test_disabled(self):
+        self.assertEqual(self._names(), [])
+        EmailCampaign.objects.bulk_create([
+            EmailCampaign(name='Bulk', subject='Hi', body='<p>Hi</p>', email='a@example.com', created_by=self.user),
+        ])
+        self.assertEqual(self._names(), ['Bulk'])
+
+
+class MetricsEndpointTests(TestCase):
+    def setUp(self):
+        from em_store import metrics
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.user = get_user_model().objects.create_user(username='owner', password='x')
+        self.staff = get_user_model().objects.create_user(username='ops', password='x', is_staff=True)
+        self.client = APIClient()
+
+    def test_staff_only(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_reports_latency_and_queries_by_route(self):
+        self.client.force_authenticate(self.user)
+        self.client.get('/api/campaigns/')
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn(
+            'http_request_duration_seconds_count{endpoint="api/campaigns/",method="GET",status="200"} 1', body,
+        )
+        self.assertIn('db_queries_per_request_count{endpoint="api/campaigns/",method="GET"} 1', body)
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_only_counted(self):
+        self.client.force_authenticate(self.staff)
+        self.client.get('/api/campaigns/')
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('http_requests_seen_total{method="GET"} 2', body)
+        self.assertNotIn('http_request_duration_seconds_count', body)
+
+
+class CredentialInvalidationTests(TestCase):
+    def setUp(self):
+        credential_cache.clear()
+        self.addCleanup(credential_cache.clear)
+
+    def cached(self, instance, pk):
+        return any(key[:2] == (instance._meta.label, pk) for key in credential_cache._entries)
+
+    def test_save_and_delete_drop_the_cached_password(self):
+        campaign = EmailCampaign.objects.create(
+            name='Creds', subject='Hi', body='<p>Hi</p>', email='creds@example.com', password='first',
+        )
+        pk = campaign.pk
+        self.assertEqual(campaign.get_decrypted_password(), 'first')
+        self.assertTrue(self.cached(campaign, pk))
+
+        campaign.password = 'second'
+        campaign.save()
+        self.assertFalse(self.cached(campaign, pk))
+        self.assertEqual(EmailCampaign.objects.get(pk=pk).get_decrypted_password(), 'second')
+
+        self.assertTrue(self.cached(campaign, pk))
+        campaign.delete()
+        self.assertFalse(self.cached(campaign, pk))
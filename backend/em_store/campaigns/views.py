@@ -3,14 +3,20 @@ from typing import TYPE_CHECKING
 from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django.db import transaction
+from django.db.models import Prefetch
 from django.core.exceptions import ValidationError
 
 from .models import EmailCampaign, CampaignEmailAttachment
+from .attachments import create_attachments
+from .cache import campaign_list_cache
+from .delivery import get_smtp_settings
+from . import ratelimit
+from jobs.queue import enqueue
 from .serializers import EmailCampaignSerializer, CampaignEmailAttachmentSerializer
-from .utils import ensure_sequence_sync
 
 if TYPE_CHECKING:
     from django.db.models import QuerySet
@@ -18,6 +24,12 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+# Columns read by the nested attachment serializer
+ATTACHMENT_FIELDS = (
+    'id', 'email_campaign', 'file', 'original_filename', 'content_type',
+    'file_size', 'download_url', 'created_at',
+)
+
 class EmailCampaignViewSet(viewsets.ModelViewSet):
     """
     ViewSet for managing email campaigns.
@@ -25,11 +37,35 @@ class EmailCampaignViewSet(viewsets.ModelViewSet):
     queryset = EmailCampaign._default_manager.all()
     serializer_class = EmailCampaignSerializer
     permission_classes = [IsAuthenticated]
+    ordering = ('-created_at', '-id')
     parser_classes = [MultiPartParser, FormParser, JSONParser]
 
     def get_queryset(self) -> 'QuerySet[EmailCampaign]':
         """Return only campaigns created by the current user."""
-        return self.queryset.filter(created_by=self.request.user)
+        if getattr(self, 'swagger_fake_view', False):
+            # Schema generation: no user to filter by
+            return self.queryset.none()
+        queryset = self.queryset.filter(created_by=self.request.user)
+        if self.action in ('list', 'retrieve', 'update', 'partial_update'):
+            # These responses nest the attachments; fetch them all in one query
+            queryset = queryset.prefetch_related(
+                Prefetch('attachments', queryset=CampaignEmailAttachment.objects.only(*ATTACHMENT_FIELDS))
+            )
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        """List the user's campaigns, served from the shared cache when unchanged."""
+        if not campaign_list_cache.enabled:
+            return super().list(request, *args, **kwargs)
+        # The absolute URL keys the page and the host used in its next/previous links
+        key = request.build_absolute_uri()
+        data, version = campaign_list_cache.get(request.user.pk, key)
+        if data is not None:
+            return Response(data)
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            campaign_list_cache.set(request.user.pk, key, version, response.data)
+        return response
 
     def perform_create(self, serializer):
         """Set the created_by field to the current user."""
@@ -41,12 +77,11 @@ class EmailCampaignViewSet(viewsets.ModelViewSet):
         Check if the current user has any campaigns.
         Returns True if user has campaigns, False otherwise.
         """
-        user_campaigns = self.get_queryset()
-        has_campaigns = user_campaigns.exists()
+        campaign_count = self.get_queryset().count()
         
         return Response({
-            'has_campaigns': has_campaigns,
-            'campaign_count': user_campaigns.count()
+            'has_campaigns': campaign_count > 0,
+            'campaign_count': campaign_count
         })
 
     def create(self, request, *args, **kwargs):
@@ -71,8 +106,9 @@ class EmailCampaignViewSet(viewsets.ModelViewSet):
             logger.info(f"  File {i}: {file.name} ({file.size} bytes, {file.content_type})")
         
         try:
-            # Prepare data for serializer
+            # Prepare data for serializer; the files are uploaded below, not by the serializer
             data = request.data.copy()
+            data.pop('uploaded_files', None)
             logger.info(f"Prepared data for serializer: {data}")
             
             # Create and validate the campaign
@@ -92,41 +128,17 @@ class EmailCampaignViewSet(viewsets.ModelViewSet):
             # Process file uploads if any
             if files:
                 logger.info(f"Processing {len(files)} file(s) for campaign {campaign.id}")
-                successful_uploads = 0
-                
+                accepted = []
                 for file in files:
-                    try:
-                        # Validate file type and size
-                        if file.size > 10 * 1024 * 1024:  # 10MB limit
-                            logger.warning(f"File {file.name} exceeds size limit (10MB)")
-                            continue
-                            
-                        # Create attachment with proper file handling
-                        try:
-                            attachment = CampaignEmailAttachment(
-                                email_campaign=campaign,
-                                original_filename=file.name,
-                                content_type=file.content_type or 'application/octet-stream',
-                                file_size=file.size
-                            )
-                            
-                            # Set the file field to trigger the save method
-                            attachment.file = file
-                            attachment.save()
-                            
-                            successful_uploads += 1
-                            logger.info(f"Created attachment ID {attachment.id} for file: {file.name}")
-                            logger.info(f"Download URL: {attachment.download_url}")
-                            
-                        except Exception as e:
-                            logger.error(f"Failed to create attachment for {file.name}: {str(e)}")
-                            continue
-                        
-                    except Exception as e:
-                        logger.error(f"Error processing file {file.name}: {str(e)}", exc_info=True)
+                    # Validate file size
+                    if file.size > 10 * 1024 * 1024:  # 10MB limit
+                        logger.warning(f"File {file.name} exceeds size limit (10MB)")
                         continue
+                    accepted.append(file)
                 
-                logger.info(f"Successfully uploaded {successful_uploads}/{len(files)} files")
+                # Files are uploaded to R2 in parallel
+                attachments = create_attachments(campaign, accepted)
+                logger.info(f"Successfully uploaded {len(attachments)}/{len(files)} files")
             
             # Get the updated campaign with attachments
             serializer = self.get_serializer(campaign)
@@ -158,43 +170,16 @@ class EmailCampaignViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Check and fix sequence before creating attachments
-        try:
-            sequence_was_fixed = ensure_sequence_sync()
-            if sequence_was_fixed:
-                logger.info("Sequence was fixed before uploading new attachments")
-        except Exception as e:
-            logger.error(f"Error checking/fixing sequence: {str(e)}")
-            # Continue with upload even if sequence check fails
-        
-        attachments = []
+        accepted = []
         for file in files:
-            try:
-                # Check file size before processing
-                if file.size > 10 * 1024 * 1024:  # 10MB limit
-                    logger.warning(f"File {file.name} exceeds size limit (10MB)")
-                    continue
-                    
-                # Create attachment with proper file handling
-                attachment = CampaignEmailAttachment(
-                    email_campaign=campaign,
-                    original_filename=file.name,
-                    content_type=file.content_type or 'application/octet-stream',
-                    file_size=file.size
-                )
-                
-                # Set the file field to trigger the save method
-                attachment.file = file
-                attachment.save()
-                
-                attachments.append(attachment)
-                logger.info(f"Successfully created attachment ID {attachment.id} for file: {file.name}")
-                logger.info(f"Download URL: {attachment.download_url}")
-                
-            except Exception as e:
-                logger.error(f"Failed to create attachment for {file.name}: {str(e)}", exc_info=True)
-                # Continue with next file even if one fails
+            # Check file size before processing
+            if file.size > 10 * 1024 * 1024:  # 10MB limit
+                logger.warning(f"File {file.name} exceeds size limit (10MB)")
                 continue
+            accepted.append(file)
+        
+        # Files are uploaded to R2 in parallel
+        attachments = create_attachments(campaign, accepted)
         
         if not attachments:
             return Response(
@@ -217,14 +202,39 @@ class EmailCampaignViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'])
     def send_campaign(self, request, pk=None):
-        """Send the campaign to all recipients."""
+        """Send the campaign to all subscribed recipients."""
         campaign = self.get_object()
-        # TODO: Implement campaign sending
+        try:
+            get_smtp_settings(campaign)
+        except ValueError as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Delivery runs in a job worker (manage.py run_workers), not in this request.
+        # Retries are safe: the send ledger skips recipients an earlier attempt sent to
+        job = enqueue('send_campaign', {'campaign_id': campaign.id}, created_by=request.user)
         return Response(
-            {"message": "Campaign sending functionality coming soon"},
-            status=status.HTTP_200_OK
+            {
+                "message": "Campaign queued for sending",
+                "job_id": job.id,
+                "status": job.status,
+                "status_url": reverse('job-detail', args=[job.id], request=request),
+            },
+            status=status.HTTP_202_ACCEPTED
         )
 
+    @action(detail=True, methods=['get'])
+    def rate_limit(self, request, pk=None):
+        """Report how far the campaign's sending account is from its provider's send limits."""
+        campaign = self.get_object()
+        return Response({
+            "account": campaign.email,
+            "provider": ratelimit.normalize_provider(campaign.provider),
+            "limits": ratelimit.headroom(campaign.email, campaign.provider),
+        })
+
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -0,0 +1,85 @@
+"""
+Shared cache tier.
+
+CACHES['default'] is shared by every gunicorn worker and job worker: the
+Postgres database cache (table ``django_cache``, created by ``manage.py
+createcachetable``) or, when REDIS_URL is set, a Redis-compatible server.
+DRF's throttles keep their request histories there, so rate limits hold
+across workers.
+
+``VersionedCache`` caches values per owner (e.g. a user's campaign list
+responses) and drops all of an owner's values at once with
+``invalidate(owner)``. Lookups are counted in ``cache_requests_total`` on
+/metrics.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+
+class VersionedCache:
+    """
+    Values scoped to an owner, invalidated together.
+
+    Each owner has a version token in the cache, and values are stored
+    together with the token that was current when the value was computed. A
+    value is only served while its token is still current, so bumping the
+    token invalidates every value of the owner without enumerating keys, and
+    a value computed while an invalidation ran is never served. A missing
+    token (expired or evicted) is replaced by a fresh one, which also
+    invalidates.
+    """
+
+    def __init__(self, name, timeout_setting, default_timeout, alias='default'):
+        self.name = name
+        self.timeout_setting = timeout_setting
+        self.default_timeout = default_timeout
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def timeout(self):
+        return getattr(settings, self.timeout_setting, self.default_timeout)
+
+    @property
+    def enabled(self):
+        return self.timeout > 0
+
+    def _version_key(self, owner):
+        return f'{self.name}:version:{owner}'
+
+    def _key(self, owner, key):
+        return f'{self.name}:{owner}:{hashlib.md5(key.encode()).hexdigest()}'
+
+    def get(self, owner, key):
+        """
+        Return ``(value, version)``. ``value`` is None on a miss; pass
+        ``version`` back to ``set`` with the value computed afterwards.
+        """
+        version_key, data_key = self._version_key(owner), self._key(owner, key)
+        found = self.cache.get_many([version_key, data_key])
+        version = found.get(version_key)
+        if version is None:
+            version = time.time_ns()
+            if not self.cache.add(version_key, version, None):
+                version = self.cache.get(version_key, version)
+        entry = found.get(data_key)
+        if entry is not None and entry[0] == version:
+            metrics.CACHE_REQUESTS.inc((self.name, 'hit'))
+            return entry[1], version
+        metrics.CACHE_REQUESTS.inc((self.name, 'miss'))
+        return None, version
+
+    def set(self, owner, key, version, value):
+        self.cache.set(self._key(owner, key), (version, value), self.timeout)
+
+    def invalidate(self, owner):
+        """Drop every value cached for ``owner``."""
+        self.cache.set(self._version_key(owner), time.time_ns(), None)
@@ -0,0 +1,183 @@
+"""
+Encryption of stored credentials (SMTP/IMAP passwords).
+
+Fernet keys are derived from SECRET_KEY with PBKDF2-HMAC-SHA256. The
+derivation is deliberately slow, so each key is derived once per process and
+cached; encrypting or decrypting a value afterwards only costs the Fernet
+operation itself.
+
+Keys are combined in a MultiFernet: new values are encrypted with the key
+derived from SECRET_KEY, while values encrypted under a key derived from any
+of SECRET_KEY_FALLBACKS can still be decrypted (and re-encrypted with
+``rotate``) after the secret key has been changed.
+
+Delivery workers that need the same plaintext password thousands of times
+read it through ``credential_cache``, an in-memory cache that is never
+persisted. It deliberately stays out of the shared cache tier
+(em_store/cache.py): plaintexts must not be written to the cache table or
+Redis, and entries are already consistent across processes because every hit
+compares the stored token.
+"""
+import base64
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+PBKDF2_ITERATIONS = 100000
+
+_lock = threading.Lock()
+_fernet = None
+_fernet_secrets = None
+
+
+@lru_cache(maxsize=8)
+def derive_key(secret):
+    """Derive the urlsafe base64 Fernet key for ``secret``."""
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=secret[:16].encode(),
+        iterations=PBKDF2_ITERATIONS,
+    )
+    return base64.urlsafe_b64encode(kdf.derive(secret.encode()))
+
+
+def get_fernet_key():
+    """Return the key new values are encrypted with."""
+    return derive_key(settings.SECRET_KEY)
+
+
+def get_fernet():
+    """Return the process-wide MultiFernet for the current secret keys."""
+    global _fernet, _fernet_secrets
+    secrets = (settings.SECRET_KEY, *getattr(settings, 'SECRET_KEY_FALLBACKS', ()))
+    if _fernet is None or _fernet_secrets != secrets:
+        with _lock:
+            if _fernet is None or _fernet_secrets != secrets:
+                _fernet = MultiFernet([Fernet(derive_key(secret)) for secret in secrets])
+                _fernet_secrets = secrets
+    return _fernet
+
+
+@metrics.timed('crypto')
+def encrypt(value):
+    """Encrypt a string and return the token as a string."""
+    return get_fernet().encrypt(value.encode()).decode()
+
+
+@metrics.timed('crypto')
+def decrypt(token):
+    """Decrypt a token produced by ``encrypt``. Raises InvalidToken if no key matches."""
+    return get_fernet().decrypt(token.encode()).decode()
+
+
+@metrics.timed('crypto')
+def decrypt_many(tokens):
+    """
+    Decrypt a batch of tokens and return the plaintexts in the same order.
+    Empty or undecryptable tokens give None; repeated tokens are decrypted once.
+    """
+    fernet = get_fernet()
+    plaintexts = {}
+    results = []
+    for token in tokens:
+        if not token:
+            results.append(None)
+            continue
+        if token not in plaintexts:
+            try:
+                plaintexts[token] = fernet.decrypt(token.encode()).decode()
+            except (InvalidToken, TypeError, ValueError) as e:
+                logger.error(f"Error decrypting credential: {e!r}")
+                plaintexts[token] = None
+        results.append(plaintexts[token])
+    return results
+
+
+def rotate(token):
+    """Re-encrypt a token under the current key."""
+    return get_fernet().rotate(token.encode()).decode()
+
+
+class CredentialCache:
+    """
+    Bounded, TTL-limited in-memory cache of decrypted passwords.
+
+    Entries are keyed on ``(model label, pk, updated_at)`` so saving the row
+    makes old entries unreachable; the post_save/post_delete receivers also
+    drop them right away. The stored token is compared on every hit, so a
+    password changed with ``QuerySet.update()`` is not served stale either.
+    Plaintexts only ever live in this process's memory.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_entries(self):
+        return self._max_entries or getattr(settings, 'CREDENTIAL_CACHE_MAX_ENTRIES', 1024)
+
+    @property
+    def ttl(self):
+        return self._ttl or getattr(settings, 'CREDENTIAL_CACHE_TTL_SECONDS', 300)
+
+    @staticmethod
+    def _key(instance):
+        return (instance._meta.label, instance.pk, getattr(instance, 'updated_at', None))
+
+    def get_password(self, instance, field='password'):
+        """
+        Return the decrypted value of ``instance.<field>``, or None if it is empty.
+        Raises InvalidToken if it cannot be decrypted; failures are not cached.
+        """
+        token = getattr(instance, field)
+        if not token:
+            return None
+        if instance.pk is None:
+            return decrypt(token)
+
+        key = self._key(instance) + (field,)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == token and entry[2] > now:
+                self._entries.move_to_end(key)
+                metrics.CACHE_REQUESTS.inc(('credentials', 'hit'))
+                return entry[1]
+
+        metrics.CACHE_REQUESTS.inc(('credentials', 'miss'))
+        plaintext = decrypt(token)
+        with self._lock:
+            self._entries[key] = (token, plaintext, now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return plaintext
+
+    def invalidate(self, instance):
+        """Drop every cached value for ``instance``."""
+        label, pk = instance._meta.label, instance.pk
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == label and key[1] == pk]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+credential_cache = CredentialCache()
@@ -0,0 +1,55 @@
+"""
+Database connection lifetime for the long-running worker commands.
+
+Web requests reuse their thread's connection for up to CONN_MAX_AGE seconds
+and check it with a ping first (CONN_HEALTH_CHECKS). The worker commands
+(run_workers, run_drip_scheduler, sync_inboxes) serve no requests; they call
+``close_old_connections()`` between units of work, which applies the same
+rules. ``use_worker_connections`` gives them DB_WORKER_CONN_MAX_AGE instead,
+by default keeping one connection per thread for the life of the process, with
+health checks on so a connection dropped by the server is replaced at the
+next unit of work rather than failing it.
+
+``autocommit_connection`` is a second connection per thread for writes that
+must be committed immediately even when the caller is inside a transaction:
+send rate limit buckets and the send ledger.
+"""
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_local = threading.local()
+
+
+def use_worker_connections(alias='default'):
+    """Switch this process to the worker connection settings."""
+    settings_dict = connections.settings[alias]
+    settings_dict['CONN_MAX_AGE'] = getattr(settings, 'DB_WORKER_CONN_MAX_AGE', None)
+    settings_dict['CONN_HEALTH_CHECKS'] = True
+    # An open connection read the old values when it connected
+    connections[alias].close()
+
+
+def autocommit_connection():
+    """
+    Return this thread's side connection (a DatabaseWrapper) to the default
+    database, opening it if needed. It is separate from ``connection``, so
+    what it writes is committed independently of any transaction the thread
+    has open; wrap statements in ``wrapper.connection.transaction()`` to
+    group them.
+    """
+    wrapper = getattr(_local, 'connection', None)
+    if wrapper is None:
+        wrapper = _local.connection = connections.create_connection(DEFAULT_DB_ALIAS)
+    wrapper.close_if_unusable_or_obsolete()
+    wrapper.ensure_connection()
+    return wrapper
+
+
+def close_autocommit_connection():
+    """Close this thread's side connection, if it has one."""
+    wrapper = getattr(_local, 'connection', None)
+    if wrapper is not None:
+        wrapper.close()
+        _local.connection = None
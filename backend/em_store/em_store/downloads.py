@@ -0,0 +1,162 @@
+"""
+Streaming delivery of stored attachments.
+
+Files are sent to the client in chunks straight from R2, so a download never
+holds the whole object in worker memory. Responses carry ETag and
+Last-Modified headers and answer conditional GETs with 304, and single
+``Range: bytes=`` requests with 206 partial content. When
+ATTACHMENT_DOWNLOAD_REDIRECT is enabled the view redirects to a short-lived
+signed URL instead and R2 serves the file itself.
+"""
+import hashlib
+import logging
+import re
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+
+logger = logging.getLogger(__name__)
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range ``Range`` header against an object of ``size`` bytes.
+
+    Returns ``(start, end)`` with an inclusive end, None when the header is
+    absent, malformed or asks for several ranges (the whole file is sent), or
+    False when the range cannot be satisfied.
+    """
+    match = RANGE_RE.match((header or '').strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        return False
+    return start, end
+
+
+def _if_range_matches(request, etag, last_modified):
+    """Return True if the Range header applies to the current version of the file."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _stat(stored_file):
+    """Return ``(etag, last_modified timestamp, size)`` for an opened stored file."""
+    obj = getattr(stored_file, 'obj', None)
+    if obj is not None:
+        # S3/R2 objects: the HEAD made when the file was opened has everything
+        return obj.e_tag, int(obj.last_modified.timestamp()), obj.content_length
+    storage, name = stored_file.storage, stored_file.name
+    size = storage.size(name)
+    try:
+        last_modified = int(storage.get_modified_time(name).timestamp())
+    except NotImplementedError:
+        last_modified = None
+    etag = quote_etag(hashlib.md5(f'{name}:{size}:{last_modified}'.encode()).hexdigest())
+    return etag, last_modified, size
+
+
+def _iter_object(obj, byte_range, chunk_size):
+    params = {'Range': f'bytes={byte_range[0]}-{byte_range[1]}'} if byte_range else {}
+    body = obj.get(**params)['Body']
+    try:
+        yield from body.iter_chunks(chunk_size)
+    finally:
+        body.close()
+
+
+def _iter_file(stored_file, byte_range, chunk_size, size):
+    start, end = byte_range or (0, size - 1)
+    remaining = end - start + 1
+    try:
+        stored_file.open('rb')
+        stored_file.seek(start)
+        while remaining > 0:
+            chunk = stored_file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        stored_file.close()
+
+
+def serve_stored_file(request, file_field, filename, content_type=None):
+    """
+    Return a response delivering ``file_field`` (a FieldFile) as a download.
+
+    Raises FileNotFoundError if the object no longer exists in storage.
+    """
+    storage, name = file_field.storage, file_field.name
+    content_type = content_type or 'application/octet-stream'
+    disposition = content_disposition_header(True, filename or name.rsplit('/', 1)[-1])
+
+    if getattr(settings, 'ATTACHMENT_DOWNLOAD_REDIRECT', False) and hasattr(storage, 'signed_url'):
+        url = storage.signed_url(
+            name,
+            expire=getattr(settings, 'ATTACHMENT_SIGNED_URL_EXPIRY', 300),
+            parameters={'ResponseContentDisposition': disposition, 'ResponseContentType': content_type},
+        )
+        return HttpResponseRedirect(url)
+
+    stored_file = storage.open(name, 'rb')
+    etag, last_modified, size = _stat(stored_file)
+    validators = {'ETag': etag}
+    if last_modified is not None:
+        validators['Last-Modified'] = http_date(last_modified)
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is not None:
+        stored_file.close()
+        for header, value in validators.items():
+            conditional[header] = value
+        return conditional
+
+    byte_range = None
+    if size and _if_range_matches(request, etag, last_modified):
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    if byte_range is False:
+        stored_file.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    chunk_size = getattr(settings, 'ATTACHMENT_DOWNLOAD_CHUNK_SIZE', 64 * 1024)
+    obj = getattr(stored_file, 'obj', None)
+    if obj is not None:
+        stored_file.close()
+        chunks = _iter_object(obj, byte_range, chunk_size)
+    else:
+        chunks = _iter_file(stored_file, byte_range, chunk_size, size)
+
+    response = StreamingHttpResponse(chunks, content_type=content_type, status=206 if byte_range else 200)
+    for header, value in validators.items():
+        response[header] = value
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = disposition
+    if byte_range:
+        start, end = byte_range
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    else:
+        response['Content-Length'] = size
+    return response
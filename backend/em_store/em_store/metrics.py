@@ -0,0 +1,307 @@
+"""
+In-process request instrumentation exposed in Prometheus text format.
+
+MetricsMiddleware times a sample of requests (METRICS_SAMPLE_RATE) and, for
+those, counts the database queries and their time. R2 calls are timed through
+boto3 event hooks registered by the storage backend, and the application
+caches count their hits and misses. Everything is kept in
+per-process histograms and counters labelled by route pattern (e.g.
+``api/campaigns/<pk>/``), not by raw path, so the label set stays bounded.
+The staff-only ``/metrics`` view renders them for Prometheus to scrape. Each
+worker process keeps its own numbers, so run one scrape target per worker or
+aggregate with ``sum by``.
+
+Calls timed here (R2 calls, and functions decorated with ``timed``) are also
+handed to the call probe registered with ``register_call_probe``, if any. The
+profiling app registers its probes from ``ProfilingConfig.ready``; em_store
+never imports it, so it still loads when profiling is not installed.
+"""
+import bisect
+import logging
+import random
+import re
+import threading
+import time
+from functools import lru_cache, wraps
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+
+class Histogram:
+    """A Prometheus histogram with one series per label tuple."""
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (plus +Inf), sum
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in sorted(snapshot):
+            label_text = _labels(self.labelnames, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f'{self.name}_bucket{{{label_text}{"," if label_text else ""}le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {cumulative}')
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Counter:
+    """A Prometheus counter with one series per label tuple."""
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            snapshot = sorted(self._series.items())
+        for labels, value in snapshot:
+            lines.append(f'{self.name}{{{_labels(self.labelnames, labels)}}} {value}')
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+class CacheCounter(Counter):
+    """
+    Counts cache lookups by cache and result. Caches built on
+    ``functools.lru_cache`` are registered with ``register_lru_cache`` and
+    their own hit/miss statistics are read at scrape time.
+    """
+
+    def __init__(self, name, documentation, labelnames):
+        super().__init__(name, documentation, labelnames)
+        self._lru_caches = {}
+
+    def register_lru_cache(self, cache_name, func):
+        self._lru_caches[cache_name] = func
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            series = dict(self._series)
+        for cache_name, func in self._lru_caches.items():
+            info = func.cache_info()
+            series[(cache_name, 'hit')] = info.hits
+            series[(cache_name, 'miss')] = info.misses
+        for labels, value in sorted(series.items()):
+            lines.append(f'{self.name}{{{_labels(self.labelnames, labels)}}} {value}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency of sampled requests.',
+    ('endpoint', 'method', 'status'), LATENCY_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    'db_queries_per_request', 'Database queries run by sampled requests.',
+    ('endpoint', 'method'), QUERY_COUNT_BUCKETS,
+)
+DB_TIME = Histogram(
+    'db_query_duration_seconds_per_request', 'Total database time of sampled requests.',
+    ('endpoint', 'method'), LATENCY_BUCKETS,
+)
+R2_LATENCY = Histogram(
+    'r2_request_duration_seconds', 'Duration of R2 (S3 API) calls.',
+    ('operation', 'outcome'), LATENCY_BUCKETS,
+)
+REQUESTS_SEEN = Counter(
+    'http_requests_seen_total', 'Requests seen, sampled or not.', ('method',),
+)
+CACHE_REQUESTS = CacheCounter(
+    'cache_requests_total', 'Lookups in the application caches.', ('cache', 'result'),
+)
+
+REGISTRY = (REQUESTS_SEEN, REQUEST_LATENCY, DB_QUERIES, DB_TIME, R2_LATENCY, CACHE_REQUESTS)
+
+
+def render():
+    """Return every metric in Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    for metric in REGISTRY:
+        metric.clear()
+
+
+class _QueryTimer:
+    """Database execute wrapper that counts statements and their time."""
+
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+
+
+NAMED_GROUP_RE = re.compile(r'\(\?P<(\w+)>[^)]*\)')
+
+
+@lru_cache(maxsize=1024)
+def _clean_route(route):
+    # DRF routers register regex routes, e.g. "api/campaigns/(?P<pk>[^/.]+)/$"
+    return NAMED_GROUP_RE.sub(r'<\1>', route).replace('^', '').replace('$', '')
+
+
+def _endpoint(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    if match.route:
+        return _clean_route(match.route)
+    return match.view_name or 'unmatched'
+
+
+class MetricsMiddleware:
+    """
+    Records latency, query count and query time for a random sample of
+    requests. Unsampled requests only bump a counter.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'METRICS_SAMPLE_RATE', 1.0)
+
+    def __call__(self, request):
+        REQUESTS_SEEN.inc((request.method,))
+        if self.sample_rate <= 0 or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return self.get_response(request)
+
+        timer = _QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        endpoint = _endpoint(request)
+        REQUEST_LATENCY.observe((endpoint, request.method, response.status_code), elapsed)
+        DB_QUERIES.observe((endpoint, request.method), timer.count)
+        DB_TIME.observe((endpoint, request.method), timer.seconds)
+        logger.debug(
+            '%s %s -> %s in %.1f ms (%d queries, %.1f ms db)',
+            request.method, request.path, response.status_code, elapsed * 1000, timer.count, timer.seconds * 1000,
+        )
+        return response
+
+
+_call_probe = None
+
+
+def register_call_probe(probe):
+    """
+    Hand timed calls to ``probe``, which provides ``is_active()`` and
+    ``record(category, name, seconds)``. Pass None to unregister.
+    """
+    global _call_probe
+    _call_probe = probe
+
+
+def record_call(category, name, seconds):
+    """Report one call to the registered probe, if any."""
+    probe = _call_probe
+    if probe is not None:
+        probe.record(category, name, seconds)
+
+
+def timed(category):
+    """Decorator reporting each call of the function under ``category`` while the probe is active."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            probe = _call_probe
+            if probe is None or not probe.is_active():
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                probe.record(category, func.__name__, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def _before_call(model, context, **kwargs):
+    context['metrics_started'] = time.perf_counter()
+
+
+def _after_call(model, context, **kwargs):
+    started = context.get('metrics_started')
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        R2_LATENCY.observe((model.name, 'ok'), elapsed)
+        record_call('storage', model.name, elapsed)
+
+
+def _after_call_error(model, context, **kwargs):
+    started = context.get('metrics_started')
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        R2_LATENCY.observe((model.name, 'error'), elapsed)
+        record_call('storage', model.name, elapsed)
+
+
+def instrument_boto3_session(session):
+    """Time every S3 API call made through clients of ``session``."""
+    session.events.register('before-call.s3', _before_call)
+    session.events.register('after-call.s3', _after_call)
+    session.events.register('after-call-error.s3', _after_call_error)
+    return session
@@ -0,0 +1,163 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+Pages are addressed by an opaque cursor holding the sort key of the last row
+seen, e.g. ``(created_at, id)``. The next page is fetched with a row-value
+comparison, ``WHERE (created_at, id) < (%s, %s) ORDER BY created_at DESC, id
+DESC LIMIT n``, which a composite index on the same columns answers by seeking
+straight to the cursor. Page 10,000 therefore costs the same as page 1, unlike
+OFFSET pagination or DRF's CursorPagination, which keys on a single field and
+falls back to an offset for ties.
+
+``COUNT(*)`` is only run when the client asks for it with ``?count=true``.
+"""
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginates on a ``(sort field, id)`` key. Views choose the key with an
+    ``ordering`` attribute such as ``('-created_at', '-id')``; both fields
+    must sort in the same direction and be non-null.
+    """
+    ordering = ('-created_at', '-id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'API_PAGE_SIZE', 50)
+        self.max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 500)
+
+    def get_ordering(self, view):
+        ordering = tuple(getattr(view, 'ordering', None) or self.ordering)
+        if len({field.startswith('-') for field in ordering}) != 1:
+            raise ValueError(f"Keyset ordering fields must share one direction: {ordering}")
+        return ordering
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'), default=str)
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request, fields, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            position = payload['p']
+            if len(position) != len(fields):
+                raise ValueError
+            position = [model._meta.get_field(field).to_python(value) for field, value in zip(fields, position)]
+            return position, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, AttributeError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _seek(self, model, fields, position, descending):
+        """A row-value comparison selecting the rows after ``position`` in the scan order."""
+        quote = connection.ops.quote_name
+        table = quote(model._meta.db_table)
+        columns = ', '.join(f'{table}.{quote(model._meta.get_field(field).column)}' for field in fields)
+        placeholders = ', '.join(['%s'] * len(fields))
+        operator = '<' if descending else '>'
+        return RawSQL(f'({columns}) {operator} ({placeholders})', position, output_field=BooleanField())
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        ordering = self.get_ordering(view)
+        self.fields = [field.lstrip('-') for field in ordering]
+        descending = ordering[0].startswith('-')
+
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes'):
+            self.count = queryset.count()
+
+        cursor = self.decode_cursor(request, self.fields, queryset.model)
+        reverse = bool(cursor and cursor[1])
+        # A "previous" cursor scans backwards from the first row of the page it came from
+        scan_descending = descending != reverse
+        prefix = '-' if scan_descending else ''
+        queryset = queryset.order_by(*(prefix + field for field in self.fields))
+        if cursor:
+            queryset = queryset.filter(self._seek(queryset.model, self.fields, cursor[0], scan_descending))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = cursor is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = rows
+        return rows
+
+    def _position(self, row):
+        return [getattr(row, field) for field in self.fields]
+
+    def _link(self, row, reverse):
+        url = remove_query_param(self.base_url, self.count_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self._position(row), reverse))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # Past the end: the previous page is the last one
+            return remove_query_param(remove_query_param(self.base_url, self.cursor_query_param), self.count_query_param)
+        return self._link(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        body = {'next': self.get_next_link(), 'previous': self.get_previous_link()}
+        if self.count is not None:
+            body['count'] = self.count
+        body['results'] = data
+        return Response(body)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer', 'description': f'Only present with ?{self.count_query_param}=true'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {'name': self.cursor_query_param, 'required': False, 'in': 'query',
+             'description': 'The pagination cursor value.', 'schema': {'type': 'string'}},
+            {'name': self.page_size_query_param, 'required': False, 'in': 'query',
+             'description': f'Number of results per page (max {self.max_page_size}).', 'schema': {'type': 'integer'}},
+            {'name': self.count_query_param, 'required': False, 'in': 'query',
+             'description': 'Include the total row count.', 'schema': {'type': 'boolean'}},
+        ]
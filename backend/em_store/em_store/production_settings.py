@@ -3,6 +3,7 @@ Production settings for em_store project.
 """
 import os
 from .settings import *
+from .settings import _conn_max_age
 
 # Override for production
 DEBUG = False
@@ -23,7 +24,12 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT', '5432'),
-        'CONN_MAX_AGE': 600,
+        'CONN_MAX_AGE': _conn_max_age(os.getenv('DB_CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'True').lower() == 'true',
+        'OPTIONS': {
+            'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '10')),
+            'sslmode': os.getenv('DB_SSLMODE', 'prefer'),
+        },
     }
 }
 
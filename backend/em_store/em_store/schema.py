@@ -0,0 +1,149 @@
+"""
+Precomputed OpenAPI schema.
+
+Generating the schema introspects every viewset and serializer, which costs
+hundreds of milliseconds. It is instead rendered once per code version into
+OPENAPI_SCHEMA_DIR (``openapi-<version>.json``/``.yaml``) by ``manage.py
+generate_openapi_schema`` at deploy, or by the first request that needs it,
+and then served from memory with an ETag. The Swagger UI and ReDoc pages load
+that artifact instead of asking drf-yasg to regenerate it.
+
+The code version is CODE_VERSION (set from the deploy's git commit); without
+one, a fingerprint of the project's Python sources is used, so a code change
+always produces a new artifact.
+"""
+import hashlib
+import logging
+import os
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import condition, require_safe
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.views import get_schema_view
+from rest_framework import permissions
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+logger = logging.getLogger(__name__)
+
+API_INFO = openapi.Info(
+    title="Email Campaigns API",
+    default_version='v1',
+    description="API documentation for Email Campaigns",
+    terms_of_service="https://www.yourapp.com/terms/",
+    contact=openapi.Contact(email="contact@yourapp.com"),
+    license=openapi.License(name="Your License"),
+)
+
+# Serves the Swagger UI and ReDoc pages; their schema comes from schema_document
+schema_view = get_schema_view(
+    API_INFO,
+    public=True,
+    permission_classes=(permissions.AllowAny,),
+)
+
+CODECS = {
+    'json': OpenAPICodecJson,
+    'yaml': OpenAPICodecYaml,
+}
+
+# Directories that hold no project code
+_SKIP_DIRS = {'__pycache__', 'media', 'staticfiles', 'static', 'logs', 'node_modules', 'venv', '.venv', 'env'}
+
+_artifacts = {}
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _source_fingerprint():
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(settings.BASE_DIR):
+        dirs[:] = sorted(d for d in dirs if d not in _SKIP_DIRS and not d.startswith('.'))
+        for name in sorted(files):
+            if name.endswith('.py'):
+                stat = os.stat(os.path.join(root, name))
+                digest.update(f'{os.path.relpath(os.path.join(root, name), settings.BASE_DIR)}:{stat.st_mtime_ns}:{stat.st_size}\n'.encode())
+    return f'src-{digest.hexdigest()[:16]}'
+
+
+def code_version():
+    """The version the schema artifact is keyed on."""
+    return getattr(settings, 'CODE_VERSION', '') or _source_fingerprint()
+
+
+def artifact_path(fmt, version=None):
+    return Path(settings.OPENAPI_SCHEMA_DIR) / f'openapi-{version or code_version()}.{fmt}'
+
+
+def generate(fmt):
+    """Introspect the API and return the encoded schema."""
+    # Views read request.user/query_params; give them an anonymous request with no host,
+    # so the document is valid on every domain the API is served from
+    request = Request(APIRequestFactory().get('/swagger.json'))
+    generator = OpenAPISchemaGenerator(API_INFO, url='')
+    schema = generator.get_schema(request=request, public=True)
+    return CODECS[fmt](validators=[]).encode(schema)
+
+
+def write_artifact(fmt, version=None):
+    """Generate the schema and write it to its artifact file. Returns the path."""
+    path = artifact_path(fmt, version)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    content = generate(fmt)
+    # Write and rename, so other workers never read a partial file
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    tmp.write_bytes(content)
+    os.replace(tmp, path)
+    return path
+
+
+def get_artifact(fmt):
+    """Return ``(content, etag)`` for the current code version, generating it if missing."""
+    key = (code_version(), fmt)
+    artifact = _artifacts.get(key)
+    if artifact is None:
+        with _lock:
+            artifact = _artifacts.get(key)
+            if artifact is None:
+                path = artifact_path(fmt, key[0])
+                if not path.exists():
+                    logger.info("No OpenAPI schema artifact for version %s; generating %s", key[0], path)
+                    write_artifact(fmt, key[0])
+                content = path.read_bytes()
+                artifact = _artifacts[key] = (content, hashlib.sha256(content).hexdigest())
+    return artifact
+
+
+def _format(format):
+    return 'yaml' if format == '.yaml' else 'json'
+
+
+@require_safe
+@condition(etag_func=lambda request, format='.json': get_artifact(_format(format))[1])
+def schema_document(request, format='.json'):
+    """Serve the precomputed schema; clients revalidate with If-None-Match."""
+    fmt = _format(format)
+    content, _ = get_artifact(fmt)
+    response = HttpResponse(content, content_type=CODECS[fmt].media_type)
+    response['Cache-Control'] = 'public, no-cache'
+    return response
+
+
+def docs_view(renderer):
+    """
+    The drf-yasg UI page for ``renderer``. Its ``?format=openapi`` variant,
+    which drf-yasg would regenerate, is answered from the artifact.
+    """
+    ui_view = schema_view.with_ui(renderer, cache_timeout=0)
+
+    def view(request, *args, **kwargs):
+        if request.GET.get('format') == 'openapi':
+            return schema_document(request)
+        return ui_view(request, *args, **kwargs)
+    return view
@@ -1,6 +1,7 @@
 """
 Django settings for em_store project.
 """
+import json
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -26,6 +27,8 @@ DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
 SECRET_KEY = os.getenv('DJANGO_SECRET_KEY')
 if not SECRET_KEY:
     raise ValueError("DJANGO_SECRET_KEY environment variable is required")
+# Previous secret keys (comma separated); stored credentials encrypted with them stay readable
+SECRET_KEY_FALLBACKS = [key for key in os.getenv('DJANGO_SECRET_KEY_FALLBACKS', '').split(',') if key]
 
 # Hosts configuration
 ALLOWED_HOSTS = ['*'] if DEBUG else [
@@ -52,6 +55,8 @@ INSTALLED_APPS = [
     'email_entry',
     'unread_emails',
     'campaigns',
+    'jobs',
+    'profiling',
     'api.apps.ApiConfig',
     'auth_app',
 ]
@@ -60,17 +65,38 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # <-- Added for CORS
+    'em_store.metrics.MetricsMiddleware',  # Sampled latency/query metrics, served on /metrics
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'em_store.middleware.CustomCSRFMiddleware',  # Custom CSRF middleware for API
     # 'django.middleware.csrf.CsrfViewMiddleware',  # Disabled for JWT-based auth
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'profiling.middleware.ProfilingMiddleware',  # Profiles staff requests sent with X-Profile: 1
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'auth_app.middleware.RequestLoggingMiddleware',
 ]
 
+# Precomputed OpenAPI schema (see em_store/schema.py). CODE_VERSION keys the
+# artifact; Render sets RENDER_GIT_COMMIT
+CODE_VERSION = os.getenv('CODE_VERSION') or os.getenv('RENDER_GIT_COMMIT', '')
+OPENAPI_SCHEMA_DIR = os.getenv('OPENAPI_SCHEMA_DIR', str(BASE_DIR / 'openapi'))
+SWAGGER_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
+REDOC_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
+
+# Fraction of requests timed by MetricsMiddleware (see em_store/metrics.py)
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', '1.0'))
+
+# On-demand request profiling (see profiling/middleware.py)
+PROFILING_ENGINE = os.getenv('PROFILING_ENGINE', 'cprofile')  # 'cprofile' or 'pyinstrument'
+PROFILING_INTERVAL = float(os.getenv('PROFILING_INTERVAL', '0.001'))  # pyinstrument sampling interval, seconds
+PROFILING_TOP_FUNCTIONS = int(os.getenv('PROFILING_TOP_FUNCTIONS', '60'))
+PROFILING_MAX_REPORTS = int(os.getenv('PROFILING_MAX_REPORTS', '200'))
+
 ROOT_URLCONF = 'em_store.urls'
 
 # Templates configuration
@@ -177,6 +203,11 @@ STORAGES = {
 # CSRF_TRUSTED_ORIGINS = os.getenv('CSRF_TRUSTED_ORIGINS', FRONTEND_URL).split(',')
 
 # Database configuration
+def _conn_max_age(value):
+    # 'none' keeps connections open for the life of the process
+    return None if value.lower() == 'none' else int(value)
+
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -185,9 +216,48 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD', 'postgres'),
         'HOST': os.getenv('DB_HOST', 'localhost'),
         'PORT': os.getenv('DB_PORT', '5432'),
+        # Persistent connections: each web thread reuses its connection across
+        # requests instead of paying connect + TLS + auth on every call
+        'CONN_MAX_AGE': _conn_max_age(os.getenv('DB_CONN_MAX_AGE', '60')),
+        # Ping a reused connection before the request that picks it up
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'True').lower() == 'true',
+        'OPTIONS': {
+            'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '10')),
+        },
     }
 }
 
+# Connection lifetime for the long-running worker commands (run_workers,
+# run_drip_scheduler, sync_inboxes); see em_store/db.py
+DB_WORKER_CONN_MAX_AGE = _conn_max_age(os.getenv('DB_WORKER_CONN_MAX_AGE', 'none'))
+
+# Shared cache used by every worker process (see em_store/cache.py): Redis when
+# REDIS_URL is set (requires the redis package), otherwise the database cache
+# table created by `manage.py createcachetable`
+REDIS_URL = os.getenv('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'em_store',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+            'KEY_PREFIX': 'em_store',
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '10000')),
+            },
+        }
+    }
+
+# Seconds a user's campaign list responses are cached; 0 disables (see campaigns/cache.py)
+CAMPAIGN_LIST_CACHE_SECONDS = int(os.getenv('CAMPAIGN_LIST_CACHE_SECONDS', '300'))
+
 # CORS configuration
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:3000',
@@ -370,8 +440,18 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'em_store.pagination.KeysetPagination',
+    # Throttle histories live in the shared cache, so the limits hold across workers
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': os.getenv('THROTTLE_ANON_RATE', '1000/hour'),
+        'user': os.getenv('THROTTLE_USER_RATE', '10000/hour'),
+    },
 }
 
+# List endpoint page sizes (see em_store/pagination.py)
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', '50'))
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', '500'))
+
 # Security settings
 SECURE_BROWSER_XSS_FILTER = True
 X_FRAME_OPTIONS = 'DENY'
@@ -396,6 +476,72 @@ DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
 
+# R2 attachment uploads and public URLs (see em_store/storage_utils.py)
+R2_PUBLIC_BASE_URL = os.getenv('R2_PUBLIC_BASE_URL', 'https://pub-cbcbce585d8246e0bdf0edecb1542e99.r2.dev/media')
+R2_UPLOAD_MAX_WORKERS = int(os.getenv('R2_UPLOAD_MAX_WORKERS', '4'))
+R2_MULTIPART_THRESHOLD = int(os.getenv('R2_MULTIPART_THRESHOLD', str(8 * 1024 * 1024)))
+R2_MULTIPART_CHUNKSIZE = int(os.getenv('R2_MULTIPART_CHUNKSIZE', str(8 * 1024 * 1024)))
+R2_MULTIPART_CONCURRENCY = int(os.getenv('R2_MULTIPART_CONCURRENCY', '4'))
+
+# Attachment downloads (see em_store/downloads.py)
+ATTACHMENT_DOWNLOAD_REDIRECT = os.getenv('ATTACHMENT_DOWNLOAD_REDIRECT', 'False').lower() == 'true'
+ATTACHMENT_SIGNED_URL_EXPIRY = int(os.getenv('ATTACHMENT_SIGNED_URL_EXPIRY', '300'))
+ATTACHMENT_DOWNLOAD_CHUNK_SIZE = int(os.getenv('ATTACHMENT_DOWNLOAD_CHUNK_SIZE', str(64 * 1024)))
+
+# Campaign delivery settings
+CAMPAIGN_SEND_WORKERS = int(os.getenv('CAMPAIGN_SEND_WORKERS', '8'))
+CAMPAIGN_SMTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv('CAMPAIGN_SMTP_MAX_CONNECTIONS_PER_HOST', '8'))
+CAMPAIGN_SMTP_MESSAGES_PER_CONNECTION = int(os.getenv('CAMPAIGN_SMTP_MESSAGES_PER_CONNECTION', '500'))
+# Per-host adaptive concurrency and circuit breaker (see campaigns/hostcontrol.py)
+CAMPAIGN_SMTP_SLOW_SECONDS = float(os.getenv('CAMPAIGN_SMTP_SLOW_SECONDS', '5'))
+CAMPAIGN_SMTP_BREAKER_BACKOFF = float(os.getenv('CAMPAIGN_SMTP_BREAKER_BACKOFF', '30'))
+CAMPAIGN_SMTP_BREAKER_MAX_BACKOFF = float(os.getenv('CAMPAIGN_SMTP_BREAKER_MAX_BACKOFF', '1800'))
+# Bytes of encoded attachment parts kept per process (see campaigns/mime.py)
+CAMPAIGN_MIME_CACHE_BYTES = int(os.getenv('CAMPAIGN_MIME_CACHE_BYTES', str(64 * 1024 * 1024)))
+
+# Per-account send rate limits (see campaigns/ratelimit.py). JSON overriding the
+# defaults per provider, e.g. {"gmail": {"minute": 60, "day": 2000}}
+CAMPAIGN_RATE_LIMITS = json.loads(os.getenv('CAMPAIGN_RATE_LIMITS', '{}'))
+CAMPAIGN_RATE_LIMIT_BATCH = int(os.getenv('CAMPAIGN_RATE_LIMIT_BATCH', '20'))
+
+# Recipients claimed per send ledger write (see campaigns/ledger.py)
+CAMPAIGN_LEDGER_BATCH = int(os.getenv('CAMPAIGN_LEDGER_BATCH', '500'))
+
+# In-memory cache of decrypted SMTP/IMAP passwords (see em_store/crypto.py)
+CREDENTIAL_CACHE_TTL_SECONDS = int(os.getenv('CREDENTIAL_CACHE_TTL_SECONDS', '300'))
+CREDENTIAL_CACHE_MAX_ENTRIES = int(os.getenv('CREDENTIAL_CACHE_MAX_ENTRIES', '1024'))
+
+# Background job queue settings (see jobs app)
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '300'))
+JOB_HEARTBEAT_SECONDS = int(os.getenv('JOB_HEARTBEAT_SECONDS', '30'))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv('JOB_POLL_INTERVAL_SECONDS', '2'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_BACKOFF_SECONDS = int(os.getenv('JOB_RETRY_BACKOFF_SECONDS', '30'))
+JOB_RETRY_MAX_DELAY_SECONDS = int(os.getenv('JOB_RETRY_MAX_DELAY_SECONDS', '3600'))
+
+# Drip-sequence scheduler settings (see email_entry/drip.py)
+DRIP_TICK_SECONDS = int(os.getenv('DRIP_TICK_SECONDS', '300'))
+DRIP_CHUNK_SIZE = int(os.getenv('DRIP_CHUNK_SIZE', '500'))
+# Longest wait for a rate-limited account before its sends move to the next tick
+DRIP_RATE_LIMIT_MAX_WAIT = int(os.getenv('DRIP_RATE_LIMIT_MAX_WAIT', '30'))
+# Age after which rows still marked 'sending' are taken to belong to a scheduler that died
+DRIP_CLAIM_TIMEOUT_SECONDS = int(os.getenv('DRIP_CLAIM_TIMEOUT_SECONDS', '3600'))
+
+# Email entry CSV/XLSX imports (see email_entry/bulk.py)
+EMAIL_IMPORT_BATCH_SIZE = int(os.getenv('EMAIL_IMPORT_BATCH_SIZE', '5000'))
+EMAIL_IMPORT_DEDUP_WINDOW = int(os.getenv('EMAIL_IMPORT_DEDUP_WINDOW', '100000'))
+
+# IMAP inbox sync settings (see unread_emails/imap_sync.py)
+IMAP_SYNC_MAX_CONNECTING = int(os.getenv('IMAP_SYNC_MAX_CONNECTING', '50'))
+IMAP_SYNC_INITIAL_MESSAGES = int(os.getenv('IMAP_SYNC_INITIAL_MESSAGES', '500'))
+IMAP_SYNC_BATCH_SIZE = int(os.getenv('IMAP_SYNC_BATCH_SIZE', '1000'))
+IMAP_SYNC_FLUSH_SECONDS = float(os.getenv('IMAP_SYNC_FLUSH_SECONDS', '1'))
+IMAP_SYNC_IDLE_SECONDS = int(os.getenv('IMAP_SYNC_IDLE_SECONDS', '1500'))
+IMAP_SYNC_POLL_SECONDS = int(os.getenv('IMAP_SYNC_POLL_SECONDS', '300'))
+IMAP_SYNC_REFRESH_SECONDS = int(os.getenv('IMAP_SYNC_REFRESH_SECONDS', '60'))
+IMAP_SYNC_TIMEOUT_SECONDS = int(os.getenv('IMAP_SYNC_TIMEOUT_SECONDS', '30'))
+IMAP_SYNC_MAX_BACKOFF_SECONDS = int(os.getenv('IMAP_SYNC_MAX_BACKOFF_SECONDS', '900'))
+
 # Allowed file types for uploads
 ALLOWED_FILE_TYPES = [
     'application/pdf',
@@ -1,6 +1,10 @@
+from boto3.s3.transfer import TransferConfig
 from storages.backends.s3boto3 import S3Boto3Storage
+from storages.utils import clean_name
 from django.conf import settings
 
+from em_store.metrics import instrument_boto3_session
+
 class R2MediaStorage(S3Boto3Storage):
     bucket_name = getattr(settings, 'AWS_STORAGE_BUCKET_NAME', 'email-autoamation')
     location = 'media'
@@ -12,25 +16,47 @@ class R2MediaStorage(S3Boto3Storage):
     verify = getattr(settings, 'AWS_S3_VERIFY', True)
     querystring_auth = getattr(settings, 'AWS_QUERYSTRING_AUTH', False)
     
-    # Ensure files are uploaded as single pieces
-    max_memory_size = 0  # Disable memory-based uploads, force file-based
-    multipart_threshold = 0  # Disable multipart uploads
+    # Uploads are streamed from the file object; large files go up as concurrent multipart parts
+    transfer_config = TransferConfig(
+        multipart_threshold=getattr(settings, 'R2_MULTIPART_THRESHOLD', 8 * 1024 * 1024),
+        multipart_chunksize=getattr(settings, 'R2_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024),
+        max_concurrency=getattr(settings, 'R2_MULTIPART_CONCURRENCY', 4),
+        use_threads=True,
+    )
     
     def _get_security_token(self):
         return None  # Not needed for R2
     
+    def _create_session(self):
+        # R2 call durations are reported on /metrics
+        return instrument_boto3_session(super()._create_session())
+    
     def url(self, name, parameters=None, expire=None, http_method=None):
         """
         Generate a public URL for the file using the R2 public domain.
         """
         try:
-            # Use the R2 public domain approach with /media/ prefix
-            public_domain = "pub-cbcbce585d8246e0bdf0edecb1542e99.r2.dev"
-            return f"https://{public_domain}/media/{name}"
+            # Use the R2 public domain (R2_PUBLIC_BASE_URL) approach
+            from em_store.storage_utils import public_url
+            return public_url(name)
         except Exception:
             # Fallback to parent method
             return super().url(name, parameters, expire, http_method)
     
+    def signed_url(self, name, expire=None, parameters=None):
+        """
+        Generate a time-limited signed GET URL for a private download.
+        ``parameters`` are extra GetObject params such as ResponseContentDisposition.
+        """
+        params = {
+            'Bucket': self.bucket.name,
+            'Key': self._normalize_name(clean_name(name)),
+            **(parameters or {}),
+        }
+        return self.bucket.meta.client.generate_presigned_url(
+            'get_object', Params=params, ExpiresIn=expire or self.querystring_expire
+        )
+    
     def _extract_account_id(self):
         """Extract account ID from endpoint URL."""
         try:
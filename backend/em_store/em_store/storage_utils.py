@@ -1,12 +1,22 @@
 import os
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
 from urllib.parse import urljoin, urlparse
 from django.conf import settings
 
+from . import metrics
+
 logger = logging.getLogger(__name__)
 
+DEFAULT_PUBLIC_BASE_URL = 'https://pub-cbcbce585d8246e0bdf0edecb1542e99.r2.dev/media'
+
+_upload_executor = None
+_upload_executor_lock = threading.Lock()
+
 def upload_file_to_r2(file_obj, file_name, content_type=None, folder='attachments'):
     """
     Upload a file to Cloudflare R2 storage and fetch the actual public URL.
@@ -30,14 +40,18 @@ def upload_file_to_r2(file_obj, file_name, content_type=None, folder='attachment
         
         # Handle both file objects and raw content
         if hasattr(file_obj, 'read'):
-            # It's a file-like object
-            file_content = file_obj.read()
+            # It's a file-like object: stream it instead of reading it into memory
+            if hasattr(file_obj, 'seek'):
+                file_obj.seek(0)
+            content = File(file_obj, name=file_name)
         else:
             # It's raw content
-            file_content = file_obj
+            content = ContentFile(file_obj, name=file_name)
+        if content_type:
+            content.content_type = content_type
         
         # Upload the file using R2 storage
-        saved_path = default_storage.save(file_path, ContentFile(file_content))
+        saved_path = default_storage.save(file_path, content)
         
         # Fetch the actual public URL from R2
         file_url = fetch_r2_public_url(saved_path)
@@ -61,6 +75,70 @@ def upload_file_to_r2(file_obj, file_name, content_type=None, folder='attachment
             'error': str(e)
         }
 
+def _get_upload_executor():
+    """
+    Return the process-wide upload pool. Its threads, and the R2 client each
+    of them opens, are reused across requests.
+    """
+    global _upload_executor
+    if _upload_executor is None:
+        with _upload_executor_lock:
+            if _upload_executor is None:
+                _upload_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'R2_UPLOAD_MAX_WORKERS', 4),
+                    thread_name_prefix='r2-upload',
+                )
+    return _upload_executor
+
+def upload_files_to_r2(uploads, max_workers=None):
+    """
+    Upload several files to R2 concurrently.
+    
+    Uploads run on a bounded pool shared by the whole process, so concurrent
+    requests cannot open more than R2_UPLOAD_MAX_WORKERS uploads between them.
+    
+    Args:
+        uploads: List of dicts with the upload_file_to_r2 arguments
+                 (file_obj, file_name, content_type, folder)
+        max_workers: Set to 1 to upload serially in the calling thread
+                     (default: R2_UPLOAD_MAX_WORKERS)
+    
+    Returns:
+        list: upload_file_to_r2 result dicts, in the same order as ``uploads``
+    """
+    if not uploads:
+        return []
+    max_workers = max_workers or getattr(settings, 'R2_UPLOAD_MAX_WORKERS', 4)
+    if len(uploads) == 1 or max_workers <= 1:
+        return [upload_file_to_r2(**upload) for upload in uploads]
+    executor = _get_upload_executor()
+    futures = [executor.submit(upload_file_to_r2, **upload) for upload in uploads]
+    return [future.result() for future in futures]
+
+@lru_cache(maxsize=4096)
+def _public_url(base_url, file_key):
+    return f"{base_url.rstrip('/')}/{file_key.lstrip('/')}"
+
+# A pure function of its arguments: a per-process cache is always correct
+metrics.CACHE_REQUESTS.register_lru_cache('public_url', _public_url)
+
+def public_url(file_key):
+    """
+    Return the public URL for a file key under R2_PUBLIC_BASE_URL.
+    
+    The URL is derived from the key alone, so resolving it never touches the
+    database or R2; results are cached per key.
+    
+    Args:
+        file_key: The key of the file in R2 (relative to the media location)
+        
+    Returns:
+        str: Public URL for the file, or '' for an empty key
+    """
+    if not file_key:
+        return ''
+    return _public_url(getattr(settings, 'R2_PUBLIC_BASE_URL', DEFAULT_PUBLIC_BASE_URL), str(file_key))
+
 def fetch_r2_public_url(file_key):
     """
     Fetch the actual public URL for a file from R2 storage using the public domain.
@@ -71,24 +149,9 @@ def fetch_r2_public_url(file_key):
     Returns:
         str: Actual public URL for the file from R2
     """
-    try:
-        # Use the R2 public domain approach with /media/ prefix
-        # This constructs the public URL directly using the R2 public domain
-        public_domain = "pub-cbcbce585d8246e0bdf0edecb1542e99.r2.dev"
-        url = f"https://{public_domain}/media/{file_key}"
-        logger.debug(f"Generated R2 public URL: {url}")
-        return url
-        
-    except Exception as e:
-        logger.error(f"Error generating R2 public URL: {str(e)}", exc_info=True)
-        # Fallback to storage backend URL method
-        try:
-            url = default_storage.url(file_key)
-            logger.debug(f"Fallback R2 public URL: {url}")
-            return url
-        except Exception as fallback_error:
-            logger.error(f"Fallback URL generation failed: {str(fallback_error)}", exc_info=True)
-            return generate_public_url(file_key)
+    url = public_url(file_key)
+    logger.debug(f"Generated R2 public URL: {url}")
+    return url
 
 def generate_public_url(file_key):
     """
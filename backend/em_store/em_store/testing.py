@@ -0,0 +1,49 @@
+"""
+Test helpers shared by the app test suites.
+
+QueryBudgetMixin checks that an endpoint runs a fixed number of SQL queries
+however many rows it serves. A serializer that follows a relation per row
+(an N+1) makes the count grow with the data and fails the test.
+"""
+import uuid
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+
+class QueryBudgetMixin:
+    """
+    Mixin for TestCase classes.
+
+    ``populate(n)`` must bring the data served by the endpoint up to ``n``
+    rows. Each size in ``sizes`` is populated, then ``url`` is requested once,
+    and the query counts must be identical and within ``budget``.
+    """
+    query_budget_sizes = (10, 1000)
+
+    def _capture(self, client, url):
+        # A fresh in-memory cache stands in for the shared one (as Redis would):
+        # cache-table statements are not counted and cached responses are not served
+        cache = {'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'query-budget-{uuid.uuid4()}',
+        }}
+        with override_settings(CACHES=cache), CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, f"GET {url} returned {response.status_code}")
+        return [query['sql'] for query in queries.captured_queries]
+
+    def assertQueryBudget(self, client, url, budget, populate, sizes=None):
+        counts = {}
+        for size in sizes or self.query_budget_sizes:
+            populate(size)
+            queries = self._capture(client, url)
+            counts[size] = len(queries)
+            self.assertLessEqual(
+                len(queries), budget,
+                f"GET {url} with {size} rows ran {len(queries)} queries (budget {budget}):\n" + '\n'.join(queries),
+            )
+        self.assertEqual(
+            len(set(counts.values())), 1,
+            f"GET {url} query count grows with the row count: {counts}",
+        )
+        return counts
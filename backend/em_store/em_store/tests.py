@@ -0,0 +1,237 @@
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+from cryptography.fernet import InvalidToken
+from django.contrib.auth.models import Group
+from django.db import close_old_connections, connection, connections, transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from . import crypto, metrics
+from . import settings as project_settings
+from .db import autocommit_connection, close_autocommit_connection, use_worker_connections
+from .downloads import parse_range
+
+
+@override_settings(SECRET_KEY='current-secret-key-for-tests', SECRET_KEY_FALLBACKS=[])
+class CredentialEncryptionTests(SimpleTestCase):
+    def test_round_trip(self):
+        token = crypto.encrypt('hunter2')
+        self.assertNotIn('hunter2', token)
+        self.assertEqual(crypto.decrypt(token), 'hunter2')
+
+    def test_fallback_keys_decrypt_and_rotate_re_encrypts(self):
+        with override_settings(SECRET_KEY='previous-secret-key-for-tests'):
+            token = crypto.encrypt('hunter2')
+        with self.assertRaises(InvalidToken):
+            crypto.decrypt(token)
+
+        with override_settings(SECRET_KEY_FALLBACKS=['previous-secret-key-for-tests']):
+            self.assertEqual(crypto.decrypt(token), 'hunter2')
+            rotated = crypto.rotate(token)
+        # Readable with the current key alone, once the fallback is gone
+        self.assertEqual(crypto.decrypt(rotated), 'hunter2')
+
+    def test_decrypt_many(self):
+        token = crypto.encrypt('hunter2')
+        with self.assertLogs('em_store.crypto', 'ERROR'):
+            self.assertEqual(
+                crypto.decrypt_many([token, '', None, 'not-a-token', token, crypto.encrypt('other')]),
+                ['hunter2', None, None, None, 'hunter2', 'other'],
+            )
+
+    @mock.patch.object(crypto, '_fernet', None)
+    def test_keys_are_derived_once_per_secret(self):
+        crypto.derive_key.cache_clear()
+        for _ in range(3):
+            crypto.decrypt(crypto.encrypt('hunter2'))
+        self.assertEqual(crypto.derive_key.cache_info().misses, 1)
+        self.assertIs(crypto.get_fernet(), crypto.get_fernet())
+
+        with override_settings(SECRET_KEY_FALLBACKS=['previous-secret-key-for-tests']):
+            crypto.get_fernet()
+        # The current key is still cached; only the fallback's is new
+        self.assertEqual(crypto.derive_key.cache_info().misses, 2)
+
+
+class CredentialCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = crypto.CredentialCache(max_entries=2, ttl=60)
+        self.decrypt = mock.patch.object(crypto, 'decrypt', wraps=crypto.decrypt).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def account(self, pk=1, password='hunter2', updated_at=1):
+        return SimpleNamespace(
+            _meta=SimpleNamespace(label='tests.Account'), pk=pk,
+            password=crypto.encrypt(password), updated_at=updated_at,
+        )
+
+    def test_hits_until_the_ttl_expires(self):
+        account = self.account()
+        with mock.patch('em_store.crypto.time.monotonic', return_value=1000.0):
+            self.assertEqual(self.cache.get_password(account), 'hunter2')
+            self.assertEqual(self.cache.get_password(account), 'hunter2')
+        self.assertEqual(self.decrypt.call_count, 1)
+        with mock.patch('em_store.crypto.time.monotonic', return_value=1061.0):
+            self.assertEqual(self.cache.get_password(account), 'hunter2')
+        self.assertEqual(self.decrypt.call_count, 2)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        first, second, third = self.account(1), self.account(2), self.account(3)
+        for account in (first, second, first, third):
+            self.cache.get_password(account)
+        self.assertEqual(self.decrypt.call_count, 3)
+        self.cache.get_password(first)
+        self.assertEqual(self.decrypt.call_count, 3)
+        # second was the least recently used when third came in
+        self.cache.get_password(second)
+        self.assertEqual(self.decrypt.call_count, 4)
+
+    def test_changed_row_or_token_misses(self):
+        account = self.account()
+        self.cache.get_password(account)
+        account.updated_at = 2
+        self.cache.get_password(account)
+        self.assertEqual(self.decrypt.call_count, 2)
+        # A password changed with QuerySet.update() keeps updated_at
+        account.password = crypto.encrypt('changed')
+        self.assertEqual(self.cache.get_password(account), 'changed')
+        self.assertEqual(self.decrypt.call_count, 3)
+
+    def test_invalidate_and_empty_values(self):
+        account = self.account()
+        self.cache.get_password(account)
+        self.cache.invalidate(account)
+        self.cache.get_password(account)
+        self.assertEqual(self.decrypt.call_count, 2)
+        account.password = ''
+        self.assertIsNone(self.cache.get_password(account))
+        account.password = 'not-a-token'
+        with self.assertRaises(InvalidToken):
+            self.cache.get_password(account)
+
+
+class CallProbeTests(SimpleTestCase):
+    def test_timed_calls_reach_the_registered_probe_only_while_active(self):
+        probe = mock.Mock()
+        probe.is_active.return_value = False
+        token = crypto.encrypt('hunter2')
+        with mock.patch.object(metrics, '_call_probe', probe):
+            crypto.decrypt(token)
+            probe.record.assert_not_called()
+            probe.is_active.return_value = True
+            crypto.decrypt(token)
+        probe.record.assert_called_once_with('crypto', 'decrypt', mock.ANY)
+
+    def test_no_probe_registered(self):
+        token = crypto.encrypt('hunter2')
+        with mock.patch.object(metrics, '_call_probe', None):
+            self.assertEqual(crypto.decrypt(token), 'hunter2')
+            metrics.record_call('storage', 'GetObject', 0.1)
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_single_ranges(self):
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=90-500', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-500', 100), (0, 99))
+
+    def test_unsatisfiable(self):
+        self.assertIs(parse_range('bytes=100-', 100), False)
+        self.assertIs(parse_range('bytes=20-10', 100), False)
+        self.assertIs(parse_range('bytes=-0', 100), False)
+
+    def test_ignored_headers_send_the_whole_file(self):
+        for header in (None, '', 'bytes=-', 'bytes=0-9,20-29', 'items=0-9', 'bytes=a-b'):
+            self.assertIsNone(parse_range(header, 100))
+
+
+class ConnectionSettingsTests(SimpleTestCase):
+    def test_conn_max_age(self):
+        self.assertIsNone(project_settings._conn_max_age('none'))
+        self.assertIsNone(project_settings._conn_max_age('None'))
+        self.assertEqual(project_settings._conn_max_age('60'), 60)
+        self.assertEqual(project_settings._conn_max_age('0'), 0)
+
+
+class WorkerConnectionTests(TransactionTestCase):
+    def setUp(self):
+        settings_dict = connections.settings['default']
+        saved = {key: settings_dict[key] for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+        self.addCleanup(connection.close)
+        self.addCleanup(settings_dict.update, saved)
+
+    def test_web_connections_are_reused_within_max_age(self):
+        connection.settings_dict.update(CONN_MAX_AGE=60, CONN_HEALTH_CHECKS=True)
+        connection.close()
+        Group.objects.exists()
+        raw = connection.connection
+        close_old_connections()
+        Group.objects.exists()
+        self.assertIs(connection.connection, raw)
+
+        connection.settings_dict['CONN_MAX_AGE'] = 0
+        connection.close()
+        Group.objects.exists()
+        close_old_connections()
+        self.assertIsNone(connection.connection)
+
+    @override_settings(DB_WORKER_CONN_MAX_AGE=None)
+    def test_worker_settings_apply_to_the_next_connection(self):
+        connection.settings_dict.update(CONN_MAX_AGE=0, CONN_HEALTH_CHECKS=False)
+        Group.objects.exists()
+        use_worker_connections()
+        # The alias's live wrapper picks up the new values, on a new connection
+        self.assertIs(connections['default'].settings_dict, connections.settings['default'])
+        self.assertIsNone(connection.settings_dict['CONN_MAX_AGE'])
+        self.assertTrue(connection.settings_dict['CONN_HEALTH_CHECKS'])
+        self.assertIsNone(connection.connection)
+
+        Group.objects.exists()
+        raw = connection.connection
+        self.assertIsNone(connection.close_at)
+        close_old_connections()
+        Group.objects.exists()
+        self.assertIs(connection.connection, raw)
+
+    @override_settings(DB_WORKER_CONN_MAX_AGE=300)
+    def test_worker_max_age_setting(self):
+        use_worker_connections()
+        self.assertEqual(connection.settings_dict['CONN_MAX_AGE'], 300)
+
+
+class AutocommitConnectionTests(TransactionTestCase):
+    """The send ledger and rate limiter rely on these writes surviving a rollback."""
+
+    def setUp(self):
+        self.addCleanup(close_autocommit_connection)
+
+    def test_writes_commit_independently_of_an_enclosing_atomic(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Group.objects.create(name='rolled back')
+                with autocommit_connection().cursor() as cursor:
+                    cursor.execute("INSERT INTO auth_group (name) VALUES ('committed')")
+                # Already visible outside the open transaction
+                with autocommit_connection().cursor() as cursor:
+                    cursor.execute("SELECT name FROM auth_group")
+                    self.assertEqual(cursor.fetchall(), [('committed',)])
+                raise RuntimeError
+        self.assertEqual(list(Group.objects.values_list('name', flat=True)), ['committed'])
+
+    def test_one_side_connection_per_thread(self):
+        wrapper = autocommit_connection()
+        self.assertIsNot(wrapper, connection)
+        self.assertIs(autocommit_connection(), wrapper)
+
+        other = []
+        thread = threading.Thread(target=lambda: (other.append(autocommit_connection()), close_autocommit_connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], wrapper)
+
+        close_autocommit_connection()
+        self.assertIsNone(wrapper.connection)
+        self.assertIsNot(autocommit_connection(), wrapper)
@@ -22,32 +22,15 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.views.generic import RedirectView
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
-
 # Local imports
 from . import views
+from .schema import docs_view, schema_document
 from .views import DebugURLsView, TestAdminView, landing_page
 from unread_emails.views import AdminSubmissionListView
 
 # API imports
 from api.views import get_current_user
 
-# Schema view for API documentation
-schema_view = get_schema_view(
-   openapi.Info(
-      title="Email Campaigns API",
-      default_version='v1',
-      description="API documentation for Email Campaigns",
-      terms_of_service="https://www.yourapp.com/terms/",
-      contact=openapi.Contact(email="contact@yourapp.com"),
-      license=openapi.License(name="Your License"),
-   ),
-   public=True,
-   permission_classes=(permissions.AllowAny,),
-)
-
 urlpatterns = [
     # Landing page
     path('', landing_page, name='landing_page'),
@@ -55,6 +38,9 @@ urlpatterns = [
     # Django admin
     path('admin/', admin.site.urls),
     
+    # Prometheus metrics (staff only)
+    path('metrics', views.metrics, name='metrics'),
+    
     # Debug and test URLs
     path('debug/urls/', DebugURLsView.as_view(), name='debug-urls'),
     path('test/admin/', TestAdminView.as_view(), name='test-admin'),
@@ -69,11 +55,12 @@ urlpatterns = [
     path('api/email-entries/', include('email_entry.urls')),  # Email entries API
     path('api/unread-emails/', include('unread_emails.urls')),  # Unread emails API
     path('api/campaigns/', include('campaigns.urls')),  # Email campaigns API
+    path('api/jobs/', include('jobs.urls')),  # Background job status API
     
-    # API Documentation
-    re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    # API Documentation, served from the precomputed schema (see em_store/schema.py)
+    re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_document, name='schema-json'),
+    path('swagger/', docs_view('swagger'), name='schema-swagger-ui'),
+    path('redoc/', docs_view('redoc'), name='schema-redoc'),
     
     # Include API app URLs (keep this last to avoid overriding other routes)
     path('api/', include('api.urls')),
@@ -4,12 +4,23 @@ from django.views.generic import TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views.decorators.http import require_http_methods
 from django.shortcuts import render
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+
+from . import metrics as request_metrics
 
 def landing_page(request):
     """Render the landing page"""
     return render(request, 'emails/index.html')
 
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    """Request, database and R2 metrics of this worker in Prometheus text format (staff only)."""
+    return HttpResponse(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def list_urls(request):
     """List all URLs in the project"""
     def get_urls(urlpatterns, prefix=''):
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import EmailEntry
+from .models import EmailEntry, EmailImport
 
 
 @admin.register(EmailEntry)
@@ -34,3 +34,14 @@ class EmailEntryAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+
+
+@admin.register(EmailImport)
+class EmailImportAdmin(admin.ModelAdmin):
+    """
+    Admin interface for CSV/XLSX email imports.
+    """
+    list_display = ('file_name', 'campaign', 'created_by', 'status', 'total_rows', 'created', 'duplicates', 'rejected', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('file_name',)
+    readonly_fields = ('created_at', 'finished_at')
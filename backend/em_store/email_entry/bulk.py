@@ -0,0 +1,362 @@
+"""
+Bulk ingestion of email entries.
+
+Uploaded CSV/XLSX files and JSON bulk submissions are validated with a
+compiled regular expression and inserted in batches with a single
+``INSERT ... ON CONFLICT (email) DO NOTHING RETURNING email`` statement per
+batch. Files are read row by row, so an import of any size keeps a flat
+memory profile, and each batch costs one round trip.
+"""
+import csv
+import io
+import logging
+import re
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import connection, transaction
+from django.db.models.functions import Upper
+from django.utils import timezone
+from rest_framework.fields import BooleanField
+
+from campaigns.models import EmailCampaign
+
+from .models import EmailEntry
+
+logger = logging.getLogger(__name__)
+
+# Fast path for plain ASCII addresses; anything else falls back to Django's validator
+EMAIL_RE = re.compile(
+    r"^[A-Za-z0-9.!#$%&'*+/=?^_`{|}~-]+@"
+    r"[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?"
+    r"(?:\.[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?)+$"
+)
+
+# Reasons recorded in the rejects report
+REJECT_MISSING_EMAIL = 'missing_email'
+REJECT_MISSING_NAME = 'missing_name'
+REJECT_INVALID_EMAIL = 'invalid_email'
+REJECT_INVALID_CLIENT_EMAIL = 'invalid_client_email'
+REJECT_DUPLICATE_IN_FILE = 'duplicate_in_file'
+REJECT_DUPLICATE = 'duplicate'
+
+REJECTS_HEADER = ['row', 'email', 'reason']
+
+CLIENT_EMAIL_MAX_LENGTH = EmailEntry._meta.get_field('client_email').max_length
+# Longest address accepted for an entry, the same as for its client_email
+EMAIL_MAX_LENGTH = CLIENT_EMAIL_MAX_LENGTH
+
+
+def is_valid_email(email):
+    """Return True if ``email`` is a syntactically valid address."""
+    if email.isascii():
+        return EMAIL_RE.match(email) is not None and len(email) <= 254
+    try:
+        validate_email(email)
+    except ValidationError:
+        return False
+    return True
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+class RecentSet:
+    """
+    Set that remembers only the last ``maxsize`` keys.
+    Used to catch repeated rows in an upload without holding every address.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+
+    def add(self, key):
+        """Add ``key`` and return True if it was already present."""
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return True
+        self._keys[key] = None
+        if len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)
+        return False
+
+
+def _iter_csv(uploaded_file):
+    uploaded_file.seek(0)
+    text = io.TextIOWrapper(uploaded_file.file, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        reader = csv.reader(text)
+        header = next(reader, None)
+        if header is None:
+            return
+        keys = [(column or '').strip().lower() for column in header]
+        for row in reader:
+            yield dict(zip(keys, row))
+    finally:
+        # Leave the underlying upload open for Django to clean up
+        text.detach()
+
+
+def _iter_xlsx(uploaded_file):
+    try:
+        from openpyxl import load_workbook
+    except ImportError as e:
+        raise ValueError("XLSX uploads require the 'openpyxl' package") from e
+    uploaded_file.seek(0)
+    workbook = load_workbook(uploaded_file.file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        keys = [str(column or '').strip().lower() for column in header]
+        for row in rows:
+            yield {key: '' if value is None else str(value) for key, value in zip(keys, row)}
+    finally:
+        workbook.close()
+
+
+def check_upload_name(name):
+    """Raise ValueError unless ``name`` is a file type that can be imported."""
+    if not (name or '').lower().endswith(('.csv', '.xlsx')):
+        raise ValueError("Unsupported file type. Upload a .csv or .xlsx file.")
+
+
+def iter_upload_rows(uploaded_file):
+    """
+    Yield each data row of an uploaded CSV or XLSX file as a dict keyed by
+    the lower-cased header. Raises ValueError for other file types.
+    """
+    check_upload_name(uploaded_file.name)
+    if uploaded_file.name.lower().endswith('.csv'):
+        return _iter_csv(uploaded_file)
+    return _iter_xlsx(uploaded_file)
+
+
+def insert_entries(rows, date_of_signup=None):
+    """
+    Insert ``(name, email, client_email, campaign_id, unsubscribe)`` tuples in
+    one statement. Rows whose email already exists, in any case, are skipped.
+    Returns the set of inserted emails.
+    """
+    if not rows:
+        return set()
+    names, emails, client_emails, campaign_ids, unsubscribes = zip(*rows)
+    table = EmailEntry._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} (name, email, client_email, campaign_id, unsubscribe, date_of_signup)
+            SELECT t.name, t.email, t.client_email, t.campaign_id, t.unsubscribe, %s
+            FROM unnest(%s::text[], %s::text[], %s::varchar[], %s::integer[], %s::boolean[])
+                AS t(name, email, client_email, campaign_id, unsubscribe)
+            -- Addresses differing only in case are the same subscriber (served by the UPPER(email) index)
+            WHERE NOT EXISTS (SELECT 1 FROM {table} e WHERE UPPER(e.email) = UPPER(t.email))
+            ON CONFLICT (email) DO NOTHING
+            RETURNING email
+            """,
+            [
+                date_of_signup or timezone.localdate(),
+                list(names), list(emails), list(client_emails), list(campaign_ids), list(unsubscribes),
+            ],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def existing_emails(emails):
+    """Return the lower-cased ``emails`` that already have an entry, whatever the case stored."""
+    uppers = {email.upper() for email in emails}
+    if not uppers:
+        return set()
+    return {
+        email.lower() for email in
+        EmailEntry.objects.annotate(email_upper=Upper('email'))
+        .filter(email_upper__in=uppers)
+        .values_list('email', flat=True)
+    }
+
+
+def create_entries(rows, batch_size=None):
+    """Insert validated rows in batches inside one transaction. Returns the inserted emails."""
+    batch_size = batch_size or getattr(settings, 'EMAIL_IMPORT_BATCH_SIZE', 5000)
+    inserted = set()
+    with transaction.atomic():
+        for start in range(0, len(rows), batch_size):
+            inserted |= insert_entries(rows[start:start + batch_size])
+    return inserted
+
+
+def _clean_char(entry, field):
+    """
+    Return ``(value, error)`` for a required text field of a JSON entry, with
+    the checks and messages of DRF's CharField: strings are trimmed, numbers
+    are converted, and other types, null and blank values are errors.
+    """
+    if field not in entry:
+        return None, 'This field is required.'
+    value = entry[field]
+    if value is None:
+        return None, 'This field may not be null.'
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        return None, 'Not a valid string.'
+    value = str(value).strip()
+    if not value:
+        return None, 'This field may not be blank.'
+    return value, None
+
+
+def _clean_boolean(value):
+    """Parse ``value`` as DRF's BooleanField does. Returns ``(value, error)``."""
+    try:
+        if value in BooleanField.TRUE_VALUES:
+            return True, None
+        if value in BooleanField.FALSE_VALUES:
+            return False, None
+    except TypeError:
+        # Unhashable values such as lists and dicts
+        pass
+    if value is None:
+        return None, 'This field may not be null.'
+    return None, 'Must be a valid boolean.'
+
+
+def validate_entries(entries):
+    """
+    Validate JSON email entries for a bulk insert without a query per row.
+
+    Fields are checked as EmailEntrySerializer checks them, and campaign
+    references with a single query for the whole list.
+    Returns ``(rows, errors)``: ``rows`` are tuples for insert_entries and
+    ``errors`` is None, or a list with one DRF-style error dict per entry
+    (empty for valid entries) when any entry is invalid.
+    """
+    campaign_ids = set()
+    for entry in entries:
+        campaign_id = entry.get('campaign')
+        if campaign_id not in (None, ''):
+            campaign_ids.add(str(campaign_id))
+    numeric_ids = {value for value in campaign_ids if value.isdigit()}
+    existing_campaigns = {
+        str(pk) for pk in EmailCampaign.objects.filter(pk__in=numeric_ids).values_list('pk', flat=True)
+    } if numeric_ids else set()
+
+    rows, errors, has_errors = [], [], False
+    for entry in entries:
+        entry_errors = {}
+        email, email_error = _clean_char(entry, 'email')
+        name, name_error = _clean_char(entry, 'name')
+        client_email = entry.get('client_email') or None
+        campaign_id = entry.get('campaign')
+        campaign_id = None if campaign_id in (None, '') else str(campaign_id)
+        unsubscribe, unsubscribe_error = _clean_boolean(entry.get('unsubscribe', False))
+
+        if email_error:
+            entry_errors['email'] = [email_error]
+        elif len(email) > EMAIL_MAX_LENGTH:
+            entry_errors['email'] = [f'Ensure this field has no more than {EMAIL_MAX_LENGTH} characters.']
+        elif not is_valid_email(email):
+            entry_errors['email'] = ['Enter a valid email address.']
+        if name_error:
+            entry_errors['name'] = [name_error]
+        if client_email is not None and (
+            not isinstance(client_email, str)
+            or len(client_email) > CLIENT_EMAIL_MAX_LENGTH
+            or not is_valid_email(client_email.strip())
+        ):
+            entry_errors['client_email'] = ['Enter a valid email address.']
+        if campaign_id is not None and campaign_id not in existing_campaigns:
+            entry_errors['campaign'] = [f'Invalid pk "{campaign_id}" - object does not exist.']
+        if unsubscribe_error:
+            entry_errors['unsubscribe'] = [unsubscribe_error]
+
+        errors.append(entry_errors)
+        if entry_errors:
+            has_errors = True
+            continue
+        rows.append((
+            name,
+            email,
+            client_email.strip() if client_email else None,
+            int(campaign_id) if campaign_id is not None else None,
+            unsubscribe,
+        ))
+    return rows, (errors if has_errors else None)
+
+
+class EmailImporter:
+    """
+    Import rows into EmailEntry in batches and report every rejected row.
+
+    ``rejects`` is a csv writer (or anything with ``writerow``) that receives
+    ``[row_number, email, reason]`` for each row that was not imported.
+    Row numbers count the header as row 1, as spreadsheets do.
+    """
+
+    def __init__(self, campaign=None, client_email=None, batch_size=None, dedup_window=None):
+        self.campaign_id = campaign.pk if campaign is not None else None
+        self.client_email = client_email
+        self.batch_size = batch_size or getattr(settings, 'EMAIL_IMPORT_BATCH_SIZE', 5000)
+        self.recent = RecentSet(dedup_window or getattr(settings, 'EMAIL_IMPORT_DEDUP_WINDOW', 100000))
+        self.date_of_signup = timezone.localdate()
+
+    def _flush(self, batch, rejects, summary):
+        inserted = insert_entries(
+            [(name, email, client_email, self.campaign_id, False) for _, name, email, client_email in batch],
+            date_of_signup=self.date_of_signup,
+        )
+        summary['created'] += len(inserted)
+        for row_number, _, email, _ in batch:
+            if email not in inserted:
+                summary['duplicates'] += 1
+                rejects.writerow([row_number, email, REJECT_DUPLICATE])
+            else:
+                # A repeat later in the same batch is a duplicate of this row
+                inserted.discard(email)
+        batch.clear()
+
+    def run(self, rows, rejects, progress=None):
+        """
+        Import ``rows`` (dicts with name/email/client_email keys) and return the
+        counters. ``progress(**counters)`` is called after every batch.
+        """
+        summary = {'total_rows': 0, 'created': 0, 'duplicates': 0, 'rejected': 0}
+        batch = []
+        for row_number, row in enumerate(rows, start=2):
+            if not any(row.values()):
+                continue
+            summary['total_rows'] += 1
+            email = normalize_email(row.get('email'))
+            name = (row.get('name') or '').strip()
+            reason = None
+            if not email:
+                reason = REJECT_MISSING_EMAIL
+            elif len(email) > EMAIL_MAX_LENGTH or not is_valid_email(email):
+                reason = REJECT_INVALID_EMAIL
+            elif not name:
+                reason = REJECT_MISSING_NAME
+            elif self.recent.add(email):
+                reason = REJECT_DUPLICATE_IN_FILE
+            if reason:
+                if reason == REJECT_DUPLICATE_IN_FILE:
+                    summary['duplicates'] += 1
+                else:
+                    summary['rejected'] += 1
+                rejects.writerow([row_number, email, reason])
+                continue
+
+            client_email = (row.get('client_email') or '').strip() or self.client_email
+            if client_email and (len(client_email) > CLIENT_EMAIL_MAX_LENGTH or not is_valid_email(client_email)):
+                summary['rejected'] += 1
+                rejects.writerow([row_number, email, REJECT_INVALID_CLIENT_EMAIL])
+                continue
+            batch.append((row_number, name, email, client_email))
+            if len(batch) >= self.batch_size:
+                self._flush(batch, rejects, summary)
+                if progress:
+                    progress(**summary)
+        self._flush(batch, rejects, summary)
+        return summary
@@ -0,0 +1,204 @@
+"""
+Drip-sequence scheduler for the email_auto table.
+
+Every step of the sequence has a status column on EmailEntry (``day_one``,
+``day_two`` ...) and is due a fixed number of days after ``date_of_signup``.
+Due rows are claimed in chunks with ``SELECT ... FOR UPDATE SKIP LOCKED``
+and marked ``sending`` in a short transaction that commits before anything
+is sent, so several scheduler processes can run side by side and no row
+locks are held while waiting on SMTP servers or rate limits. The chunk is
+then sent through the campaign delivery engine and its outcomes are written
+in a second short transaction, one bulk UPDATE per status; memory only ever
+holds a single chunk.
+
+Rows that were claimed but not attempted go back to being due. Rows left
+``sending`` by a scheduler that died are reclaimed once their
+``drip_claimed_at`` is DRIP_CLAIM_TIMEOUT_SECONDS old. Every message goes
+through the send ledger (see campaigns/ledger.py), so a reclaimed row whose
+message already went out is marked sent, or failed if the crash hit
+mid-send, and is never sent twice.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from campaigns.delivery import CampaignSender, DeliveryAborted, SMTPConnectionPool
+from campaigns.hostcontrol import HostUnavailable
+from campaigns.models import EmailCampaign
+from campaigns.ratelimit import RateLimited
+
+from .models import EmailEntry
+
+logger = logging.getLogger(__name__)
+
+# (status column, days after date_of_signup) in sequence order
+DRIP_STEPS = (
+    ('day_one', 1),
+    ('day_two', 2),
+    ('day_four', 4),
+    ('day_five', 5),
+    ('day_seven', 7),
+    ('day_nine', 9),
+)
+
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+
+class DripScheduler:
+    """
+    Advance every subscriber whose next drip step is due.
+
+    A step is due when its column is still empty, the previous step has a
+    final status (not ``sending``), the entry is subscribed and belongs to a
+    campaign, and enough days have passed since signup. Steps are processed
+    from last to first so a row moves at most one step per tick, even when it
+    is several days behind.
+
+    The campaign's subject and body are used as the message for every step;
+    rows whose campaign cannot send (no SMTP host, login refused, sending
+    account at its rate limit, SMTP host failing) are left untouched and
+    retried on the next tick.
+    """
+
+    def __init__(self, chunk_size=None, max_workers=None, today=None):
+        self.chunk_size = chunk_size or getattr(settings, 'DRIP_CHUNK_SIZE', 500)
+        self.max_workers = max_workers or getattr(settings, 'CAMPAIGN_SEND_WORKERS', 8)
+        self.today = today or timezone.localdate()
+        self.pool = SMTPConnectionPool(max_connections_per_host=self.max_workers)
+        self._senders = {}
+        self._skipped_campaigns = set()
+
+    def due(self, step):
+        """Return a queryset of the entries for which ``step`` is due."""
+        columns = [column for column, _ in DRIP_STEPS]
+        index = columns.index(step)
+        offset = DRIP_STEPS[index][1]
+        filters = {
+            f'{step}__isnull': True,
+            'unsubscribe': False,
+            'campaign__isnull': False,
+            'date_of_signup__lte': self.today - timedelta(days=offset),
+        }
+        queryset = EmailEntry.objects.filter(**filters).exclude(campaign_id__in=self._skipped_campaigns)
+        if index > 0:
+            previous = columns[index - 1]
+            queryset = queryset.filter(**{f'{previous}__isnull': False}).exclude(**{previous: STATUS_SENDING})
+        return queryset
+
+    def _get_sender(self, campaign_id):
+        """Return a CampaignSender for the campaign, or None if it cannot send this tick."""
+        if campaign_id in self._skipped_campaigns:
+            return None
+        if campaign_id not in self._senders:
+            campaign = EmailCampaign.objects.filter(pk=campaign_id).first()
+            try:
+                if campaign is None:
+                    raise ValueError(f"Campaign {campaign_id} no longer exists")
+                self._senders[campaign_id] = CampaignSender(
+                    campaign, max_workers=self.max_workers, pool=self.pool,
+                    max_rate_wait=getattr(settings, 'DRIP_RATE_LIMIT_MAX_WAIT', 30),
+                    # A failing SMTP host must not hold up the other campaigns' rows
+                    max_host_wait=0,
+                )
+            except Exception as e:
+                logger.warning("Skipping drip sends for campaign %s: %s", campaign_id, e)
+                self._skipped_campaigns.add(campaign_id)
+                return None
+        return self._senders[campaign_id]
+
+    def _send_chunk(self, rows, step, on_result):
+        """Send one claimed chunk of ``step``, reporting every attempted row to ``on_result``."""
+        # Steps are numbered from 1 in the send ledger; 0 is the campaign's own send
+        ledger_step = [column for column, _ in DRIP_STEPS].index(step) + 1
+        by_campaign = {}
+        for entry_id, name, email, campaign_id in rows:
+            by_campaign.setdefault(campaign_id, []).append(
+                EmailEntry(id=entry_id, name=name, email=email, campaign_id=campaign_id)
+            )
+
+        for campaign_id, entries in by_campaign.items():
+            sender = self._get_sender(campaign_id)
+            if sender is None:
+                continue
+            try:
+                sender.send(recipients=entries, on_result=on_result, step=ledger_step)
+            except DeliveryAborted as e:
+                logger.error("Drip sends for campaign %s aborted: %s", campaign_id, e)
+                self._skipped_campaigns.add(campaign_id)
+            except (RateLimited, HostUnavailable) as e:
+                # The rows that were not sent stay due and go out on a later tick
+                logger.info("Drip sends for campaign %s paused: %s", campaign_id, e)
+                self._skipped_campaigns.add(campaign_id)
+
+    def release_stale(self, step):
+        """Make rows of ``step`` left sending for longer than DRIP_CLAIM_TIMEOUT_SECONDS due again."""
+        cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'DRIP_CLAIM_TIMEOUT_SECONDS', 3600))
+        released = EmailEntry.objects.filter(
+            drip_claimed_at__lt=cutoff, **{step: STATUS_SENDING},
+        ).update(drip_claimed_at=None, **{step: None})
+        if released:
+            logger.warning("Reclaimed %s drip %s rows left sending by a stopped scheduler", released, step)
+        return released
+
+    def _claim(self, step):
+        """Mark the next chunk of due rows as sending and return them, committed."""
+        with transaction.atomic():
+            rows = list(
+                self.due(step)
+                .select_for_update(skip_locked=True)
+                .order_by('id')
+                .values_list('id', 'name', 'email', 'campaign_id')[:self.chunk_size]
+            )
+            if rows:
+                EmailEntry.objects.filter(id__in=[row[0] for row in rows]).update(
+                    drip_claimed_at=timezone.now(), **{step: STATUS_SENDING},
+                )
+        return rows
+
+    def _finish(self, step, rows, sent_ids, failed_ids):
+        """Write the outcomes of a chunk; rows that were not attempted become due again."""
+        unsent_ids = {row[0] for row in rows} - set(sent_ids) - set(failed_ids)
+        with transaction.atomic():
+            for ids, status in ((sent_ids, STATUS_SENT), (failed_ids, STATUS_FAILED), (unsent_ids, None)):
+                if ids:
+                    EmailEntry.objects.filter(id__in=ids, **{step: STATUS_SENDING}).update(
+                        drip_claimed_at=None, **{step: status},
+                    )
+
+    def run_step(self, step):
+        """Send every due row of ``step`` chunk by chunk. Returns sent/failed counts."""
+        counts = {'sent': 0, 'failed': 0}
+        self.release_stale(step)
+        while True:
+            rows = self._claim(step)
+            if not rows:
+                return counts
+            sent_ids, failed_ids = [], []
+
+            def on_result(entry, error):
+                (failed_ids if error else sent_ids).append(entry.id)
+
+            try:
+                self._send_chunk(rows, step, on_result)
+            finally:
+                self._finish(step, rows, sent_ids, failed_ids)
+            counts['sent'] += len(sent_ids)
+            counts['failed'] += len(failed_ids)
+            logger.debug("Drip %s chunk: %s sent, %s failed", step, len(sent_ids), len(failed_ids))
+
+    def run_tick(self, steps=None):
+        """Run the given steps (all by default) and return their counts keyed by step."""
+        steps = steps or [column for column, _ in DRIP_STEPS]
+        results = {}
+        try:
+            for step, _ in reversed(DRIP_STEPS):
+                if step in steps:
+                    results[step] = self.run_step(step)
+        finally:
+            self.pool.close_all()
+        return results
@@ -0,0 +1,78 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from campaigns.models import EmailCampaign
+from email_entry.bulk import create_entries, validate_entries
+from email_entry.serializers import EmailEntrySerializer
+
+
+class _Rollback(Exception):
+    pass
+
+
+class _QueryCounter:
+    """Database execute wrapper that counts statements."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Compare the DRF many=True serializer and the bulk insert path for a bulk email entry upload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Entries per upload')
+
+    def _entries(self, count, campaign_id):
+        prefix = uuid.uuid4().hex[:8]
+        return [
+            {'name': f'Bench {i}', 'email': f'bench-{prefix}-{i}@example.com', 'campaign': campaign_id}
+            for i in range(count)
+        ]
+
+    def _serializer_path(self, entries):
+        serializer = EmailEntrySerializer(data=entries, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return len(serializer.data)
+
+    def _bulk_path(self, entries):
+        rows, errors = validate_entries(entries)
+        if errors:
+            raise ValueError("Benchmark entries failed validation")
+        return len(create_entries(rows))
+
+    def _measure(self, label, func, count):
+        # Every run happens in a transaction that is rolled back, leaving no rows behind
+        try:
+            with transaction.atomic():
+                campaign = EmailCampaign.objects.create(
+                    name='benchmark', subject='Benchmark', body='<p>Benchmark</p>', email='sender@example.com',
+                )
+                entries = self._entries(count, campaign.id)
+                queries = _QueryCounter()
+                with connection.execute_wrapper(queries):
+                    started = time.perf_counter()
+                    created = func(entries)
+                    elapsed = time.perf_counter() - started
+                raise _Rollback
+        except _Rollback:
+            pass
+        self.stdout.write(
+            f"{label:<22} {created:>7} rows  {elapsed:8.2f}s  {count / elapsed:10.0f} rows/s  "
+            f"{queries.count:>7} queries"
+        )
+        return elapsed
+
+    def handle(self, *args, **options):
+        count = options['rows']
+        before = self._measure('serializer many=True', self._serializer_path, count)
+        after = self._measure('bulk insert', self._bulk_path, count)
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {before / after:.1f}x"))
@@ -0,0 +1,85 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.test import APIClient
+
+from em_store.pagination import KeysetPagination
+from email_entry.models import EmailEntry
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare page 1 and deep page latency for keyset (/api/email-entries/) and OFFSET pagination'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500000, help='Entries inserted for the run (rolled back)')
+        parser.add_argument('--page-size', type=int, default=50, help='Rows per page')
+        parser.add_argument('--page', type=int, default=10000, help='Deep page number to compare with page 1')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed fetches per measurement')
+
+    def _time(self, func, repeat):
+        func()  # warm-up
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return sorted(timings)[len(timings) // 2] * 1000
+
+    def _get(self, client, url):
+        def fetch():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f"GET {url} failed: {response.status_code}")
+        return fetch
+
+    def _offset_page(self, offset, page_size):
+        def fetch():
+            list(EmailEntry.objects.order_by('date_of_signup', 'id')[offset:offset + page_size])
+        return fetch
+
+    def handle(self, *args, **options):
+        rows, page_size, page = options['rows'], options['page_size'], options['page']
+        offset = (page - 1) * page_size
+        if offset >= rows:
+            raise CommandError(f"--rows must exceed (page - 1) * page-size = {offset}")
+
+        # Everything happens in a transaction that is rolled back, leaving no rows behind
+        try:
+            with transaction.atomic():
+                prefix = uuid.uuid4().hex[:8]
+                EmailEntry.objects.bulk_create(
+                    (EmailEntry(name=f'Bench {i}', email=f'bench-{prefix}-{i}@example.com') for i in range(rows)),
+                    batch_size=5000,
+                )
+                with connection.cursor() as cursor:
+                    cursor.execute(f'ANALYZE {EmailEntry._meta.db_table}')
+
+                # The cursor a client would hold after walking to the deep page
+                last = EmailEntry.objects.order_by('date_of_signup', 'id')[offset - 1]
+                cursor = KeysetPagination().encode_cursor([last.date_of_signup, last.id], False)
+
+                client = APIClient(HTTP_HOST='localhost')
+                base = f'/api/email-entries/?page_size={page_size}'
+                results = {
+                    'keyset page 1': self._time(self._get(client, base), options['repeat']),
+                    f'keyset page {page}': self._time(self._get(client, f'{base}&cursor={cursor}'), options['repeat']),
+                    # OFFSET is timed on the query alone, without the view around it
+                    'offset page 1': self._time(self._offset_page(0, page_size), options['repeat']),
+                    f'offset page {page}': self._time(self._offset_page(offset, page_size), options['repeat']),
+                }
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        for label, ms in results.items():
+            self.stdout.write(f"{label:<24} median {ms:8.2f} ms")
+        self.stdout.write(self.style.SUCCESS(
+            f"Keyset page {page} / page 1: {results[f'keyset page {page}'] / results['keyset page 1']:.2f}x, "
+            f"offset page {page} / page 1: {results[f'offset page {page}'] / results['offset page 1']:.2f}x"
+        ))
@@ -0,0 +1,51 @@
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from em_store.db import use_worker_connections
+from email_entry.drip import DRIP_STEPS, DripScheduler
+
+
+class Command(BaseCommand):
+    help = 'Send due drip-sequence emails (day_one ... day_nine) to subscribed email entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run a single tick and exit')
+        parser.add_argument(
+            '--interval', type=int, default=None,
+            help='Seconds between ticks (default: DRIP_TICK_SECONDS)',
+        )
+        parser.add_argument('--chunk-size', type=int, default=None, help='Rows claimed per transaction')
+        parser.add_argument('--workers', type=int, default=None, help='Sender threads per chunk')
+        parser.add_argument(
+            '--step', action='append', choices=[step for step, _ in DRIP_STEPS],
+            help='Only run this step (may be given more than once)',
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or getattr(settings, 'DRIP_TICK_SECONDS', 300)
+        stopping = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stopping.set())
+        use_worker_connections()
+
+        try:
+            while not stopping.is_set():
+                close_old_connections()
+                started = time.monotonic()
+                scheduler = DripScheduler(chunk_size=options['chunk_size'], max_workers=options['workers'])
+                results = scheduler.run_tick(steps=options['step'])
+                for step, counts in results.items():
+                    if counts['sent'] or counts['failed']:
+                        self.stdout.write(f"{step}: {counts['sent']} sent, {counts['failed']} failed")
+                self.stdout.write(self.style.SUCCESS(
+                    f"Drip tick finished in {time.monotonic() - started:.1f}s"
+                ))
+                if options['once']:
+                    break
+                stopping.wait(interval)
+        except KeyboardInterrupt:
+            pass
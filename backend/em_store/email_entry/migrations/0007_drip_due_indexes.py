@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:10
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without blocking writes to email_auto
+    atomic = False
+
+    dependencies = [
+        ('email_entry', '0006_emailentry_client_email'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='emailentry',
+            index=models.Index(condition=models.Q(('day_one__isnull', True), ('unsubscribe', False)), fields=['date_of_signup', 'id'], name='email_auto_day_one_due_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='emailentry',
+            index=models.Index(condition=models.Q(('day_two__isnull', True), ('unsubscribe', False)), fields=['date_of_signup', 'id'], name='email_auto_day_two_due_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='emailentry',
+            index=models.Index(condition=models.Q(('day_four__isnull', True), ('unsubscribe', False)), fields=['date_of_signup', 'id'], name='email_auto_day_four_due_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='emailentry',
+            index=models.Index(condition=models.Q(('day_five__isnull', True), ('unsubscribe', False)), fields=['date_of_signup', 'id'], name='email_auto_day_five_due_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='emailentry',
+            index=models.Index(condition=models.Q(('day_seven__isnull', True), ('unsubscribe', False)), fields=['date_of_signup', 'id'], name='email_auto_day_seven_due_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='emailentry',
+            index=models.Index(condition=models.Q(('day_nine__isnull', True), ('unsubscribe', False)), fields=['date_of_signup', 'id'], name='email_auto_day_nine_due_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import email_entry.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0006_campaignemailattachment_client'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('email_entry', '0007_drip_due_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(help_text='Name of the uploaded file', max_length=255)),
+                ('status', models.CharField(choices=[('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='processing', max_length=20)),
+                ('total_rows', models.PositiveIntegerField(default=0)),
+                ('created', models.PositiveIntegerField(default=0, help_text='Entries inserted')),
+                ('duplicates', models.PositiveIntegerField(default=0, help_text='Rows skipped as duplicates')),
+                ('rejected', models.PositiveIntegerField(default=0, help_text='Rows skipped as invalid')),
+                ('rejects_file', models.FileField(blank=True, help_text='CSV report of the rows that were not imported', null=True, upload_to=email_entry.models.email_import_rejects_path)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('campaign', models.ForeignKey(blank=True, help_text='Campaign the imported entries were added to', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='email_imports', to='campaigns.emailcampaign')),
+                ('created_by', models.ForeignKey(blank=True, help_text='User who uploaded the file', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='email_imports', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Email Import',
+                'verbose_name_plural': 'Email Imports',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:18
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+    # Build the index without blocking writes to email_auto
+    atomic = False
+
+    dependencies = [
+        ('email_entry', '0008_emailimport'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='emailentry',
+            index=models.Index(django.db.models.functions.text.Upper('email'), name='email_auto_email_upper_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:37
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the index without blocking writes to email_auto
+    atomic = False
+
+    dependencies = [
+        ('email_entry', '0009_email_upper_index'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='emailentry',
+            index=models.Index(fields=['date_of_signup', 'id'], name='email_auto_signup_id_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:37
+
+from django.db import migrations, models
+import email_entry.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('email_entry', '0010_keyset_pagination_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailimport',
+            name='upload_file',
+            field=models.FileField(blank=True, help_text='The uploaded file, kept until it has been imported', null=True, upload_to=email_entry.models.email_import_upload_path),
+        ),
+        migrations.AlterField(
+            model_name='emailimport',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='queued', max_length=20),
+        ),
+    ]
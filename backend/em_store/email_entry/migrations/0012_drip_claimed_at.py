@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:50
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+from django.utils import timezone
+
+DRIP_STEPS = ('day_one', 'day_two', 'day_four', 'day_five', 'day_seven', 'day_nine')
+
+
+def stamp_sending_rows(apps, schema_editor):
+    """Date the rows already left 'sending', so the scheduler reclaims them after the timeout."""
+    EmailEntry = apps.get_model('email_entry', 'EmailEntry')
+    sending = models.Q()
+    for step in DRIP_STEPS:
+        sending |= models.Q(**{step: 'sending'})
+    EmailEntry.objects.filter(sending).update(drip_claimed_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+    # Build the index without blocking writes to email_auto
+    atomic = False
+
+    dependencies = [
+        ('email_entry', '0011_email_import_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailentry',
+            name='drip_claimed_at',
+            field=models.DateTimeField(blank=True, help_text="When the drip scheduler marked the entry's current step as sending", null=True),
+        ),
+        migrations.RunPython(stamp_sending_rows, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='emailentry',
+            index=models.Index(condition=models.Q(('drip_claimed_at__isnull', False)), fields=['drip_claimed_at'], name='email_auto_drip_claimed_idx'),
+        ),
+    ]
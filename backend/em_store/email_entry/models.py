@@ -1,4 +1,7 @@
+import uuid
+from django.conf import settings
 from django.db import models
+from django.db.models.functions import Upper
 from django.core.validators import EmailValidator
 from campaigns.models import EmailCampaign
 
@@ -66,6 +69,12 @@ class EmailEntry(models.Model):
         blank=True,
         help_text="Day nine email status"
     )
+
+    drip_claimed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the drip scheduler marked the entry's current step as sending"
+    )
     
     unsubscribe = models.BooleanField(
         default=False,
@@ -86,6 +95,101 @@ class EmailEntry(models.Model):
         verbose_name = "Email Entry"
         verbose_name_plural = "Email Entries"
         ordering = ['date_of_signup', 'id']  # Oldest first, then by ID for consistent ordering
+        # Partial indexes so the drip scheduler only scans rows still waiting for a step
+        indexes = [
+            models.Index(
+                fields=['date_of_signup', 'id'],
+                condition=models.Q(**{f'{step}__isnull': True, 'unsubscribe': False}),
+                name=f'email_auto_{step}_due_idx',
+            )
+            for step in ('day_one', 'day_two', 'day_four', 'day_five', 'day_seven', 'day_nine')
+        ] + [
+            # Serves case-insensitive (email__iexact) lookups
+            models.Index(Upper('email'), name='email_auto_email_upper_idx'),
+            # Keyset pagination of the list endpoint (see em_store/pagination.py)
+            models.Index(fields=['date_of_signup', 'id'], name='email_auto_signup_id_idx'),
+            # Finds drip claims left behind by a scheduler that died
+            models.Index(
+                fields=['drip_claimed_at'],
+                condition=models.Q(drip_claimed_at__isnull=False),
+                name='email_auto_drip_claimed_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.name} <{self.email}>"
+
+
+def email_import_rejects_path(instance, filename):
+    """Store rejects reports under an unguessable name"""
+    return f'email_imports/{uuid.uuid4()}/{filename}'
+
+
+def email_import_upload_path(instance, filename):
+    """Store uploaded files under an unguessable name until their import has run"""
+    return f'email_imports/{uuid.uuid4()}/uploads/{filename}'
+
+
+class EmailImport(models.Model):
+    """
+    A CSV/XLSX upload of email entries and its outcome.
+    The file is imported by an ``import_email_entries`` job (see
+    email_entry/tasks.py). Rows that were not imported are listed in the
+    rejects report.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_PROCESSING = 'processing'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    file_name = models.CharField(max_length=255, help_text="Name of the uploaded file")
+    campaign = models.ForeignKey(
+        EmailCampaign,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='email_imports',
+        help_text="Campaign the imported entries were added to"
+    )
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='email_imports',
+        help_text="User who uploaded the file"
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    upload_file = models.FileField(
+        upload_to=email_import_upload_path,
+        null=True,
+        blank=True,
+        help_text="The uploaded file, kept until it has been imported"
+    )
+    total_rows = models.PositiveIntegerField(default=0)
+    created = models.PositiveIntegerField(default=0, help_text="Entries inserted")
+    duplicates = models.PositiveIntegerField(default=0, help_text="Rows skipped as duplicates")
+    rejected = models.PositiveIntegerField(default=0, help_text="Rows skipped as invalid")
+    rejects_file = models.FileField(
+        upload_to=email_import_rejects_path,
+        null=True,
+        blank=True,
+        help_text="CSV report of the rows that were not imported"
+    )
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Email Import"
+        verbose_name_plural = "Email Imports"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.file_name} ({self.status})"
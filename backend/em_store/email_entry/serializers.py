@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import EmailEntry
+from rest_framework.reverse import reverse
+from .models import EmailEntry, EmailImport
 from campaigns.serializers import EmailCampaignSerializer
 
 class EmailEntrySerializer(serializers.ModelSerializer):
@@ -26,3 +27,25 @@ class EmailEntrySerializer(serializers.ModelSerializer):
             'name': {'required': True},
             'client_email': {'required': False, 'allow_blank': True, 'allow_null': True}
         }
+
+
+class EmailImportSerializer(serializers.ModelSerializer):
+    status_url = serializers.SerializerMethodField()
+    rejects_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = EmailImport
+        fields = [
+            'id', 'file_name', 'campaign', 'status', 'status_url', 'total_rows', 'created',
+            'duplicates', 'rejected', 'rejects_url', 'error', 'created_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+    def get_status_url(self, obj):
+        return reverse('emailentry-import-detail', args=[obj.pk], request=self.context.get('request'))
+
+    def get_rejects_url(self, obj):
+        """Authenticated download link for the rejects report, if there is one."""
+        if not obj.rejects_file:
+            return None
+        return reverse('emailentry-import-rejects', args=[obj.pk], request=self.context.get('request'))
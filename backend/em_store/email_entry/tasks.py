@@ -0,0 +1,75 @@
+"""
+Background job handlers for email entries, run by ``manage.py run_workers``.
+"""
+import csv
+import io
+import logging
+import os
+import shutil
+import tempfile
+
+from django.core.files import File
+from django.utils import timezone
+
+from jobs.queue import register
+from .bulk import REJECTS_HEADER, EmailImporter, iter_upload_rows
+from .models import EmailImport
+
+logger = logging.getLogger(__name__)
+
+
+def import_failed(job, error):
+    """Mark the import of a failed job failed, e.g. when its worker died mid-import."""
+    EmailImport.objects.filter(
+        pk=job.payload['import_id'],
+        status__in=[EmailImport.STATUS_QUEUED, EmailImport.STATUS_PROCESSING],
+    ).update(status=EmailImport.STATUS_FAILED, error=str(error), finished_at=timezone.now())
+
+
+@register('import_email_entries', on_failure=import_failed)
+def import_email_entries(job):
+    """
+    Import the file of an EmailImport, reporting progress on the job.
+
+    The upload is copied from storage to a local temporary file first, so
+    the CSV/XLSX readers can seek in it. The import row is marked completed
+    or failed, and the stored upload is deleted once it has been imported.
+    """
+    email_import = EmailImport.objects.select_related('campaign').get(pk=job.payload['import_id'])
+    email_import.status = EmailImport.STATUS_PROCESSING
+    email_import.save(update_fields=['status'])
+    importer = EmailImporter(campaign=email_import.campaign, client_email=job.payload.get('client_email'))
+
+    try:
+        with tempfile.TemporaryFile() as upload, tempfile.TemporaryFile() as report:
+            with email_import.upload_file.open('rb') as stored:
+                shutil.copyfileobj(stored, upload)
+            text = io.TextIOWrapper(report, encoding='utf-8', newline='')
+            writer = csv.writer(text)
+            writer.writerow(REJECTS_HEADER)
+            summary = importer.run(
+                iter_upload_rows(File(upload, name=email_import.file_name)), writer, progress=job.update_progress,
+            )
+            text.flush()
+            text.detach()
+
+            if summary['duplicates'] or summary['rejected']:
+                report.seek(0)
+                stem = os.path.splitext(os.path.basename(email_import.file_name))[0] or 'upload'
+                email_import.rejects_file.save(f"{stem}-rejects.csv", File(report), save=False)
+    except Exception as e:
+        logger.exception("Email import %s failed", email_import.pk)
+        email_import.status = EmailImport.STATUS_FAILED
+        email_import.error = str(e)
+        email_import.finished_at = timezone.now()
+        email_import.save(update_fields=['status', 'error', 'finished_at'])
+        raise
+
+    for field, value in summary.items():
+        setattr(email_import, field, value)
+    email_import.status = EmailImport.STATUS_COMPLETED
+    email_import.finished_at = timezone.now()
+    email_import.upload_file.delete(save=False)
+    email_import.save()
+    logger.info("Email import %s completed: %s", email_import.pk, summary)
+    return summary
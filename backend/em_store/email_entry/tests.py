@@ -1,3 +1,565 @@
-from django.test import TestCase
+import csv
+import io
+import tempfile
+import threading
+import unittest
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from campaigns import hostcontrol
+from campaigns.delivery import CampaignSender
+from campaigns.ledger import SendLedger
+from campaigns.models import EmailCampaign
+from campaigns.smtp_sink import CountingHandler, LocalSMTPSink
+from em_store.db import close_autocommit_connection
+from em_store.testing import QueryBudgetMixin
+from jobs import queue
+from jobs.models import Job
+from . import bulk
+from .drip import DRIP_STEPS, STATUS_FAILED, STATUS_SENDING, STATUS_SENT, DripScheduler
+from .models import EmailEntry, EmailImport
+from .tasks import import_email_entries
+
+try:
+    import aiosmtpd
+except ImportError:
+    aiosmtpd = None
+
+
+class CaseInsensitiveEmailLookupTests(TestCase):
+    """
+    email__iexact compiles to UPPER(email) = UPPER(%s) on Postgres, which only
+    the functional UPPER(email) indexes can serve.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        EmailEntry.objects.bulk_create(
+            EmailEntry(name=f'User {i}', email=f'user{i}@example.com') for i in range(200)
+        )
+        EmailCampaign.objects.bulk_create(
+            EmailCampaign(name=f'Campaign {i}', subject='Hi', body='<p>Hi</p>', email=f'sender{i}@example.com')
+            for i in range(50)
+        )
+
+    def explain(self, queryset):
+        # The test tables are tiny; stop the planner preferring a sequential scan
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def test_duplicate_check_uses_upper_index(self):
+        plan = self.explain(EmailEntry.objects.filter(email__iexact='USER42@example.com'))
+        self.assertIn('email_auto_email_upper_idx', plan)
+
+    def test_campaign_email_lookup_uses_upper_index(self):
+        plan = self.explain(EmailCampaign.objects.filter(email__iexact='Sender7@Example.com'))
+        self.assertIn('campaign_email_upper_idx', plan)
+
+    def test_lookup_is_case_insensitive(self):
+        self.assertTrue(EmailEntry.objects.filter(email__iexact='USER42@EXAMPLE.COM').exists())
+
+
+@override_settings(API_PAGE_SIZE=10)
+class KeysetPaginationTests(TestCase):
+    """The list endpoint pages on (date_of_signup, id); every row here shares one date."""
+
+    @classmethod
+    def setUpTestData(cls):
+        EmailEntry.objects.bulk_create(
+            EmailEntry(name=f'User {i}', email=f'page{i}@example.com') for i in range(25)
+        )
+        cls.ids = list(EmailEntry.objects.order_by('date_of_signup', 'id').values_list('id', flat=True))
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def _get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_walks_every_row_once_in_order(self):
+        seen, url, pages = [], '/api/email-entries/', []
+        while url:
+            page = self._get(url)
+            pages.append(page)
+            seen.extend(row['id'] for row in page['results'])
+            url = page['next']
+        self.assertEqual(seen, self.ids)
+        self.assertEqual([len(page['results']) for page in pages], [10, 10, 5])
+        self.assertIsNone(pages[0]['previous'])
+        self.assertNotIn('count', pages[0])
+
+        # Going back from the last page returns the middle page
+        previous = self._get(pages[-1]['previous'])
+        self.assertEqual([row['id'] for row in previous['results']], self.ids[10:20])
+        self.assertIsNotNone(previous['next'])
+
+    def test_count_only_when_requested(self):
+        page = self._get('/api/email-entries/?count=true&page_size=5')
+        self.assertEqual(page['count'], 25)
+        self.assertEqual(len(page['results']), 5)
+        self.assertNotIn('count=', page['next'])
+
+    def test_page_size_is_bounded(self):
+        with override_settings(API_MAX_PAGE_SIZE=20):
+            self.assertEqual(len(self._get('/api/email-entries/?page_size=1000')['results']), 20)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/email-entries/?cursor=bm90LWpzb24').status_code, 404)
+
+    def test_seek_uses_composite_index(self):
+        from em_store.pagination import KeysetPagination
+        cursor_row = EmailEntry.objects.get(id=self.ids[12])
+        seek = KeysetPagination()._seek(
+            EmailEntry, ['date_of_signup', 'id'], [cursor_row.date_of_signup, cursor_row.id], False,
+        )
+        queryset = EmailEntry.objects.order_by('date_of_signup', 'id')
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.filter(seek)[:10].explain()
+        self.assertIn('email_auto_signup_id_idx', plan)
+        self.assertNotIn('Sort', plan)
+
+
+class EntryQueryBudgetTests(QueryBudgetMixin, TestCase):
+    def populate(self, count):
+        campaign = EmailCampaign.objects.first() or EmailCampaign.objects.create(
+            name='Campaign', subject='Hi', body='<p>Hi</p>', email='sender@example.com',
+        )
+        EmailEntry.objects.bulk_create(
+            EmailEntry(name=f'User {i}', email=f'budget{i}@example.com', campaign=campaign)
+            for i in range(EmailEntry.objects.count(), count)
+        )
+
+    def test_entry_list(self):
+        self.assertQueryBudget(APIClient(), '/api/email-entries/?page_size=500', 1, self.populate)
+
+
+def create_entry(campaign, email, days_ago, **fields):
+    entry = EmailEntry.objects.create(name='R', email=email, campaign=campaign, **fields)
+    # date_of_signup is auto_now_add
+    EmailEntry.objects.filter(pk=entry.pk).update(date_of_signup=timezone.localdate() - timedelta(days=days_ago))
+    return entry
+
+
+class DripDueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.campaign = EmailCampaign.objects.create(
+            name='Drip', subject='Hi', body='<p>Hi</p>', email='drip@example.com',
+        )
+        cls.new = create_entry(cls.campaign, 'new@example.com', 1)
+        cls.today = create_entry(cls.campaign, 'today@example.com', 0)
+        cls.second = create_entry(cls.campaign, 'second@example.com', 2, day_one=STATUS_SENT)
+        cls.after_failure = create_entry(cls.campaign, 'failed@example.com', 3, day_one=STATUS_FAILED)
+        cls.in_progress = create_entry(cls.campaign, 'sending@example.com', 2, day_one=STATUS_SENDING)
+        cls.unsubscribed = create_entry(cls.campaign, 'gone@example.com', 1, unsubscribe=True)
+        cls.orphan = create_entry(None, 'orphan@example.com', 1)
+
+    def due_ids(self, step):
+        return set(DripScheduler().due(step).values_list('id', flat=True))
+
+    def test_due_rows_per_step(self):
+        self.assertEqual(self.due_ids('day_one'), {self.new.id})
+        # The previous step must be done (sent or failed), not still sending
+        self.assertEqual(self.due_ids('day_two'), {self.second.id, self.after_failure.id})
+        self.assertEqual(self.due_ids('day_four'), set())
+
+    def test_due_waits_for_the_step_offset(self):
+        later = DripScheduler(today=timezone.localdate() + timedelta(days=2))
+        self.assertIn(self.after_failure.id, set(later.due('day_two').values_list('id', flat=True)))
+        self.assertIn(self.second.id, set(later.due('day_two').values_list('id', flat=True)))
+        self.assertIn(self.today.id, set(later.due('day_one').values_list('id', flat=True)))
+        self.assertNotIn(self.today.id, self.due_ids('day_one'))
+
+    def test_unsubscribed_and_orphan_rows_are_excluded(self):
+        far_future = DripScheduler(today=timezone.localdate() + timedelta(days=30))
+        due = set(far_future.due('day_one').values_list('id', flat=True))
+        self.assertNotIn(self.unsubscribed.id, due)
+        self.assertNotIn(self.orphan.id, due)
+
+
+class RejectingHandler(CountingHandler):
+    """Sink handler that refuses recipients whose address starts with 'bad'."""
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('bad'):
+            return '550 5.1.1 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+
+@unittest.skipIf(aiosmtpd is None, "aiosmtpd is not installed")
+@override_settings(CAMPAIGN_RATE_LIMITS={'default': {}})
+class DripSchedulerTests(TransactionTestCase):
+    """Chunks are claimed and finished in their own transactions, so these tests commit."""
+
+    def setUp(self):
+        self.addCleanup(close_autocommit_connection)
+        self.addCleanup(hostcontrol.reset)
+        self.sink = LocalSMTPSink(handler=RejectingHandler()).start()
+        self.addCleanup(self.sink.stop)
+        self.campaign = EmailCampaign.objects.create(
+            name='Drip', subject='Hi', body='<p>Hi</p>', email='drip@example.com',
+            provider='custom', smtp_host=self.sink.host, smtp_port=self.sink.port, use_ssl=False,
+        )
+
+    def statuses(self, step='day_one'):
+        return dict(EmailEntry.objects.values_list('email', step))
+
+    def test_statuses_are_written_back(self):
+        for email in ('good1@example.com', 'good2@example.com', 'bad1@example.com'):
+            create_entry(self.campaign, email, 1)
+        during_send = []
+        send = CampaignSender.send
+
+        def checked_send(sender, *args, **kwargs):
+            during_send.append((connection.in_atomic_block, set(self.statuses().values())))
+            return send(sender, *args, **kwargs)
+
+        with mock.patch.object(CampaignSender, 'send', checked_send):
+            counts = DripScheduler().run_tick(['day_one'])
+        self.assertEqual(counts, {'day_one': {'sent': 2, 'failed': 1}})
+        # Sent with the claim committed and no transaction (or row lock) open
+        self.assertEqual(during_send, [(False, {STATUS_SENDING})])
+        self.assertEqual(self.statuses(), {
+            'good1@example.com': STATUS_SENT,
+            'good2@example.com': STATUS_SENT,
+            'bad1@example.com': STATUS_FAILED,
+        })
+        self.assertEqual(self.sink.handler.messages, 2)
+
+    def test_rows_not_attempted_become_due_again(self):
+        broken = EmailCampaign.objects.create(
+            name='No host', subject='Hi', body='<p>Hi</p>', email='nohost@example.com', provider='custom',
+        )
+        create_entry(broken, 'stuck@example.com', 1)
+        create_entry(self.campaign, 'good@example.com', 1)
+        counts = DripScheduler().run_tick(['day_one'])
+        self.assertEqual(counts, {'day_one': {'sent': 1, 'failed': 0}})
+        self.assertEqual(self.statuses(), {'stuck@example.com': None, 'good@example.com': STATUS_SENT})
+
+    def test_second_scheduler_skips_locked_rows(self):
+        entries = [create_entry(self.campaign, f'good{i}@example.com', 1) for i in range(4)]
+        claimed, release = threading.Event(), threading.Event()
+        first_rows = []
+
+        def first_scheduler():
+            try:
+                # The outer transaction keeps the claim uncommitted and its rows locked
+                with transaction.atomic():
+                    first_rows.extend(DripScheduler(chunk_size=2)._claim('day_one'))
+                    claimed.set()
+                    release.wait(10)
+                    transaction.set_rollback(True)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=first_scheduler)
+        thread.start()
+        try:
+            self.assertTrue(claimed.wait(10))
+            second_rows = DripScheduler(chunk_size=4)._claim('day_one')
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual([row[0] for row in first_rows], [entry.id for entry in entries[:2]])
+        self.assertEqual([row[0] for row in second_rows], [entry.id for entry in entries[2:]])
+
+    def test_rows_of_a_crashed_scheduler_are_reclaimed(self):
+        entries = [create_entry(self.campaign, f'good{i}@example.com', 2) for i in range(3)]
+        # The scheduler dies after its claim: nothing was sent and _finish never runs
+        self.assertEqual(len(DripScheduler()._claim('day_one')), 3)
+        # It had got as far as claiming the second row in the send ledger
+        SendLedger(self.campaign.pk, 1).claim([entries[1].id])
+
+        self.assertEqual(DripScheduler().run_tick(), {step: {'sent': 0, 'failed': 0} for step, _ in DRIP_STEPS})
+        self.assertEqual(set(self.statuses().values()), {STATUS_SENDING})
+
+        EmailEntry.objects.update(drip_claimed_at=timezone.now() - timedelta(hours=2))
+        counts = DripScheduler().run_tick(['day_one'])
+        # The ledger can't tell whether the second row's message went out, so it isn't sent again
+        self.assertEqual(counts, {'day_one': {'sent': 2, 'failed': 1}})
+        self.assertEqual(self.sink.handler.messages, 2)
+        self.assertEqual(self.statuses(), {
+            'good0@example.com': STATUS_SENT, 'good1@example.com': STATUS_FAILED, 'good2@example.com': STATUS_SENT,
+        })
+        self.assertFalse(EmailEntry.objects.filter(drip_claimed_at__isnull=False).exists())
+        # Later steps go on as usual
+        self.assertEqual(DripScheduler().run_tick(['day_two']), {'day_two': {'sent': 3, 'failed': 0}})
+
+    def test_concurrent_schedulers_send_every_row_once(self):
+        for i in range(12):
+            create_entry(self.campaign, f'good{i}@example.com', 1)
+        counts = []
+
+        def run():
+            try:
+                counts.append(DripScheduler(chunk_size=2, max_workers=2).run_tick(['day_one'])['day_one'])
+            finally:
+                close_autocommit_connection()
+                connection.close()
+
+        threads = [threading.Thread(target=run) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(count['sent'] for count in counts), 12)
+        self.assertEqual(self.sink.handler.messages, 12)
+        self.assertEqual(set(self.statuses().values()), {STATUS_SENT})
+
+
+class RecentSetTests(SimpleTestCase):
+    def test_forgets_keys_past_the_window(self):
+        recent = bulk.RecentSet(2)
+        self.assertFalse(recent.add('a'))
+        self.assertFalse(recent.add('b'))
+        self.assertTrue(recent.add('a'))
+        # 'b' is now the oldest key and drops out
+        self.assertFalse(recent.add('c'))
+        self.assertFalse(recent.add('b'))
+        self.assertTrue(recent.add('c'))
+
+
+class EmailImporterTests(TestCase):
+    def run_import(self, rows, **kwargs):
+        report = io.StringIO()
+        summary = bulk.EmailImporter(**kwargs).run(iter(rows), csv.writer(report))
+        return summary, list(csv.reader(io.StringIO(report.getvalue())))
+
+    def test_invalid_and_duplicate_rows_are_reported(self):
+        summary, rejects = self.run_import([
+            {'name': 'Ann', 'email': 'Ann@Example.com'},
+            {'name': 'Ann again', 'email': ' ann@example.com '},
+            {'name': '', 'email': 'noname@example.com'},
+            {'name': 'Bad', 'email': 'not-an-email'},
+            {'name': 'Nobody', 'email': ''},
+            {'name': '', 'email': ''},
+            {'name': 'Client', 'email': 'client@example.com', 'client_email': 'x' * 300},
+            {'name': 'Bob', 'email': 'bob@example.com'},
+            {'name': 'Foo', 'email': 'foo@example.com', 'client_email': 'foo'},
+        ])
+        self.assertEqual(summary, {'total_rows': 8, 'created': 2, 'duplicates': 1, 'rejected': 5})
+        # Row numbers count the header as row 1; blank rows are skipped but still numbered
+        self.assertEqual(rejects, [
+            ['3', 'ann@example.com', bulk.REJECT_DUPLICATE_IN_FILE],
+            ['4', 'noname@example.com', bulk.REJECT_MISSING_NAME],
+            ['5', 'not-an-email', bulk.REJECT_INVALID_EMAIL],
+            ['6', '', bulk.REJECT_MISSING_EMAIL],
+            ['8', 'client@example.com', bulk.REJECT_INVALID_CLIENT_EMAIL],
+            ['10', 'foo@example.com', bulk.REJECT_INVALID_CLIENT_EMAIL],
+        ])
+        self.assertEqual(
+            sorted(EmailEntry.objects.values_list('email', flat=True)), ['ann@example.com', 'bob@example.com'],
+        )
+
+    def test_rows_conflicting_with_existing_emails(self):
+        EmailEntry.objects.create(name='Existing', email='taken@example.com')
+        summary, rejects = self.run_import([
+            {'name': 'New', 'email': 'new@example.com'},
+            {'name': 'Taken', 'email': 'TAKEN@example.com'},
+        ], batch_size=1)
+        self.assertEqual((summary['created'], summary['duplicates']), (1, 1))
+        self.assertEqual(rejects, [['3', 'taken@example.com', bulk.REJECT_DUPLICATE]])
+        self.assertEqual(EmailEntry.objects.get(email='taken@example.com').name, 'Existing')
+
+    def test_existing_emails_match_in_any_case(self):
+        EmailEntry.objects.create(name='Legacy', email='Legacy@Example.com')
+        summary, rejects = self.run_import([{'name': 'New', 'email': 'legacy@example.com'}])
+        self.assertEqual((summary['created'], summary['duplicates']), (0, 1))
+        self.assertEqual(rejects, [['2', 'legacy@example.com', bulk.REJECT_DUPLICATE]])
+        self.assertEqual(list(EmailEntry.objects.values_list('email', flat=True)), ['Legacy@Example.com'])
+
+    def test_repeats_past_the_dedup_window_are_caught_by_the_insert(self):
+        rows = [{'name': 'R', 'email': f'r{i}@example.com'} for i in range(3)] + [{'name': 'R', 'email': 'r0@example.com'}]
+        summary, rejects = self.run_import(rows, dedup_window=2, batch_size=2)
+        self.assertEqual((summary['created'], summary['duplicates']), (3, 1))
+        self.assertEqual(rejects, [['5', 'r0@example.com', bulk.REJECT_DUPLICATE]])
+
+    def test_xlsx_rows(self):
+        from openpyxl import Workbook
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['Name', ' EMAIL ', 'Client_Email', 'Notes'])
+        sheet.append(['Ann', 'ann@example.com', None, 12])
+        sheet.append([None, None, None, None])
+        sheet.append(['Bob', 'bob@example.com', 'client@example.com', None])
+        content = io.BytesIO()
+        workbook.save(content)
+        upload = SimpleUploadedFile('list.xlsx', content.getvalue())
+        self.assertEqual(list(bulk.iter_upload_rows(upload)), [
+            {'name': 'Ann', 'email': 'ann@example.com', 'client_email': '', 'notes': '12'},
+            {'name': '', 'email': '', 'client_email': '', 'notes': ''},
+            {'name': 'Bob', 'email': 'bob@example.com', 'client_email': 'client@example.com', 'notes': ''},
+        ])
+
+    def test_unsupported_file_type(self):
+        with self.assertRaises(ValueError):
+            bulk.iter_upload_rows(SimpleUploadedFile('list.txt', b'name,email'))
+
+
+class EmailImportUploadTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        storages = override_settings(MEDIA_ROOT=directory.name, STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        storages.enable()
+        self.addCleanup(storages.disable)
+        self.user = get_user_model().objects.create_user(username='importer', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, content, name='list.csv'):
+        return self.client.post(
+            '/api/email-entries/upload/', {'file': SimpleUploadedFile(name, content)}, format='multipart',
+        )
+
+    def test_upload_is_imported_by_a_job(self):
+        EmailEntry.objects.create(name='Existing', email='taken@example.com')
+        response = self.upload(b'name,email\nAnn,ann@example.com\nTaken,taken@example.com\nBad,nope\n')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], EmailImport.STATUS_QUEUED)
+        # Nothing is imported in the request itself
+        self.assertFalse(EmailEntry.objects.filter(email='ann@example.com').exists())
+        job = Job.objects.get(pk=response.data['job_id'])
+        self.assertEqual((job.kind, job.max_attempts), ('import_email_entries', 1))
+
+        import_email_entries(job)
+
+        status = self.client.get(response.data['status_url'])
+        self.assertEqual(status.status_code, 200)
+        self.assertEqual(
+            {key: status.data[key] for key in ('status', 'total_rows', 'created', 'duplicates', 'rejected')},
+            {'status': EmailImport.STATUS_COMPLETED, 'total_rows': 3, 'created': 1, 'duplicates': 1, 'rejected': 1},
+        )
+        self.assertTrue(EmailEntry.objects.filter(email='ann@example.com').exists())
+        self.assertFalse(EmailImport.objects.get(pk=response.data['id']).upload_file)
+        report = self.client.get(status.data['rejects_url'])
+        self.assertEqual(b''.join(report.streaming_content).decode().splitlines(), [
+            # Invalid rows are reported as they are read, duplicates when their batch is inserted
+            'row,email,reason', '4,nope,invalid_email', '3,taken@example.com,duplicate',
+        ])
+
+    def test_failed_import_is_marked_failed(self):
+        response = self.upload(b'not a workbook', name='list.xlsx')
+        job = Job.objects.get(pk=response.data['job_id'])
+        with self.assertRaises(zipfile.BadZipFile):
+            import_email_entries(job)
+        email_import = EmailImport.objects.get(pk=response.data['id'])
+        self.assertEqual(email_import.status, EmailImport.STATUS_FAILED)
+        self.assertTrue(email_import.error)
+
+    def test_import_of_a_dead_worker_is_marked_failed(self):
+        response = self.upload(b'name,email\nAnn,ann@example.com\n')
+        job = queue.lease('worker-a')
+        self.assertEqual(job.pk, response.data['job_id'])
+        EmailImport.objects.filter(pk=response.data['id']).update(status=EmailImport.STATUS_PROCESSING)
+
+        # worker-a dies; its lease expires on the job's only attempt
+        Job.objects.filter(pk=job.pk).update(leased_until=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(queue.lease('worker-b'))
+        status = self.client.get(response.data['status_url']).data
+        self.assertEqual(status['status'], EmailImport.STATUS_FAILED)
+        self.assertIn('worker-a', status['error'])
+
+    def test_rejects_unsupported_files_and_other_users_imports(self):
+        self.assertEqual(self.upload(b'x', name='list.txt').status_code, 400)
+        response = self.upload(b'name,email\nAnn,ann@example.com\n')
+        other = APIClient()
+        other.force_authenticate(get_user_model().objects.create_user(username='other', password='x'))
+        self.assertEqual(other.get(response.data['status_url']).status_code, 404)
+
+
+class BulkEntryTests(TestCase):
+    """JSON lists posted to the entry list are validated like EmailEntrySerializer did."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.campaign = EmailCampaign.objects.create(name='Drip', subject='Hi', body='<p>Hi</p>', email='s@example.com')
+
+    def post(self, entries):
+        return APIClient().post('/api/email-entries/', entries, format='json')
+
+    def test_created(self):
+        response = self.post([
+            {'name': ' Ann ', 'email': 'Ann@Example.com', 'campaign': self.campaign.pk},
+            {'name': 'Bob', 'email': 'bob@example.com', 'unsubscribe': 'false'},
+            {'name': 'Cy', 'email': 'cy@example.com', 'unsubscribe': '1', 'client_email': 'c@example.com'},
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {
+            'created': 3, 'duplicates': 0, 'duplicate_emails': [], 'total_processed': 3,
+            'status': 'completed', 'message': 'Successfully created 3 entries.',
+        })
+        self.assertEqual(
+            list(EmailEntry.objects.order_by('email').values_list('name', 'email', 'unsubscribe', 'campaign_id')),
+            [('Ann', 'ann@example.com', False, self.campaign.pk), ('Bob', 'bob@example.com', False, None),
+             ('Cy', 'cy@example.com', True, None)],
+        )
+
+    def test_existing_emails_are_skipped(self):
+        EmailEntry.objects.create(name='Ann', email='ann@example.com')
+        response = self.post([{'name': 'Ann', 'email': 'ANN@example.com'}, {'name': 'Bob', 'email': 'bob@example.com'}])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response['X-Duplicates'], 'ann@example.com')
+        self.assertEqual(
+            {key: response.data[key] for key in ('created', 'duplicates', 'duplicate_emails', 'total_processed')},
+            {'created': 1, 'duplicates': 1, 'duplicate_emails': ['ann@example.com'], 'total_processed': 2},
+        )
+
+    def test_existing_emails_match_in_any_case(self):
+        EmailEntry.objects.create(name='Legacy', email='Legacy@Example.com')
+        response = self.post([{'name': 'Legacy', 'email': 'legacy@example.com'}])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['duplicate_emails'], ['legacy@example.com'])
+        self.assertEqual(EmailEntry.objects.count(), 1)
+
+    def test_validation_errors_per_entry(self):
+        response = self.post([
+            {'name': 'Ann', 'email': 'ann@example.com'},
+            {'name': '   ', 'email': 'blank@example.com'},
+            {'name': ['Bob'], 'email': 'list@example.com'},
+            {'name': True, 'email': 'bool@example.com'},
+            {'name': None, 'email': 'null@example.com'},
+            {'email': 'missing@example.com'},
+            {'name': 'Long', 'email': 'a' * 250 + '@example.com'},
+            {'name': 'Bad', 'email': 'nope'},
+            {'name': 'Sub', 'email': 'sub@example.com', 'unsubscribe': 'maybe'},
+            {'name': 'Camp', 'email': 'camp@example.com', 'campaign': 999999},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            {key: response.data[key] for key in ('error', 'created', 'status')},
+            {'error': 'Validation error', 'created': 0, 'status': 'validation_error'},
+        )
+        self.assertEqual(response.data['details'], [
+            {},
+            {'name': ['This field may not be blank.']},
+            {'name': ['Not a valid string.']},
+            {'name': ['Not a valid string.']},
+            {'name': ['This field may not be null.']},
+            {'name': ['This field is required.']},
+            {'email': ['Ensure this field has no more than 255 characters.']},
+            {'email': ['Enter a valid email address.']},
+            {'unsubscribe': ['Must be a valid boolean.']},
+            {'campaign': ['Invalid pk "999999" - object does not exist.']},
+        ])
+        self.assertFalse(EmailEntry.objects.exists())
+
+    def test_numeric_names_are_stored_as_text(self):
+        self.assertEqual(self.post([{'name': 42, 'email': 'n@example.com', 'unsubscribe': 0}]).status_code, 201)
+        self.assertEqual(EmailEntry.objects.values_list('name', 'unsubscribe').get(), ('42', False))
@@ -1,59 +1,19 @@
 import logging
+import os
 import traceback
-from django.db import connection
-from django.utils import timezone
+from django.http import FileResponse
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from campaigns.models import EmailCampaign
-from .models import EmailEntry
-from .serializers import EmailEntrySerializer
+from jobs.queue import enqueue
+from .bulk import check_upload_name, create_entries, existing_emails, validate_entries
+from .models import EmailEntry, EmailImport
+from .serializers import EmailEntrySerializer, EmailImportSerializer
 
-# Set up logging
 logger = logging.getLogger(__name__)
-console = logging.StreamHandler()
-console.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-console.setFormatter(formatter)
-logger.addHandler(console)
-
-def log_database_info():
-    """Log database connection and table information"""
-    try:
-        logger.debug("Getting database connection info...")
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT current_database(), current_user, version()")
-            db_info = cursor.fetchone()
-            logger.info(f"Database Info: {db_info}")
-            
-            logger.debug("Fetching table list...")
-            cursor.execute("""
-                SELECT table_name 
-                FROM information_schema.tables 
-                WHERE table_schema = 'public'
-            """)
-            tables = [row[0] for row in cursor.fetchall()]
-            logger.info(f"Available tables: {tables}")
-            
-            if 'email_auto' in tables:
-                logger.debug("Checking email_auto table...")
-                cursor.execute("SELECT COUNT(*) FROM email_auto")
-                count = cursor.fetchone()[0]
-                logger.info(f"email_auto table has {count} rows")
-                
-                # Get column information
-                cursor.execute("""
-                    SELECT column_name, data_type 
-                    FROM information_schema.columns 
-                    WHERE table_name = 'email_auto'
-                """)
-                columns = {row[0]: row[1] for row in cursor.fetchall()}
-                logger.info(f"email_auto columns: {columns}")
-    except Exception as e:
-        error_msg = f"Error checking database info: {str(e)}\n{traceback.format_exc()}"
-        logger.error(error_msg)
-        return error_msg
-    return "Database check completed"
 
 class EmailEntryViewSet(viewsets.ModelViewSet):
     """
@@ -62,6 +22,7 @@ class EmailEntryViewSet(viewsets.ModelViewSet):
     """
     queryset = EmailEntry.objects.all()
     serializer_class = EmailEntrySerializer
+    ordering = ('date_of_signup', 'id')
     permission_classes = [AllowAny]  # No authentication required for email submissions
     
     def get_serializer_context(self):
@@ -87,14 +48,6 @@ class EmailEntryViewSet(viewsets.ModelViewSet):
         return context
         
     def create(self, request, *args, **kwargs):
-        logger.info("\n" + "="*80)
-        logger.info("START: EmailEntryViewSet.create")
-        logger.info(f"Request method: {request.method}")
-        logger.info(f"Request headers: {dict(request.headers)}")
-        logger.info(f"Content type: {request.content_type}")
-        logger.info(f"Query params: {dict(request.query_params)}")
-        logger.info(f"Request data: {request.data}")
-        
         # Check for campaign_id in query params or request data
         campaign_id = None
         campaign = None
@@ -110,25 +63,13 @@ class EmailEntryViewSet(viewsets.ModelViewSet):
         if campaign_id:
             try:
                 campaign = EmailCampaign.objects.get(id=campaign_id)
-                logger.info(f"Processing request for campaign: {campaign.name} (ID: {campaign.id})")
+                logger.debug("Processing request for campaign %s", campaign.id)
             except (EmailCampaign.DoesNotExist, ValueError) as e:
                 logger.warning(f"Campaign with ID {campaign_id} not found - {str(e)}")
             except Exception as e:
                 logger.error(f"Error fetching campaign: {str(e)}")
-        else:
-            logger.info("No campaign_id provided in request")
         
         try:
-            # Log database info
-            logger.info("\n[1/5] Checking database connection...")
-            db_status = log_database_info()
-            logger.info(f"Database status: {db_status}")
-            
-            # Log incoming request data
-            logger.info("\n[2/5] Processing request data...")
-            logger.info(f"Request data type: {type(request.data)}")
-            logger.info(f"Request data: {request.data}")
-            
             # Validate input data
             if not isinstance(request.data, (dict, list)):
                 error_msg = "Invalid data format. Expected object or array of objects."
@@ -140,7 +81,6 @@ class EmailEntryViewSet(viewsets.ModelViewSet):
             
             # Handle single entry
             if isinstance(request.data, dict):
-                logger.info("\n[3/5] Processing single entry...")
                 data = request.data.copy()
                 if campaign:
                     data['campaign'] = campaign.id
@@ -148,7 +88,6 @@ class EmailEntryViewSet(viewsets.ModelViewSet):
             
             # Handle bulk entries (list of entries)
             elif isinstance(request.data, list):
-                logger.info(f"\n[3/5] Processing {len(request.data)} bulk entries...")
                 entries = request.data
                 
                 # Validate all entries are dictionaries
@@ -177,13 +116,7 @@ class EmailEntryViewSet(viewsets.ModelViewSet):
             
         except Exception as e:
             error_msg = f"Error in EmailEntryViewSet.create: {str(e)}"
-            logger.error(f"\n[ERROR] {error_msg}")
-            logger.error(f"Exception type: {type(e).__name__}")
-            logger.error(f"Traceback:\n{traceback.format_exc()}")
-            
-            # Log more details about the exception
-            if hasattr(e, '__dict__'):
-                logger.error(f"Exception details: {e.__dict__}")
+            logger.exception(error_msg)
                 
             return Response(
                 {
@@ -193,10 +126,99 @@ class EmailEntryViewSet(viewsets.ModelViewSet):
                 },
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-        finally:
-            logger.info("\n[5/5] Request processing completed")
-            logger.info("="*80 + "\n")
     
+    @action(
+        detail=False,
+        methods=['post'],
+        permission_classes=[IsAuthenticated],
+        parser_classes=[MultiPartParser, FormParser],
+    )
+    def upload(self, request):
+        """
+        Queue an import of email entries from an uploaded CSV or XLSX file (``file`` field).
+
+        The file needs a header row with ``name`` and ``email`` columns and an
+        optional ``client_email`` column. It is saved to storage and imported
+        by a job worker (manage.py run_workers), not in this request, so its
+        size is limited by neither DATA_UPLOAD_MAX_MEMORY_SIZE nor the request
+        timeout. Responds 202 with the import; poll ``status_url`` for its
+        counters. Rows that are not imported are listed in a CSV report
+        available from ``rejects_url`` once it has finished.
+        """
+        uploaded = request.FILES.get('file')
+        if not uploaded:
+            return Response({"error": "No file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
+
+        campaign = None
+        campaign_id = request.query_params.get('campaign_id') or request.data.get('campaign_id')
+        if campaign_id:
+            try:
+                campaign = EmailCampaign.objects.get(id=campaign_id, created_by=request.user)
+            except (EmailCampaign.DoesNotExist, ValueError):
+                return Response({"error": "Campaign not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            check_upload_name(uploaded.name)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        email_import = EmailImport(
+            file_name=uploaded.name[:255],
+            campaign=campaign,
+            created_by=request.user,
+        )
+        email_import.upload_file.save(os.path.basename(uploaded.name), uploaded, save=False)
+        email_import.save()
+        # One attempt: a rerun would report the rows of the first run as duplicates
+        job = enqueue(
+            'import_email_entries',
+            {'import_id': email_import.pk, 'client_email': request.data.get('client_email') or None},
+            created_by=request.user,
+            max_attempts=1,
+        )
+        logger.info("Email import %s queued as job %s", email_import.pk, job.pk)
+
+        data = EmailImportSerializer(email_import, context={'request': request}).data
+        data['job_id'] = job.pk
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path=r'imports/(?P<import_id>[0-9]+)',
+        permission_classes=[IsAuthenticated],
+    )
+    def import_detail(self, request, import_id=None):
+        """Status and counters of an import."""
+        email_import = self._get_import(request, import_id)
+        if email_import is None:
+            return Response({"error": "Import not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(EmailImportSerializer(email_import, context={'request': request}).data)
+
+    def _get_import(self, request, import_id):
+        imports = EmailImport.objects.all()
+        if not request.user.is_staff:
+            imports = imports.filter(created_by=request.user)
+        return imports.filter(pk=import_id).first()
+
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path=r'imports/(?P<import_id>[0-9]+)/rejects',
+        permission_classes=[IsAuthenticated],
+    )
+    def import_rejects(self, request, import_id=None):
+        """Download the rejected-rows report of an import."""
+        email_import = self._get_import(request, import_id)
+        if email_import is None or not email_import.rejects_file:
+            return Response({"error": "Report not found"}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(
+            email_import.rejects_file.open('rb'),
+            as_attachment=True,
+            filename=os.path.basename(email_import.rejects_file.name),
+            content_type='text/csv',
+        )
+
     def _check_duplicate_email(self, email):
         """Check if email already exists in the database"""
         return EmailEntry.objects.filter(email__iexact=email).exists()
@@ -204,8 +226,6 @@ class EmailEntryViewSet(viewsets.ModelViewSet):
     def _handle_single_entry(self, data):
         """Handle creation of a single email entry"""
         try:
-            logger.info("\n[4/5] Validating single entry...")
-            
             # Check for duplicate email
             email = data.get('email', '').strip().lower()
             if self._check_duplicate_email(email):
@@ -219,15 +239,10 @@ class EmailEntryViewSet(viewsets.ModelViewSet):
                 )
             
             serializer = self.get_serializer(data=data)
-            logger.debug("Running serializer validation...")
             serializer.is_valid(raise_exception=True)
-            
-            logger.debug("Creating database record...")
             self.perform_create(serializer)
             
             headers = self.get_success_headers(serializer.data)
-            logger.info("Single entry created successfully")
-            logger.debug(f"Created entry: {serializer.data}")
             
             return Response(
                 {
@@ -246,7 +261,6 @@ class EmailEntryViewSet(viewsets.ModelViewSet):
     
     def _handle_bulk_entries(self, data):
         """Handle bulk creation of email entries with duplicate checking"""
-        logger.info(f"Processing {len(data)} bulk entries")
         
         # Convert all emails to lowercase for case-insensitive comparison and validate client_email
         for entry in data:
@@ -286,67 +300,28 @@ class EmailEntryViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Check for existing emails in the database
-        existing_emails = set(
-            EmailEntry.objects.filter(
-                email__in=seen_emails
-            ).values_list('email', flat=True)
-        )
+        # Check for existing emails in the database, in any case
+        existing = existing_emails(seen_emails)
         
         # Separate new and duplicate entries
         new_entries = []
         duplicate_entries = []
         
         for entry in data:
-            if entry['email'] in existing_emails:
+            if entry['email'] in existing:
                 duplicate_entries.append(entry['email'])
             else:
                 new_entries.append(entry)
         
         # Only process new entries
         created_count = 0
-        serializer = None
         
         if new_entries:
             try:
-                logger.info(f"Processing {len(new_entries)} new entries")
-                # Initialize serializer with the new entries
-                serializer = self.get_serializer(data=new_entries, many=True)
-                serializer.is_valid(raise_exception=True)
-                
-                # Log the data being saved
-                logger.debug(f"Saving {len(new_entries)} valid entries")
-                self.perform_create(serializer)
-                created_count = len(serializer.data)
-                logger.info(f"Successfully created {created_count} entries")
-                
-            except Exception as e:
-                error_msg = f"Error creating entries: {str(e)}"
-                logger.error(error_msg)
-                
-                # Get validation errors if serializer was initialized
-                validation_errors = {}
-                if serializer is not None and hasattr(serializer, 'errors'):
-                    validation_errors = serializer.errors
-                    logger.error(f"Validation errors: {validation_errors}")
-                
-                logger.error(f"Exception type: {type(e).__name__}")
-                logger.error(f"Traceback:\n{traceback.format_exc()}")
-                
-                # If we have a validation error, include details in the response
-                if hasattr(e, 'detail') and isinstance(e.detail, dict):
-                    return Response(
-                        {
-                            "error": "Validation error",
-                            "details": e.detail,
-                            "created": created_count,
-                            "status": "validation_error"
-                        },
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # For serializer validation errors
+                # Validate every entry up front; the campaign FK is checked with one query
+                rows, validation_errors = validate_entries(new_entries)
                 if validation_errors:
+                    logger.error(f"Validation errors: {validation_errors}")
                     return Response(
                         {
                             "error": "Validation error",
@@ -357,7 +332,19 @@ class EmailEntryViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_400_BAD_REQUEST
                     )
                 
-                # For other errors, return a generic error message
+                inserted = create_entries(rows)
+                created_count = len(inserted)
+                # Rows inserted by a concurrent request since the existence check
+                duplicate_entries.extend(
+                    entry['email'] for entry in new_entries if entry['email'] not in inserted
+                )
+                
+            except Exception as e:
+                error_msg = f"Error creating entries: {str(e)}"
+                logger.error(error_msg)
+                logger.error(f"Exception type: {type(e).__name__}")
+                logger.error(f"Traceback:\n{traceback.format_exc()}")
+                
                 return Response(
                     {
                         "error": "Failed to create some entries",
@@ -387,7 +374,10 @@ class EmailEntryViewSet(viewsets.ModelViewSet):
             response_data["message"] = f"Successfully created {created_count} entries."
             status_code = status.HTTP_201_CREATED
         
-        logger.info(f"Bulk upload completed: {response_data}")
+        logger.info(
+            "Bulk upload completed: %d created, %d duplicates of %d",
+            created_count, len(duplicate_entries), len(data),
+        )
         
         return Response(
             response_data,
@@ -0,0 +1,14 @@
+from django.contrib import admin
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'max_attempts', 'locked_by', 'run_after', 'created_at')
+    list_filter = ('status', 'kind', 'created_at')
+    search_fields = ('kind', 'locked_by', 'last_error')
+    readonly_fields = (
+        'attempts', 'locked_by', 'leased_until', 'heartbeat_at', 'progress', 'result',
+        'last_error', 'created_at', 'updated_at', 'started_at', 'finished_at'
+    )
+    date_hierarchy = 'created_at'
@@ -0,0 +1,59 @@
+import multiprocessing
+import signal
+import time
+
+from django import db
+from django.core.management.base import BaseCommand
+
+from em_store.db import use_worker_connections
+from jobs.worker import Worker
+
+
+def _run_worker():
+    use_worker_connections()
+    worker = Worker()
+    signal.signal(signal.SIGTERM, lambda *args: worker.stopping.set())
+    signal.signal(signal.SIGINT, lambda *args: worker.stopping.set())
+    worker.run()
+
+
+class Command(BaseCommand):
+    help = 'Run background job worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', '-n', type=int, default=2, help='Number of worker processes')
+
+    def handle(self, *args, **options):
+        count = options['processes']
+        stopping = False
+
+        def stop(*args):
+            nonlocal stopping
+            stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        # Children must not inherit the parent's database connection
+        db.connections.close_all()
+
+        processes = {}
+        self.stdout.write(self.style.SUCCESS(f"Starting {count} job worker process(es)"))
+        while not stopping:
+            for index in range(count):
+                process = processes.get(index)
+                if process is None or not process.is_alive():
+                    if process is not None:
+                        self.stderr.write(f"Worker {index} exited with code {process.exitcode}; restarting")
+                    process = multiprocessing.Process(target=_run_worker, name=f'job-worker-{index}')
+                    process.start()
+                    processes[index] = process
+            time.sleep(1)
+
+        self.stdout.write("Stopping workers...")
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in processes.values():
+            process.join()
+        self.stdout.write(self.style.SUCCESS("All workers stopped"))
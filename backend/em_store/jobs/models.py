@@ -0,0 +1,79 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """
+    A unit of background work stored in Postgres.
+
+    Workers lease jobs with ``SELECT ... FOR UPDATE SKIP LOCKED`` (see
+    ``jobs.queue``), keep the lease alive with heartbeats and report progress
+    counters that the job-status endpoint exposes.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=100, help_text="Name of the registered job handler")
+    payload = models.JSONField(default=dict, blank=True, help_text="Arguments passed to the handler")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+
+    # Retry bookkeeping
+    attempts = models.PositiveIntegerField(default=0, help_text="Number of times the job has been leased")
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now, help_text="Earliest time the job may be leased")
+    last_error = models.TextField(blank=True, default='')
+
+    # Lease held by the worker currently running the job
+    locked_by = models.CharField(max_length=255, blank=True, default='')
+    leased_until = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    progress = models.JSONField(default=dict, blank=True, help_text="Progress counters reported by the handler")
+    result = models.JSONField(null=True, blank=True)
+
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='jobs',
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='jobs_job_status_run_after_idx'),
+            models.Index(fields=['created_by', 'created_at', 'id'], name='jobs_job_owner_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+    def update_progress(self, **counters):
+        """
+        Merge ``counters`` into the stored progress and extend the lease.
+        Progress writes double as heartbeats.
+        """
+        self.progress.update(counters)
+        now = timezone.now()
+        lease_seconds = getattr(settings, 'JOB_LEASE_SECONDS', 300)
+        Job.objects.filter(pk=self.pk).update(
+            progress=self.progress,
+            heartbeat_at=now,
+            leased_until=now + timedelta(seconds=lease_seconds),
+        )
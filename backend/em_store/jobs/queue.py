@@ -0,0 +1,172 @@
+"""
+Postgres-backed job queue.
+
+Jobs are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` so any number of
+worker processes can poll the same table without handing a job out twice.
+A claimed job carries a lease; if the worker dies and stops heartbeating, the
+lease expires and another worker picks the job up again.
+"""
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+_failure_handlers = {}
+
+
+def register(kind, on_failure=None):
+    """
+    Decorator registering ``func(job)`` as the handler for jobs of ``kind``.
+    The handler's return value is stored as the job result.
+
+    ``on_failure(job, error)`` is called once a job of ``kind`` has failed
+    for good, including when its worker died during the last attempt and
+    the job never got to clean up after itself.
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        if on_failure is not None:
+            _failure_handlers[kind] = on_failure
+        return func
+    return decorator
+
+
+def get_handler(kind):
+    return _handlers.get(kind)
+
+
+def _job_failed(job, error):
+    """Run the failure handler of a job that has failed for good."""
+    on_failure = _failure_handlers.get(job.kind)
+    if on_failure is None:
+        return
+    try:
+        on_failure(job, error)
+    except Exception:
+        logger.exception("Failure handler of job %s (%s) raised", job.pk, job.kind)
+
+
+def enqueue(kind, payload=None, created_by=None, max_attempts=None, run_after=None):
+    """Create a queued job and return it."""
+    return Job.objects.create(
+        kind=kind,
+        payload=payload or {},
+        created_by=created_by,
+        max_attempts=max_attempts or getattr(settings, 'JOB_MAX_ATTEMPTS', 3),
+        run_after=run_after or timezone.now(),
+    )
+
+
+def lease(worker_id, lease_seconds=None):
+    """
+    Claim the next runnable job for ``worker_id`` and return it, or None.
+
+    Runnable means queued and due, or running with an expired lease (its
+    worker died). Expired jobs that are out of attempts are marked failed.
+    """
+    lease_seconds = lease_seconds or getattr(settings, 'JOB_LEASE_SECONDS', 300)
+    while True:
+        now = timezone.now()
+        expired = None
+        with transaction.atomic():
+            job = (
+                Job.objects
+                .select_for_update(skip_locked=True)
+                .filter(
+                    Q(status=Job.STATUS_QUEUED, run_after__lte=now)
+                    | Q(status=Job.STATUS_RUNNING, leased_until__lt=now)
+                )
+                .order_by('run_after', 'id')
+                .first()
+            )
+            if job is None:
+                return None
+
+            if job.status == Job.STATUS_RUNNING and job.attempts >= job.max_attempts:
+                logger.warning("Job %s lost its lease on its last attempt; marking failed", job.pk)
+                job.status = Job.STATUS_FAILED
+                job.last_error = job.last_error or f"Lease held by {job.locked_by} expired"
+                job.finished_at = now
+                job.save(update_fields=['status', 'last_error', 'finished_at', 'updated_at'])
+                expired = job
+            else:
+                job.status = Job.STATUS_RUNNING
+                job.attempts = F('attempts') + 1
+                job.locked_by = worker_id
+                job.leased_until = now + timedelta(seconds=lease_seconds)
+                job.heartbeat_at = now
+                job.started_at = job.started_at or now
+                job.save(update_fields=[
+                    'status', 'attempts', 'locked_by', 'leased_until',
+                    'heartbeat_at', 'started_at', 'updated_at',
+                ])
+                job.refresh_from_db(fields=['attempts'])
+                return job
+        # Outside the transaction, so the job stays failed whatever the handler does
+        _job_failed(expired, expired.last_error)
+
+
+def heartbeat(job, lease_seconds=None):
+    """Extend the lease of a running job. Returns False if the lease was lost."""
+    lease_seconds = lease_seconds or getattr(settings, 'JOB_LEASE_SECONDS', 300)
+    now = timezone.now()
+    return bool(
+        Job.objects
+        .filter(pk=job.pk, status=Job.STATUS_RUNNING, locked_by=job.locked_by)
+        .update(heartbeat_at=now, leased_until=now + timedelta(seconds=lease_seconds))
+    )
+
+
+def complete(job, result=None):
+    """Mark a job as succeeded and store its result."""
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+        status=Job.STATUS_SUCCEEDED,
+        result=result,
+        leased_until=None,
+        finished_at=timezone.now(),
+        updated_at=timezone.now(),
+    )
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter, capped by JOB_RETRY_MAX_DELAY_SECONDS."""
+    base = getattr(settings, 'JOB_RETRY_BACKOFF_SECONDS', 30)
+    cap = getattr(settings, 'JOB_RETRY_MAX_DELAY_SECONDS', 3600)
+    delay = min(cap, base * (2 ** max(attempts - 1, 0)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def fail(job, error):
+    """
+    Record a failed attempt. The job is re-queued with backoff while it has
+    attempts left, otherwise it is marked failed and its kind's failure
+    handler runs.
+    """
+    now = timezone.now()
+    if job.attempts < job.max_attempts:
+        delay = retry_delay(job.attempts)
+        logger.warning("Job %s attempt %s failed, retrying in %.0fs: %s", job.pk, job.attempts, delay, error)
+        updates = {
+            'status': Job.STATUS_QUEUED,
+            'run_after': now + timedelta(seconds=delay),
+        }
+    else:
+        logger.error("Job %s failed after %s attempts: %s", job.pk, job.attempts, error)
+        updates = {'status': Job.STATUS_FAILED, 'finished_at': now}
+    updated = Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+        last_error=str(error)[:10000],
+        leased_until=None,
+        updated_at=now,
+        **updates,
+    )
+    if updated and updates['status'] == Job.STATUS_FAILED:
+        _job_failed(job, error)
@@ -0,0 +1,248 @@
+import threading
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from campaigns import hostcontrol
+from campaigns.delivery import CampaignSender
+from campaigns.models import EmailCampaign, SendLog
+from campaigns.smtp_sink import CountingHandler, LocalSMTPSink
+from em_store.db import close_autocommit_connection
+from email_entry.models import EmailEntry
+from . import queue
+from .models import Job
+from .worker import Worker
+
+try:
+    import aiosmtpd
+except ImportError:
+    aiosmtpd = None
+
+
+class LeaseTests(TestCase):
+    def test_leases_due_jobs_in_order(self):
+        later = queue.enqueue('noop', run_after=timezone.now() + timedelta(minutes=5))
+        first = queue.enqueue('noop', {'n': 1})
+        second = queue.enqueue('noop', {'n': 2})
+
+        job = queue.lease('worker-a')
+        self.assertEqual(job.pk, first.pk)
+        self.assertEqual((job.status, job.attempts, job.locked_by), (Job.STATUS_RUNNING, 1, 'worker-a'))
+        self.assertEqual(queue.lease('worker-a').pk, second.pk)
+        # Not due yet
+        self.assertIsNone(queue.lease('worker-a'))
+        self.assertEqual(Job.objects.get(pk=later.pk).status, Job.STATUS_QUEUED)
+
+    def test_heartbeat_extends_the_lease(self):
+        queue.enqueue('noop')
+        job = queue.lease('worker-a', lease_seconds=10)
+        leased_until = Job.objects.get(pk=job.pk).leased_until
+
+        self.assertTrue(queue.heartbeat(job, lease_seconds=600))
+        self.assertGreater(Job.objects.get(pk=job.pk).leased_until, leased_until + timedelta(seconds=500))
+
+        # Another worker took the job over: the old one is told it lost the lease
+        Job.objects.filter(pk=job.pk).update(locked_by='worker-b')
+        self.assertFalse(queue.heartbeat(job))
+
+    def test_expired_lease_is_reclaimed(self):
+        queue.enqueue('noop', max_attempts=2)
+        job = queue.lease('worker-a')
+        self.assertIsNone(queue.lease('worker-b'))
+
+        Job.objects.filter(pk=job.pk).update(leased_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = queue.lease('worker-b')
+        self.assertEqual(reclaimed.pk, job.pk)
+        self.assertEqual((reclaimed.attempts, reclaimed.locked_by), (2, 'worker-b'))
+
+        # Out of attempts: an expired lease fails the job instead of running it again
+        Job.objects.filter(pk=job.pk).update(leased_until=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(queue.lease('worker-c'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertIn('worker-b', job.last_error)
+
+    @override_settings(JOB_RETRY_BACKOFF_SECONDS=10, JOB_RETRY_MAX_DELAY_SECONDS=100)
+    def test_retry_delay_backs_off_up_to_the_cap(self):
+        with mock.patch('jobs.queue.random.uniform', return_value=1.0):
+            self.assertEqual([queue.retry_delay(n) for n in (1, 2, 3, 4, 5, 20)], [10, 20, 40, 80, 100, 100])
+        for attempts in (1, 20):
+            delay = queue.retry_delay(attempts)
+            base = min(100, 10 * 2 ** (attempts - 1))
+            self.assertTrue(0.8 * base <= delay <= 1.2 * base)
+
+    def test_fail_retries_until_max_attempts(self):
+        queue.enqueue('noop', max_attempts=2)
+        job = queue.lease('worker-a')
+        queue.fail(job, 'boom')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_QUEUED)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIsNone(job.leased_until)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        job = queue.lease('worker-a')
+        self.assertEqual(job.attempts, 2)
+        queue.fail(job, 'boom again')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error), (Job.STATUS_FAILED, 'boom again'))
+        self.assertIsNotNone(job.finished_at)
+        self.assertIsNone(queue.lease('worker-a'))
+
+    def test_failure_handler_runs_once_the_job_has_failed_for_good(self):
+        failures = []
+        queue.register('flaky', on_failure=lambda job, error: failures.append((job.pk, str(error))))(lambda job: None)
+        first = queue.enqueue('flaky', max_attempts=2)
+        queue.fail(queue.lease('worker-a'), 'boom')
+        self.assertEqual(failures, [])
+        Job.objects.filter(pk=first.pk).update(run_after=timezone.now())
+        queue.fail(queue.lease('worker-a'), 'boom again')
+        self.assertEqual(failures, [(first.pk, 'boom again')])
+
+        # A worker that died on the last attempt never calls fail()
+        second = queue.enqueue('flaky', max_attempts=1)
+        queue.lease('worker-a')
+        Job.objects.filter(pk=second.pk).update(leased_until=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(queue.lease('worker-b'))
+        self.assertEqual(failures[1], (second.pk, 'Lease held by worker-a expired'))
+
+    def test_complete_stores_the_result(self):
+        queue.enqueue('noop')
+        job = queue.lease('worker-a')
+        queue.complete(job, {'sent': 3})
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (Job.STATUS_SUCCEEDED, {'sent': 3}))
+
+
+class ConcurrentLeaseTests(TransactionTestCase):
+    """Leases from other threads use other connections, so these tests commit."""
+
+    def test_locked_job_is_skipped(self):
+        first = queue.enqueue('noop')
+        second = queue.enqueue('noop')
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            try:
+                with transaction.atomic():
+                    Job.objects.select_for_update().get(pk=first.pk)
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        try:
+            self.assertTrue(locked.wait(10))
+            # Doesn't wait for the locked row, takes the next one
+            self.assertEqual(queue.lease('worker-a').pk, second.pk)
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(queue.lease('worker-a').pk, first.pk)
+
+    def test_concurrent_workers_never_lease_the_same_job(self):
+        jobs = [queue.enqueue('noop', {'n': i}) for i in range(40)]
+        leased = []
+
+        def work(worker_id):
+            try:
+                while (job := queue.lease(worker_id)) is not None:
+                    leased.append(job.pk)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(f'worker-{i}',)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(leased), [job.pk for job in jobs])
+        self.assertFalse(Job.objects.exclude(attempts=1).exists())
+
+
+class JobViewSetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.owner = User.objects.create_user(username='owner', password='x')
+        cls.other = User.objects.create_user(username='other', password='x')
+        cls.staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        cls.own_job = queue.enqueue('noop', created_by=cls.owner)
+        cls.other_job = queue.enqueue('noop', created_by=cls.other)
+
+    def _client(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def test_users_only_see_their_own_jobs(self):
+        client = self._client(self.owner)
+        response = client.get('/api/jobs/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([job['id'] for job in response.data['results']], [self.own_job.pk])
+        self.assertEqual(client.get(f'/api/jobs/{self.own_job.pk}/').status_code, 200)
+        self.assertEqual(client.get(f'/api/jobs/{self.other_job.pk}/').status_code, 404)
+
+    def test_staff_see_every_job(self):
+        response = self._client(self.staff).get('/api/jobs/')
+        self.assertEqual({job['id'] for job in response.data['results']}, {self.own_job.pk, self.other_job.pk})
+
+    def test_requires_authentication(self):
+        self.assertEqual(APIClient().get('/api/jobs/').status_code, 401)
+
+
+@unittest.skipIf(aiosmtpd is None, "aiosmtpd is not installed")
+@override_settings(CAMPAIGN_LEDGER_BATCH=3, CAMPAIGN_RATE_LIMITS={'default': {}})
+class SendCampaignRetryTests(TransactionTestCase):
+    """The send ledger is written on its own connection, so these tests commit."""
+
+    def setUp(self):
+        self.addCleanup(close_autocommit_connection)
+        self.addCleanup(hostcontrol.reset)
+        self.sink = LocalSMTPSink(handler=CountingHandler()).start()
+        self.addCleanup(self.sink.stop)
+        self.campaign = EmailCampaign.objects.create(
+            name='Retry', subject='Hi', body='<p>Hi</p>', email='retry@example.com',
+            provider='custom', smtp_host=self.sink.host, smtp_port=self.sink.port, use_ssl=False,
+        )
+        EmailEntry.objects.bulk_create(
+            EmailEntry(name='R', email=f'r{i}@example.com', campaign=self.campaign) for i in range(8)
+        )
+
+    def test_retry_after_a_partial_send_delivers_the_rest(self):
+        job = queue.enqueue('send_campaign', {'campaign_id': self.campaign.pk})
+        self.assertEqual(job.max_attempts, 3)
+        worker = Worker(worker_id='worker-a')
+        get_recipients = CampaignSender.get_recipients
+
+        def crash_after_first_batch(sender):
+            recipients = get_recipients(sender)
+            for _ in range(3):
+                yield next(recipients)
+            raise RuntimeError("worker crashed")
+
+        with mock.patch.object(CampaignSender, 'get_recipients', crash_after_first_batch):
+            self.assertTrue(worker.run_one())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_QUEUED, 1))
+        self.assertIn('worker crashed', job.last_error)
+        self.assertEqual(self.sink.handler.messages, 3)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertTrue(worker.run_one())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_SUCCEEDED, 2))
+        self.assertEqual((job.result['sent'], job.result['skipped']), (5, 3))
+        # Every recipient got exactly one message
+        self.assertEqual(self.sink.handler.messages, 8)
+        self.assertEqual(
+            SendLog.objects.filter(campaign_id=self.campaign.pk, status=SendLog.STATUS_SENT).count(), 8,
+        )
@@ -0,0 +1,24 @@
+from rest_framework import viewsets
+from rest_framework.permissions import IsAuthenticated
+
+from .models import Job
+from .serializers import JobSerializer
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Read-only status of background jobs, including their progress counters.
+    Users only see the jobs they created; staff see all jobs.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+    ordering = ('-created_at', '-id')
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            # Schema generation: no user to filter by
+            return self.queryset.none()
+        if self.request.user.is_staff:
+            return self.queryset
+        return self.queryset.filter(created_by=self.request.user)
@@ -0,0 +1,94 @@
+"""
+Job worker loop used by ``manage.py run_workers``.
+"""
+import logging
+import os
+import socket
+import threading
+import traceback
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils.module_loading import autodiscover_modules
+
+from . import queue
+
+logger = logging.getLogger(__name__)
+
+
+class Heartbeat(threading.Thread):
+    """Background thread that keeps a job's lease alive while its handler runs."""
+
+    def __init__(self, job, interval):
+        super().__init__(name=f'job-{job.pk}-heartbeat', daemon=True)
+        self.job = job
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stop_event.wait(self.interval):
+                if not queue.heartbeat(self.job):
+                    logger.warning("Job %s lost its lease", self.job.pk)
+                    return
+        except Exception as e:
+            logger.error("Heartbeat for job %s failed: %s", self.job.pk, e)
+        finally:
+            # Threads get their own DB connection; don't leak it
+            connection.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class Worker:
+    """Polls the job table, runs handlers and records the outcome."""
+
+    def __init__(self, worker_id=None, poll_interval=None, heartbeat_interval=None):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_interval = poll_interval or getattr(settings, 'JOB_POLL_INTERVAL_SECONDS', 2)
+        self.heartbeat_interval = heartbeat_interval or getattr(settings, 'JOB_HEARTBEAT_SECONDS', 30)
+        self.stopping = threading.Event()
+        # Import every app's tasks module so their handlers are registered
+        autodiscover_modules('tasks')
+
+    def run_one(self):
+        """Lease and run a single job. Returns False if there was nothing to do."""
+        close_old_connections()
+        job = queue.lease(self.worker_id)
+        if job is None:
+            return False
+
+        handler = queue.get_handler(job.kind)
+        if handler is None:
+            queue.fail(job, f"No handler registered for job kind '{job.kind}'")
+            return True
+
+        logger.info("Worker %s running job %s (%s), attempt %s", self.worker_id, job.pk, job.kind, job.attempts)
+        heartbeat = Heartbeat(job, self.heartbeat_interval)
+        heartbeat.start()
+        try:
+            result = handler(job)
+        except Exception as e:
+            heartbeat.stop()
+            logger.debug(traceback.format_exc())
+            queue.fail(job, f"{type(e).__name__}: {e}")
+        else:
+            heartbeat.stop()
+            queue.complete(job, result)
+            logger.info("Job %s finished", job.pk)
+        return True
+
+    def run(self):
+        """Run jobs until ``stopping`` is set."""
+        logger.info("Worker %s started", self.worker_id)
+        while not self.stopping.is_set():
+            try:
+                if not self.run_one():
+                    self.stopping.wait(self.poll_interval)
+            except Exception as e:
+                logger.error("Worker %s error: %s", self.worker_id, e, exc_info=True)
+                connection.close()
+                self.stopping.wait(self.poll_interval)
+        logger.info("Worker %s stopped", self.worker_id)
@@ -0,0 +1,66 @@
+import json
+
+from django.contrib import admin
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+
+from .models import ProfileReport
+
+
+@admin.register(ProfileReport)
+class ProfileReportAdmin(admin.ModelAdmin):
+    list_display = (
+        'created_at', 'method', 'path', 'status_code', 'duration_ms', 'sql_count', 'sql_ms',
+        'crypto_calls', 'storage_calls', 'storage_ms', 'user', 'report_link',
+    )
+    list_filter = ('method', 'status_code', 'engine', 'created_at')
+    search_fields = ('path', 'endpoint', 'user__username')
+    list_select_related = ('user',)
+    date_hierarchy = 'created_at'
+    exclude = ('summary', 'report')
+    readonly_fields = (
+        'user', 'method', 'path', 'endpoint', 'status_code', 'duration_ms',
+        'sql_count', 'sql_ms', 'crypto_calls', 'crypto_ms', 'storage_calls', 'storage_ms',
+        'engine', 'created_at', 'summary_display', 'report_link', 'report_display',
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        urls = [
+            path(
+                '<int:pk>/report/',
+                self.admin_site.admin_view(self.raw_report_view),
+                name='profiling_profilereport_report',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def raw_report_view(self, request, pk):
+        """Serve the profiler output on its own page (pyinstrument reports are full HTML documents)."""
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        profile = get_object_or_404(ProfileReport, pk=pk)
+        content_type = 'text/html' if profile.report_format == ProfileReport.FORMAT_HTML else 'text/plain'
+        return HttpResponse(profile.report, content_type=f'{content_type}; charset=utf-8')
+
+    @admin.display(description='Report')
+    def report_link(self, obj):
+        url = reverse('admin:profiling_profilereport_report', args=[obj.pk])
+        return format_html('<a href="{}" target="_blank">{}</a>', url, obj.engine)
+
+    @admin.display(description='Summary')
+    def summary_display(self, obj):
+        return format_html('<pre>{}</pre>', json.dumps(obj.summary, indent=2))
+
+    @admin.display(description='Profile')
+    def report_display(self, obj):
+        if obj.report_format == ProfileReport.FORMAT_HTML:
+            return 'Open the report link above.'
+        return format_html('<pre style="white-space: pre; overflow-x: auto">{}</pre>', obj.report)
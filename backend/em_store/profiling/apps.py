@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class ProfilingConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'profiling'
+
+    def ready(self):
+        from em_store import metrics
+        from . import probes
+
+        metrics.register_call_probe(probes)
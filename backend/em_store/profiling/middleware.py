@@ -0,0 +1,134 @@
+"""
+On-demand profiling of single requests.
+
+A staff user (session or JWT) sends ``X-Profile: 1`` and the rest of the
+middleware chain and the view run under a profiler: cProfile by default, or
+pyinstrument's sampling profiler when PROFILING_ENGINE is ``pyinstrument``
+and the package is installed. SQL statements, credential crypto and R2 calls
+are counted and timed alongside (see ``profiling.probes``), and the result is
+stored as a ProfileReport that staff read in the admin. The response carries
+``X-Profile-Id`` and a one-line ``X-Profile-Summary``.
+
+Requests without the header pay for one dictionary lookup.
+"""
+import cProfile
+import io
+import logging
+import pstats
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from em_store.metrics import _endpoint
+from . import probes
+from .models import ProfileReport
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+logger = logging.getLogger(__name__)
+
+# Only one profiler can be attached to the interpreter at a time
+_profiler_lock = threading.Lock()
+
+
+def _staff_user(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user if user.is_staff else None
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    if authenticated and authenticated[0].is_staff:
+        return authenticated[0]
+    return None
+
+
+class ProfilingMiddleware:
+    """Profiles requests from staff users that send ``X-Profile: 1``."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.META.get('HTTP_X_PROFILE') != '1':
+            return self.get_response(request)
+        user = _staff_user(request)
+        if user is None:
+            return self.get_response(request)
+        if not _profiler_lock.acquire(blocking=False):
+            logger.info("Not profiling %s %s: another profile is running", request.method, request.path)
+            response = self.get_response(request)
+            response['X-Profile-Summary'] = 'busy'
+            return response
+        try:
+            return self._profile(request, user)
+        finally:
+            _profiler_lock.release()
+
+    def _run(self, request):
+        """Return (response, engine, report format, report)."""
+        if getattr(settings, 'PROFILING_ENGINE', 'cprofile') == 'pyinstrument' and pyinstrument is not None:
+            profiler = pyinstrument.Profiler(interval=getattr(settings, 'PROFILING_INTERVAL', 0.001))
+            profiler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.stop()
+            return response, 'pyinstrument', ProfileReport.FORMAT_HTML, profiler.output_html()
+
+        profiler = cProfile.Profile()
+        response = profiler.runcall(self.get_response, request)
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(getattr(settings, 'PROFILING_TOP_FUNCTIONS', 60))
+        return response, 'cprofile', ProfileReport.FORMAT_TEXT, stream.getvalue()
+
+    def _profile(self, request, user):
+        with probes.collecting() as collector, connection.execute_wrapper(collector.sql_wrapper):
+            started = time.perf_counter()
+            response, engine, report_format, report = self._run(request)
+            elapsed = time.perf_counter() - started
+
+        crypto_calls, crypto_seconds = collector.totals('crypto')
+        storage_calls, storage_seconds = collector.totals('storage')
+        sql_seconds = sum(seconds for _, seconds in collector.queries)
+        profile = ProfileReport.objects.create(
+            user=user,
+            method=request.method,
+            path=request.get_full_path()[:2048],
+            endpoint=_endpoint(request)[:255],
+            status_code=response.status_code,
+            duration_ms=elapsed * 1000,
+            sql_count=len(collector.queries),
+            sql_ms=sql_seconds * 1000,
+            crypto_calls=crypto_calls,
+            crypto_ms=crypto_seconds * 1000,
+            storage_calls=storage_calls,
+            storage_ms=storage_seconds * 1000,
+            summary=collector.summary(),
+            engine=engine,
+            report_format=report_format,
+            report=report,
+        )
+        self._prune()
+
+        response['X-Profile-Id'] = str(profile.pk)
+        response['X-Profile-Summary'] = (
+            f"total={elapsed * 1000:.1f}ms sql={len(collector.queries)}/{sql_seconds * 1000:.1f}ms "
+            f"crypto={crypto_calls}/{crypto_seconds * 1000:.1f}ms storage={storage_calls}/{storage_seconds * 1000:.1f}ms"
+        )
+        return response
+
+    def _prune(self):
+        keep = getattr(settings, 'PROFILING_MAX_REPORTS', 200)
+        stale = list(ProfileReport.objects.values_list('pk', flat=True)[keep:])
+        if stale:
+            ProfileReport.objects.filter(pk__in=stale).delete()
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=2048)),
+                ('endpoint', models.CharField(blank=True, default='', help_text='Route pattern the request resolved to', max_length=255)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('duration_ms', models.FloatField()),
+                ('sql_count', models.PositiveIntegerField(default=0)),
+                ('sql_ms', models.FloatField(default=0)),
+                ('crypto_calls', models.PositiveIntegerField(default=0)),
+                ('crypto_ms', models.FloatField(default=0)),
+                ('storage_calls', models.PositiveIntegerField(default=0)),
+                ('storage_ms', models.FloatField(default=0)),
+                ('summary', models.JSONField(blank=True, default=dict, help_text='Slowest queries and per-call breakdown')),
+                ('engine', models.CharField(help_text='Profiler that produced the report', max_length=20)),
+                ('report_format', models.CharField(choices=[('text', 'Text'), ('html', 'HTML')], default='text', max_length=10)),
+                ('report', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='profile_reports', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.db import models
+
+
+class ProfileReport(models.Model):
+    """
+    A profile of one request, captured by ``profiling.middleware.ProfilingMiddleware``
+    when a staff user sends ``X-Profile: 1``.
+    """
+    FORMAT_TEXT = 'text'
+    FORMAT_HTML = 'html'
+    FORMAT_CHOICES = [
+        (FORMAT_TEXT, 'Text'),
+        (FORMAT_HTML, 'HTML'),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='profile_reports',
+    )
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=2048)
+    endpoint = models.CharField(max_length=255, blank=True, default='', help_text="Route pattern the request resolved to")
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+
+    # Attributed calls
+    sql_count = models.PositiveIntegerField(default=0)
+    sql_ms = models.FloatField(default=0)
+    crypto_calls = models.PositiveIntegerField(default=0)
+    crypto_ms = models.FloatField(default=0)
+    storage_calls = models.PositiveIntegerField(default=0)
+    storage_ms = models.FloatField(default=0)
+    summary = models.JSONField(default=dict, blank=True, help_text="Slowest queries and per-call breakdown")
+
+    engine = models.CharField(max_length=20, help_text="Profiler that produced the report")
+    report_format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default=FORMAT_TEXT)
+    report = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
@@ -0,0 +1,102 @@
+"""
+Call probes feeding the per-request profile reports.
+
+``collecting()`` opens a Collector for the current request. Code paths worth
+attributing (credential crypto, R2 calls) report into it through
+``em_store.metrics``, which this module is registered with in
+``ProfilingConfig.ready``. When no profile is running, the only cost is a
+truthiness check on a module-level set, so the probes can stay in hot paths.
+
+Calls made on other threads (the R2 upload pool, boto3 transfer threads) do
+not see the request's context; they are attributed to every profile running
+at the time, which is exact in the usual case of a single profiled request.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar('profiling_collector', default=None)
+_active = set()
+_active_lock = threading.Lock()
+
+SLOW_QUERY_LIMIT = 10
+
+
+class Collector:
+    """Counts and times the SQL, crypto and storage calls of one request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries = []
+        self.calls = {}
+
+    def add(self, category, name, seconds):
+        with self._lock:
+            stats = self.calls.setdefault(category, {}).setdefault(name, [0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+
+    def sql_wrapper(self, execute, sql, params, many, context):
+        """Database execute wrapper for ``connection.execute_wrapper``."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    def totals(self, category):
+        with self._lock:
+            stats = list(self.calls.get(category, {}).values())
+        return sum(count for count, _ in stats), sum(seconds for _, seconds in stats)
+
+    def summary(self):
+        """JSON-serialisable breakdown stored with the report."""
+        slowest = sorted(self.queries, key=lambda query: query[1], reverse=True)[:SLOW_QUERY_LIMIT]
+        with self._lock:
+            calls = {
+                category: {
+                    name: {'calls': count, 'ms': round(seconds * 1000, 3)}
+                    for name, (count, seconds) in sorted(stats.items())
+                }
+                for category, stats in self.calls.items()
+            }
+        return {
+            'slowest_queries': [{'sql': sql, 'ms': round(seconds * 1000, 3)} for sql, seconds in slowest],
+            'calls': calls,
+        }
+
+
+@contextmanager
+def collecting():
+    """Collect probe data for the code run inside the block."""
+    collector = Collector()
+    token = _current.set(collector)
+    with _active_lock:
+        _active.add(collector)
+    try:
+        yield collector
+    finally:
+        with _active_lock:
+            _active.discard(collector)
+        _current.reset(token)
+
+
+def is_active():
+    """Whether any profile is being collected."""
+    return bool(_active)
+
+
+def record(category, name, seconds):
+    """Attribute one call to the running profile(s), if any."""
+    if not _active:
+        return
+    collector = _current.get()
+    if collector is not None:
+        collector.add(category, name, seconds)
+        return
+    with _active_lock:
+        collectors = tuple(_active)
+    for collector in collectors:
+        collector.add(category, name, seconds)
+
@@ -0,0 +1,81 @@
+from unittest import mock, skipIf
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from em_store import crypto
+from . import middleware, probes
+from .models import ProfileReport
+
+
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', password='pw', is_staff=True, is_superuser=True)
+        self.user = User.objects.create_user(username='user', password='pw')
+        self.client = APIClient()
+
+    def _get(self, user, **headers):
+        token = str(RefreshToken.for_user(user).access_token)
+        return self.client.get('/api/campaigns/', HTTP_AUTHORIZATION=f'Bearer {token}', **headers)
+
+    def test_requests_without_header_are_not_profiled(self):
+        response = self._get(self.staff)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(ProfileReport.objects.exists())
+
+    def test_non_staff_users_are_not_profiled(self):
+        response = self._get(self.user, HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(ProfileReport.objects.exists())
+
+    def test_staff_jwt_request_is_profiled_and_viewable_in_admin(self):
+        response = self._get(self.staff, HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+
+        profile = ProfileReport.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual(profile.user, self.staff)
+        self.assertEqual(profile.endpoint, 'api/campaigns/')
+        self.assertEqual(profile.engine, 'cprofile')
+        self.assertGreater(profile.sql_count, 0)
+        self.assertIn('function calls', profile.report)
+        self.assertIn(f'sql={profile.sql_count}/', response['X-Profile-Summary'])
+
+        self.client.force_login(self.staff)
+        page = self.client.get(f'/admin/profiling/profilereport/{profile.pk}/change/')
+        self.assertContains(page, 'function calls')
+        raw = self.client.get(f'/admin/profiling/profilereport/{profile.pk}/report/')
+        self.assertEqual(raw['Content-Type'], 'text/plain; charset=utf-8')
+
+    def test_crypto_calls_are_attributed(self):
+        token = crypto.encrypt('secret')
+        with probes.collecting() as collector:
+            crypto.decrypt(token)
+            crypto.decrypt_many([token, token])
+        self.assertEqual(collector.totals('crypto')[0], 2)
+        self.assertEqual(set(collector.summary()['calls']['crypto']), {'decrypt', 'decrypt_many'})
+
+    @override_settings(PROFILING_MAX_REPORTS=2)
+    def test_old_reports_are_pruned(self):
+        for _ in range(3):
+            self._get(self.staff, HTTP_X_PROFILE='1')
+        self.assertEqual(ProfileReport.objects.count(), 2)
+
+    @skipIf(middleware.pyinstrument is None, "pyinstrument is not installed")
+    @override_settings(PROFILING_ENGINE='pyinstrument')
+    def test_pyinstrument_engine(self):
+        response = self._get(self.staff, HTTP_X_PROFILE='1')
+        profile = ProfileReport.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual(profile.engine, 'pyinstrument')
+        self.assertEqual(profile.report_format, ProfileReport.FORMAT_HTML)
+
+    def test_busy_profiler_serves_request_unprofiled(self):
+        with mock.patch.object(middleware, '_profiler_lock') as lock:
+            lock.acquire.return_value = False
+            response = self._get(self.staff, HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Profile-Summary'], 'busy')
+        self.assertFalse(ProfileReport.objects.exists())
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UnreadEmail, UnreadEmailAttachment
+from .models import MailboxSyncState, UnreadEmail, UnreadEmailAttachment
 
 class UnreadEmailAttachmentInline(admin.TabularInline):
     model = UnreadEmailAttachment
@@ -44,3 +44,11 @@ class UnreadEmailAttachmentAdmin(admin.ModelAdmin):
     
     def has_add_permission(self, request):
         return False
+
+
+@admin.register(MailboxSyncState)
+class MailboxSyncStateAdmin(admin.ModelAdmin):
+    list_display = ('account', 'mailbox', 'uidvalidity', 'uidnext', 'supports_idle', 'last_synced_at', 'last_error')
+    list_filter = ('supports_idle', 'mailbox')
+    search_fields = ('account__email',)
+    readonly_fields = ('account', 'mailbox', 'uidvalidity', 'uidnext', 'supports_idle', 'last_synced_at', 'last_error', 'updated_at')
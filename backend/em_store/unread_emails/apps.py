@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class UnreadEmailsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'unread_emails'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,526 @@
+"""
+Concurrent IMAP inbox sync for UnreadEmail accounts.
+
+Every account gets one asyncio task that keeps its IMAP connection open, so a
+single process can follow thousands of mailboxes. Each mailbox has a
+UIDVALIDITY/UIDNEXT checkpoint (MailboxSyncState): a sync fetches only the
+headers of messages with a UID at or above the checkpoint and never
+re-downloads the mailbox. The first sync, and any sync after the server has
+changed UIDVALIDITY, starts from the most recent IMAP_SYNC_INITIAL_MESSAGES
+UIDs. Between syncs a task waits in IDLE when the server supports it and
+polls otherwise.
+
+Fetched headers from all accounts go through a single HeaderWriter, which
+inserts them in bulk together with the advanced checkpoints. An account's
+checkpoint only moves once its headers are stored.
+"""
+import asyncio
+import logging
+import re
+import ssl
+from datetime import datetime, timezone as dt_timezone
+from email import policy
+from email.parser import BytesHeaderParser
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from .models import InboxMessage, MailboxSyncState, UnreadEmail
+
+try:
+    import aioimaplib
+except ImportError:  # only the sync service needs it
+    aioimaplib = None
+
+logger = logging.getLogger(__name__)
+
+# IMAP defaults used when an account leaves imap_host/imap_port blank
+PROVIDER_IMAP_DEFAULTS = {
+    'gmail': ('imap.gmail.com', 993),
+    'yahoo': ('imap.mail.yahoo.com', 993),
+    'outlook': ('outlook.office365.com', 993),
+}
+
+HEADER_FIELDS = ('MESSAGE-ID', 'SUBJECT', 'FROM', 'TO', 'DATE')
+FETCH_ITEMS = f"(UID RFC822.SIZE FLAGS INTERNALDATE BODY.PEEK[HEADER.FIELDS ({' '.join(HEADER_FIELDS)})])"
+
+FETCH_LINE_RE = re.compile(rb'^\d+ FETCH \(')
+UID_RE = re.compile(rb'\bUID (\d+)')
+SIZE_RE = re.compile(rb'\bRFC822\.SIZE (\d+)')
+FLAGS_RE = re.compile(rb'\bFLAGS \(([^)]*)\)')
+INTERNALDATE_RE = re.compile(rb'\bINTERNALDATE "([^"]+)"')
+EXISTS_RE = re.compile(rb'^(\d+) EXISTS$')
+UIDVALIDITY_RE = re.compile(rb'\[UIDVALIDITY (\d+)\]')
+UIDNEXT_RE = re.compile(rb'\[UIDNEXT (\d+)\]')
+
+FIELD_MAX_LENGTH = InboxMessage._meta.get_field('from_address').max_length
+FLAGS_MAX_LENGTH = InboxMessage._meta.get_field('flags').max_length
+
+_header_parser = BytesHeaderParser(policy=policy.default)
+
+
+class IMAPSyncError(Exception):
+    """Raised when the IMAP server refuses a command during a sync."""
+
+
+def get_imap_settings(account):
+    """
+    Return the (host, port, use_ssl) triple used to reach the account's IMAP server.
+    Falls back to the provider defaults when host or port are not set.
+    """
+    default_host, default_port = PROVIDER_IMAP_DEFAULTS.get(
+        (account.provider or '').lower(), (None, None)
+    )
+    host = account.imap_host or default_host
+    port = account.imap_port or default_port or (993 if account.use_ssl else 143)
+    if not host:
+        raise ValueError(f"No IMAP host configured for account {account.pk}")
+    return host, int(port), bool(account.use_ssl)
+
+
+def parse_mailbox_status(lines):
+    """Return EXISTS, UIDVALIDITY and UIDNEXT from a SELECT response (None when absent)."""
+    status = {'exists': 0, 'uidvalidity': None, 'uidnext': None}
+    for line in lines:
+        line = bytes(line)
+        if match := EXISTS_RE.match(line):
+            status['exists'] = int(match.group(1))
+        elif match := UIDVALIDITY_RE.search(line):
+            status['uidvalidity'] = int(match.group(1))
+        elif match := UIDNEXT_RE.search(line):
+            status['uidnext'] = int(match.group(1))
+    return status
+
+
+def _parse_internaldate(value):
+    try:
+        return datetime.strptime(value.decode().strip(), '%d-%b-%Y %H:%M:%S %z')
+    except ValueError:
+        return None
+
+
+def parse_headers(raw):
+    """Return the stored header fields of a message from its raw header block."""
+    fields = {'message_id': '', 'subject': '', 'from_address': '', 'to_addresses': '', 'sent_at': None}
+    if not raw:
+        return fields
+    try:
+        message = _header_parser.parsebytes(raw)
+        fields['message_id'] = str(message.get('Message-ID', '')).strip()[:FIELD_MAX_LENGTH]
+        fields['subject'] = str(message.get('Subject', ''))
+        fields['from_address'] = str(message.get('From', ''))[:FIELD_MAX_LENGTH]
+        fields['to_addresses'] = str(message.get('To', ''))
+        date = message.get('Date')
+        sent_at = getattr(date, 'datetime', None)
+        if sent_at is not None and timezone.is_naive(sent_at):
+            sent_at = sent_at.replace(tzinfo=dt_timezone.utc)
+        fields['sent_at'] = sent_at
+    except Exception as e:
+        logger.debug(f"Could not parse message headers: {e}")
+    return fields
+
+
+def parse_fetch(lines):
+    """
+    Parse a UID FETCH response into one dict per message with its UID, size,
+    flags, INTERNALDATE and header fields. Header blocks arrive as literals,
+    i.e. as the response line that follows the FETCH line.
+    """
+    messages = []
+    index = 0
+    while index < len(lines):
+        line = bytes(lines[index])
+        index += 1
+        if not FETCH_LINE_RE.match(line):
+            continue
+        attributes, raw_headers = line, b''
+        if line.endswith(b'}') and index < len(lines):
+            raw_headers = bytes(lines[index])
+            index += 1
+            if index < len(lines):
+                # Attributes may also follow the literal, e.g. " UID 12)"
+                attributes += b' ' + bytes(lines[index])
+                index += 1
+        uid = UID_RE.search(attributes)
+        if not uid:
+            continue
+        size = SIZE_RE.search(attributes)
+        flags = FLAGS_RE.search(attributes)
+        internaldate = INTERNALDATE_RE.search(attributes)
+        messages.append({
+            'uid': int(uid.group(1)),
+            'size': int(size.group(1)) if size else 0,
+            'flags': flags.group(1).decode(errors='replace')[:FLAGS_MAX_LENGTH] if flags else '',
+            'received_at': _parse_internaldate(internaldate.group(1)) if internaldate else None,
+            **parse_headers(raw_headers),
+        })
+    return messages
+
+
+class HeaderWriter:
+    """
+    Collects fetched headers and checkpoints from every account and writes
+    them in bulk: one INSERT for the headers and one upsert for the
+    checkpoints per flush. Flushes happen every IMAP_SYNC_FLUSH_SECONDS, or
+    sooner once IMAP_SYNC_BATCH_SIZE headers are waiting.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None):
+        self.batch_size = batch_size or getattr(settings, 'IMAP_SYNC_BATCH_SIZE', 1000)
+        self.flush_interval = flush_interval or getattr(settings, 'IMAP_SYNC_FLUSH_SECONDS', 1.0)
+        self._pending = []
+        self._pending_messages = 0
+        self._wakeup = asyncio.Event()
+        self._closed = False
+
+    async def submit(self, account_id, mailbox, checkpoint, messages=(), error=''):
+        """Queue headers and the checkpoint they advance to, and wait until they are stored."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((account_id, mailbox, checkpoint, list(messages), error, future))
+        self._pending_messages += len(messages)
+        if self._pending_messages >= self.batch_size:
+            self._wakeup.set()
+        await future
+
+    async def run(self):
+        while not self._closed or self._pending:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def close(self):
+        """Stop ``run`` after the pending headers have been written."""
+        self._closed = True
+        self._wakeup.set()
+
+    async def flush(self):
+        pending, self._pending, self._pending_messages = self._pending, [], 0
+        if not pending:
+            return
+        try:
+            await sync_to_async(self._write)(pending)
+        except Exception as e:
+            logger.error(f"Error writing synced headers: {e}", exc_info=True)
+            for *_, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for *_, future in pending:
+            if not future.done():
+                future.set_result(None)
+
+    def _write(self, pending):
+        # Replace the connection if the server dropped it since the last batch
+        close_old_connections()
+        # Accounts deleted while their headers were in flight are dropped
+        existing = set(
+            UnreadEmail.objects.filter(pk__in={item[0] for item in pending}).values_list('pk', flat=True)
+        )
+        now = timezone.now()
+        messages, states = [], {}
+        for account_id, mailbox, checkpoint, batch, error, _ in pending:
+            if account_id not in existing:
+                continue
+            messages.extend(
+                InboxMessage(account_id=account_id, mailbox=mailbox, uidvalidity=checkpoint['uidvalidity'], **fields)
+                for fields in batch
+            )
+            states[(account_id, mailbox)] = MailboxSyncState(
+                account_id=account_id,
+                mailbox=mailbox,
+                uidvalidity=checkpoint['uidvalidity'],
+                uidnext=checkpoint['uidnext'],
+                supports_idle=checkpoint['supports_idle'],
+                last_synced_at=checkpoint['last_synced_at'] if error else now,
+                last_error=error,
+            )
+        with transaction.atomic():
+            if messages:
+                InboxMessage.objects.bulk_create(messages, batch_size=self.batch_size, ignore_conflicts=True)
+            if states:
+                MailboxSyncState.objects.bulk_create(
+                    states.values(),
+                    update_conflicts=True,
+                    unique_fields=['account', 'mailbox'],
+                    update_fields=['uidvalidity', 'uidnext', 'supports_idle', 'last_synced_at', 'last_error', 'updated_at'],
+                )
+
+
+class AccountSyncer:
+    """Keeps one account's mailbox in sync over a single IMAP connection."""
+
+    def __init__(self, account, state, writer, mailbox='INBOX'):
+        self.account = account
+        self.writer = writer
+        self.mailbox = mailbox
+        self.host, self.port, self.use_ssl = get_imap_settings(account)
+        self.timeout = getattr(settings, 'IMAP_SYNC_TIMEOUT_SECONDS', 30)
+        self.initial_messages = getattr(settings, 'IMAP_SYNC_INITIAL_MESSAGES', 500)
+        self.idle_seconds = getattr(settings, 'IMAP_SYNC_IDLE_SECONDS', 1500)
+        self.poll_seconds = getattr(settings, 'IMAP_SYNC_POLL_SECONDS', 300)
+        self.max_backoff = getattr(settings, 'IMAP_SYNC_MAX_BACKOFF_SECONDS', 900)
+        self.checkpoint = {
+            'uidvalidity': state.uidvalidity if state else None,
+            'uidnext': state.uidnext if state else None,
+            'supports_idle': state.supports_idle if state else False,
+            'last_synced_at': state.last_synced_at if state else None,
+        }
+        self.last_error = state.last_error if state else ''
+        self.client = None
+
+    async def connect(self):
+        """Open the connection, log in and select the mailbox. Returns the mailbox status."""
+        password = self.account.get_decrypted_password()
+        if not password:
+            raise IMAPSyncError("Password could not be decrypted")
+        if self.use_ssl:
+            client = aioimaplib.IMAP4_SSL(
+                host=self.host, port=self.port, timeout=self.timeout, ssl_context=ssl.create_default_context()
+            )
+        else:
+            client = aioimaplib.IMAP4(host=self.host, port=self.port, timeout=self.timeout)
+        self.client = client
+        await client.wait_hello_from_server()
+        response = await client.login(self.account.email, password)
+        if response.result != 'OK':
+            raise IMAPSyncError(f"Login failed: {b' '.join(map(bytes, response.lines)).decode(errors='replace')}")
+        self.checkpoint['supports_idle'] = client.has_capability('IDLE')
+        return await self.select()
+
+    async def select(self):
+        response = await self.client.select(self.mailbox)
+        if response.result != 'OK':
+            raise IMAPSyncError(f"SELECT {self.mailbox} failed")
+        return parse_mailbox_status(response.lines)
+
+    async def close(self):
+        client, self.client = self.client, None
+        if client is None:
+            return
+        try:
+            await asyncio.wait_for(client.logout(), self.timeout)
+        except Exception:
+            pass
+
+    def fetch_start(self, status):
+        """Return the first UID to fetch, or None when there is nothing new."""
+        if self.checkpoint['uidvalidity'] == status['uidvalidity'] and self.checkpoint['uidnext']:
+            if status['uidnext'] is not None and status['uidnext'] <= self.checkpoint['uidnext']:
+                return None
+            return self.checkpoint['uidnext']
+        # First sync, or the server renumbered the mailbox: start from the newest messages
+        if not status['exists']:
+            return None
+        if status['uidnext']:
+            return max(1, status['uidnext'] - self.initial_messages)
+        return 1
+
+    async def sync(self, status=None):
+        """Fetch and store the headers of messages that arrived since the checkpoint."""
+        if status is None:
+            status = await self.select()
+        start = self.fetch_start(status)
+        validity_changed = status['uidvalidity'] != self.checkpoint['uidvalidity']
+        if start is None and not validity_changed:
+            return 0
+
+        messages = []
+        if start is not None:
+            response = await self.client.uid('fetch', f'{start}:*', FETCH_ITEMS)
+            if response.result != 'OK':
+                raise IMAPSyncError("UID FETCH failed")
+            # "n:*" also returns the last message when its UID is below n
+            messages = [message for message in parse_fetch(response.lines) if message['uid'] >= start]
+            if len(messages) > self.initial_messages and validity_changed:
+                messages = messages[-self.initial_messages:]
+
+        uidnext = max(
+            [status['uidnext'] or 1, start or 1]
+            + [message['uid'] + 1 for message in messages]
+        )
+        checkpoint = {**self.checkpoint, 'uidvalidity': status['uidvalidity'], 'uidnext': uidnext}
+        await self.writer.submit(self.account.pk, self.mailbox, checkpoint, messages)
+        self.checkpoint = {**checkpoint, 'last_synced_at': timezone.now()}
+        self.last_error = ''
+        return len(messages)
+
+    async def wait_for_changes(self, stop_event):
+        """Wait until the mailbox may have changed. Returns False once ``stop_event`` is set."""
+        if not self.checkpoint['supports_idle']:
+            try:
+                await asyncio.wait_for(stop_event.wait(), self.poll_seconds)
+                return False
+            except asyncio.TimeoutError:
+                return True
+
+        idle = await self.client.idle_start(timeout=self.idle_seconds)
+        stop_task = asyncio.ensure_future(stop_event.wait())
+        try:
+            while True:
+                push_task = asyncio.ensure_future(self.client.wait_server_push(timeout=self.idle_seconds + self.timeout))
+                done, _ = await asyncio.wait({push_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+                if stop_task in done:
+                    push_task.cancel()
+                    return False
+                push = push_task.result()
+                if push == aioimaplib.STOP_WAIT_SERVER_PUSH:
+                    # IDLE has to be re-issued periodically; re-check the mailbox meanwhile
+                    return True
+                if any(EXISTS_RE.match(bytes(line)) for line in push):
+                    return True
+        finally:
+            stop_task.cancel()
+            self.client.idle_done()
+            await asyncio.wait_for(idle, self.timeout)
+
+    async def _record_error(self, error):
+        logger.warning(f"IMAP sync failed for account {self.account.pk} ({self.host}): {error}")
+        if error != self.last_error:
+            self.last_error = error
+            await self.writer.submit(self.account.pk, self.mailbox, self.checkpoint, error=error)
+
+    async def sync_once(self, limiter):
+        """Connect, sync and disconnect. Returns the number of new messages, or None on failure."""
+        async with limiter:
+            try:
+                return await self.sync(await self.connect())
+            except Exception as e:
+                await self._record_error(str(e) or e.__class__.__name__)
+                return None
+            finally:
+                await self.close()
+
+    async def run(self, stop_event, limiter):
+        """Keep the mailbox in sync until ``stop_event`` is set, reconnecting with backoff on errors."""
+        failures = 0
+        try:
+            while not stop_event.is_set():
+                try:
+                    # Connecting and the initial catch-up are bounded; idling connections are not
+                    async with limiter:
+                        await self.sync(await self.connect())
+                    failures = 0
+                    while await self.wait_for_changes(stop_event):
+                        await self.sync()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    failures += 1
+                    await self._record_error(str(e) or e.__class__.__name__)
+                await self.close()
+                if failures:
+                    delay = min(self.max_backoff, 2 ** min(failures, 16))
+                    try:
+                        await asyncio.wait_for(stop_event.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            await self.close()
+
+
+class InboxSyncService:
+    """
+    Syncs the inboxes of every UnreadEmail account with a password, or of a
+    shard of them (``shard`` out of ``shards``, by id) when the work is split
+    over several processes.
+    """
+
+    def __init__(self, mailbox='INBOX', account_ids=None, shard=0, shards=1, max_connecting=None):
+        if aioimaplib is None:
+            raise ImportError("The inbox sync requires the 'aioimaplib' package")
+        self.mailbox = mailbox
+        self.account_ids = account_ids
+        self.shard = shard
+        self.shards = shards
+        self.max_connecting = max_connecting or getattr(settings, 'IMAP_SYNC_MAX_CONNECTING', 50)
+        self.refresh_interval = getattr(settings, 'IMAP_SYNC_REFRESH_SECONDS', 60)
+
+    def load_accounts(self):
+        """Return ``[(account, sync_state_or_None)]`` for the accounts to sync."""
+        accounts = UnreadEmail.objects.exclude(password__isnull=True).exclude(password='').only(
+            'id', 'email', 'password', 'provider', 'imap_host', 'imap_port', 'use_ssl', 'updated_at',
+        )
+        if self.account_ids:
+            accounts = accounts.filter(pk__in=self.account_ids)
+        if self.shards > 1:
+            accounts = accounts.annotate(shard=Mod('id', self.shards)).filter(shard=self.shard)
+        accounts = list(accounts.order_by('id'))
+        states = {
+            state.account_id: state
+            for state in MailboxSyncState.objects.filter(mailbox=self.mailbox, account__in=[a.pk for a in accounts])
+        }
+        return [(account, states.get(account.pk)) for account in accounts]
+
+    def _syncer(self, account, state, writer):
+        try:
+            return AccountSyncer(account, state, writer, mailbox=self.mailbox)
+        except ValueError as e:
+            logger.warning(str(e))
+            return None
+
+    async def run_once(self):
+        """Sync every account once and return a summary dict."""
+        writer = HeaderWriter()
+        writer_task = asyncio.ensure_future(writer.run())
+        limiter = asyncio.Semaphore(self.max_connecting)
+        summary = {'accounts': 0, 'synced': 0, 'failed': 0, 'messages': 0}
+        try:
+            accounts = await sync_to_async(self.load_accounts)()
+            syncers = [s for s in (self._syncer(a, st, writer) for a, st in accounts) if s is not None]
+            summary['accounts'] = len(syncers)
+            results = await asyncio.gather(*(syncer.sync_once(limiter) for syncer in syncers))
+            for fetched in results:
+                if fetched is None:
+                    summary['failed'] += 1
+                else:
+                    summary['synced'] += 1
+                    summary['messages'] += fetched
+        finally:
+            writer.close()
+            await writer_task
+            await sync_to_async(connections.close_all)()
+        return summary
+
+    async def run_forever(self, stop_event):
+        """
+        Follow every account until ``stop_event`` is set. The account list is
+        reloaded every IMAP_SYNC_REFRESH_SECONDS: new accounts are started,
+        deleted ones stopped and edited ones restarted with their new settings.
+        """
+        writer = HeaderWriter()
+        writer_task = asyncio.ensure_future(writer.run())
+        limiter = asyncio.Semaphore(self.max_connecting)
+        running = {}
+        try:
+            while not stop_event.is_set():
+                accounts = await sync_to_async(self.load_accounts)()
+                seen = set()
+                for account, state in accounts:
+                    seen.add(account.pk)
+                    current = running.get(account.pk)
+                    if current and current[0] == account.updated_at and not current[1].done():
+                        continue
+                    if current:
+                        current[1].cancel()
+                    syncer = self._syncer(account, state, writer)
+                    if syncer is not None:
+                        running[account.pk] = (account.updated_at, asyncio.ensure_future(syncer.run(stop_event, limiter)))
+                for account_id in set(running) - seen:
+                    running.pop(account_id)[1].cancel()
+                logger.info(f"Inbox sync following {len(running)} account(s)")
+                try:
+                    await asyncio.wait_for(stop_event.wait(), self.refresh_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            stop_event.set()
+            await asyncio.gather(*(task for _, task in running.values()), return_exceptions=True)
+            writer.close()
+            await writer_task
+            await sync_to_async(connections.close_all)()
@@ -0,0 +1,54 @@
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from em_store.db import use_worker_connections
+from unread_emails import imap_sync
+
+
+class Command(BaseCommand):
+    help = 'Sync the inboxes of UnreadEmail accounts over IMAP (headers only, incremental by UID)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Sync every account once and exit instead of following them')
+        parser.add_argument('--account', type=int, action='append', dest='accounts', help='Only sync this account id (repeatable)')
+        parser.add_argument('--mailbox', default='INBOX', help='Mailbox to sync')
+        parser.add_argument('--shard', default='0/1', help='Sync only accounts with id %% N == I, given as I/N')
+        parser.add_argument('--max-connecting', type=int, help='Connections allowed to log in and catch up at the same time')
+
+    def handle(self, *args, **options):
+        if imap_sync.aioimaplib is None:
+            raise CommandError("The inbox sync requires aioimaplib (pip install aioimaplib)")
+        try:
+            shard, shards = (int(part) for part in options['shard'].split('/'))
+        except ValueError:
+            raise CommandError("--shard must look like I/N, e.g. 0/4")
+        if shards < 1 or not 0 <= shard < shards:
+            raise CommandError("--shard must satisfy 0 <= I < N")
+
+        use_worker_connections()
+        service = imap_sync.InboxSyncService(
+            mailbox=options['mailbox'],
+            account_ids=options['accounts'],
+            shard=shard,
+            shards=shards,
+            max_connecting=options['max_connecting'],
+        )
+        if options['once']:
+            summary = asyncio.run(service.run_once())
+            self.stdout.write(self.style.SUCCESS(
+                f"Synced {summary['synced']}/{summary['accounts']} accounts, "
+                f"{summary['messages']} new messages, {summary['failed']} failed"
+            ))
+            return
+        asyncio.run(self._follow(service))
+
+    async def _follow(self, service):
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+        self.stdout.write('Following inboxes, press Ctrl+C to stop')
+        await service.run_forever(stop_event)
+        self.stdout.write(self.style.SUCCESS('Inbox sync stopped'))
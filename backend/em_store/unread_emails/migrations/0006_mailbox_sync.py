@@ -0,0 +1,68 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('unread_emails', '0005_alter_unreademailattachment_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailboxSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mailbox', models.CharField(default='INBOX', max_length=255)),
+                ('uidvalidity', models.BigIntegerField(blank=True, null=True)),
+                ('uidnext', models.BigIntegerField(blank=True, null=True)),
+                ('supports_idle', models.BooleanField(default=False)),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('account', models.ForeignKey(help_text='The account this mailbox belongs to', on_delete=django.db.models.deletion.CASCADE, related_name='sync_states', to='unread_emails.unreademail')),
+            ],
+            options={
+                'verbose_name': 'Mailbox Sync State',
+                'verbose_name_plural': 'Mailbox Sync States',
+            },
+        ),
+        migrations.CreateModel(
+            name='InboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mailbox', models.CharField(default='INBOX', max_length=255)),
+                ('uidvalidity', models.BigIntegerField()),
+                ('uid', models.BigIntegerField()),
+                ('message_id', models.CharField(blank=True, default='', max_length=998)),
+                ('subject', models.TextField(blank=True, default='')),
+                ('from_address', models.CharField(blank=True, default='', max_length=998)),
+                ('to_addresses', models.TextField(blank=True, default='')),
+                ('sent_at', models.DateTimeField(blank=True, help_text='Date header of the message', null=True)),
+                ('received_at', models.DateTimeField(blank=True, help_text='IMAP INTERNALDATE', null=True)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('flags', models.CharField(blank=True, default='', max_length=255)),
+                ('fetched_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(help_text='The account the message was fetched from', on_delete=django.db.models.deletion.CASCADE, related_name='inbox_messages', to='unread_emails.unreademail')),
+            ],
+            options={
+                'verbose_name': 'Inbox Message',
+                'verbose_name_plural': 'Inbox Messages',
+                'ordering': ['-received_at'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='mailboxsyncstate',
+            constraint=models.UniqueConstraint(fields=('account', 'mailbox'), name='unique_mailbox_sync_state'),
+        ),
+        migrations.AddIndex(
+            model_name='inboxmessage',
+            index=models.Index(fields=['account', '-received_at'], name='inbox_msg_account_recv_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='inboxmessage',
+            constraint=models.UniqueConstraint(fields=('account', 'mailbox', 'uidvalidity', 'uid'), name='unique_inbox_message_uid'),
+        ),
+    ]
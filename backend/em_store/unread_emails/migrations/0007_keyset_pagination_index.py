@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('unread_emails', '0006_mailbox_sync'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='unreademail',
+            index=models.Index(fields=['created_at', 'id'], name='credentials_email_created_idx'),
+        ),
+    ]
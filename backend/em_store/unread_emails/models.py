@@ -1,31 +1,14 @@
 # model
 import os
 import uuid
-import base64
 import logging
 from django.db import models
-import typing
 
 # Set up logger
 logger = logging.getLogger(__name__)
 from django.core.validators import EmailValidator
 from django.utils import timezone
-from django.conf import settings
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-
-# Generate a key from Django's SECRET_KEY
-def get_fernet_key():
-    salt = settings.SECRET_KEY[:16].encode()
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=100000,
-    )
-    key = base64.urlsafe_b64encode(kdf.derive(settings.SECRET_KEY.encode()))
-    return key
+from em_store import crypto
 
 def user_directory_path(instance, filename):
     # File will be uploaded to MEDIA_ROOT/user_<id>/<filename>
@@ -60,15 +43,15 @@ class UnreadEmail(models.Model):
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # Store original password on init to detect changes
-        self._password = self.password
+        # Store original password on init to detect changes. Read it from
+        # __dict__ so querysets that defer the password don't load it per row.
+        self._password = self.__dict__.get('password')
     
     def save(self, *args, **kwargs):
         # Always encrypt the password if it's set and not already encrypted
         if self.password and isinstance(self.password, str) and not self.password.startswith('gAA'):
             try:
-                f = Fernet(get_fernet_key())
-                self.password = f.encrypt(self.password.encode()).decode()
+                self.password = crypto.encrypt(self.password)
             except Exception as e:
                 import logging
                 logger = logging.getLogger(__name__)
@@ -81,9 +64,8 @@ class UnreadEmail(models.Model):
         if not self.password:
             return None
         try:
-            f = Fernet(get_fernet_key())
             if isinstance(self.password, str):
-                return f.decrypt(self.password.encode()).decode()
+                return crypto.credential_cache.get_password(self)
             return None
         except Exception as e:
             logger.error(f"Error decrypting password: {e}")
@@ -159,6 +141,10 @@ class UnreadEmail(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Unread Email Submission'
         verbose_name_plural = 'Unread Email Submissions'
+        indexes = [
+            # Keyset pagination (see em_store/pagination.py)
+            models.Index(fields=['created_at', 'id'], name='credentials_email_created_idx'),
+        ]
 
 
 class UnreadEmailAttachment(models.Model):
@@ -210,10 +196,10 @@ class UnreadEmailAttachment(models.Model):
     def save(self, *args, **kwargs):
         """Save the file to Cloudflare R2 and update file metadata."""
         is_new = not self.pk
-        file_changed = False
         
-        # Handle file upload to R2 for new attachments
-        if is_new and self.file:
+        # Handle file upload to R2 for new attachments (files already uploaded
+        # concurrently by the view arrive as committed storage keys and are skipped)
+        if is_new and self.file and not self.file._committed:
             self.original_filename = os.path.basename(str(self.file))
             
             # Get content type from file if not set
@@ -226,28 +212,22 @@ class UnreadEmailAttachment(models.Model):
                     logger.error(f"Error detecting content type: {e}")
                     self.content_type = 'application/octet-stream'
             
-            # Read the file content
+            # Stream the file to R2 without reading it into memory
             try:
-                file_content = b''
-                if hasattr(self.file, 'read'):  # type: ignore[attr-defined]
-                    if callable(self.file.read):  # type: ignore[attr-defined]
-                        from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
-                        file_obj = typing.cast(InMemoryUploadedFile, self.file)
-                        file_content = file_obj.read()  # type: ignore[attr-defined]
-                self.file_size = len(typing.cast(bytes, file_content))  # type: ignore
+                self.file_size = self.file.size
                 # Upload to R2 with enhanced URL generation
                 from em_store.storage_utils import upload_file_to_r2
                 upload_result = upload_file_to_r2(
-                    file_content,
+                    self.file.file,
                     file_name=os.path.basename(str(self.file.name)),
                     content_type=self.content_type,
                     folder=f'unread_emails/{getattr(self, 'unread_email_id', '')}/attachments'
                 )
                 if upload_result['success']:
-                    # Store the R2 key and URL
-                    self.file.name = upload_result['key']
+                    # Store the R2 key and URL before the INSERT; assigning the key marks
+                    # the file as committed so the FileField doesn't upload it again
+                    self.file = upload_result['key']
                     self.download_url = upload_result['url']
-                    file_changed = True
                     logger.info(f"Successfully uploaded file to R2: {upload_result['key']}")
                     logger.info(f"Generated download URL: {upload_result['url']}")
                 else:
@@ -258,23 +238,16 @@ class UnreadEmailAttachment(models.Model):
         
         # Save the model
         super().save(*args, **kwargs)
-        
-        # If file was changed, update the URL in the database
-        if file_changed and self.pk:
-            UnreadEmailAttachment.objects.filter(pk=self.pk).update(  # type: ignore[attr-defined]
-                file=self.file.name,
-                download_url=self.download_url
-            )
-            logger.info(f"Updated attachment {self.pk} with download URL: {self.download_url}")
     
     def get_download_url(self):
-        """Return the stored download URL or generate a new one."""
-        if not self.download_url and self.pk:
-            self.download_url = self._generate_download_url()
-            if self.download_url:
-                self.save(update_fields=['download_url'])
-                logger.info(f"Generated and stored download URL for attachment {self.pk}: {self.download_url}")
-        return self.download_url
+        """
+        Return the public download URL, resolved from the file key.
+        Never writes: rows are backfilled with the backfill_download_urls command.
+        """
+        if self.file:
+            from em_store.storage_utils import public_url
+            return public_url(self.file.name)
+        return self.download_url or ""
     
     def _generate_download_url(self):
         """Generate a download URL for this attachment from R2."""
@@ -310,3 +283,75 @@ class UnreadEmailAttachment(models.Model):
         # Delete the model instance
         super().delete(*args, **kwargs)
 
+
+
+class MailboxSyncState(models.Model):
+    """
+    IMAP sync checkpoint for one mailbox of an account.
+
+    ``uidnext`` is the first UID not yet fetched under ``uidvalidity``; the
+    next sync fetches only ``uidnext:*``. When the server reports a different
+    UIDVALIDITY the UIDs are no longer comparable and the checkpoint restarts.
+    """
+    account = models.ForeignKey(
+        UnreadEmail,
+        on_delete=models.CASCADE,
+        related_name='sync_states',
+        help_text="The account this mailbox belongs to"
+    )
+    mailbox = models.CharField(max_length=255, default='INBOX')
+    uidvalidity = models.BigIntegerField(null=True, blank=True)
+    uidnext = models.BigIntegerField(null=True, blank=True)
+    supports_idle = models.BooleanField(default=False)  # type: ignore
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Mailbox Sync State'
+        verbose_name_plural = 'Mailbox Sync States'
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'mailbox'], name='unique_mailbox_sync_state'),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id}:{self.mailbox} (uidvalidity={self.uidvalidity}, uidnext={self.uidnext})"
+
+
+class InboxMessage(models.Model):
+    """Headers of a message fetched from an account's mailbox by the IMAP sync."""
+    account = models.ForeignKey(
+        UnreadEmail,
+        on_delete=models.CASCADE,
+        related_name='inbox_messages',
+        help_text="The account the message was fetched from"
+    )
+    mailbox = models.CharField(max_length=255, default='INBOX')
+    uidvalidity = models.BigIntegerField()
+    uid = models.BigIntegerField()
+    message_id = models.CharField(max_length=998, blank=True, default='')
+    subject = models.TextField(blank=True, default='')
+    from_address = models.CharField(max_length=998, blank=True, default='')
+    to_addresses = models.TextField(blank=True, default='')
+    sent_at = models.DateTimeField(null=True, blank=True, help_text="Date header of the message")
+    received_at = models.DateTimeField(null=True, blank=True, help_text="IMAP INTERNALDATE")
+    size = models.PositiveIntegerField(default=0)  # type: ignore
+    flags = models.CharField(max_length=255, blank=True, default='')
+    fetched_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-received_at']
+        verbose_name = 'Inbox Message'
+        verbose_name_plural = 'Inbox Messages'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['account', 'mailbox', 'uidvalidity', 'uid'],
+                name='unique_inbox_message_uid',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['account', '-received_at'], name='inbox_msg_account_recv_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} <{self.from_address}>"
@@ -2,7 +2,7 @@ from rest_framework import serializers
 from .models import UnreadEmail, UnreadEmailAttachment
 
 class UnreadEmailAttachmentSerializer(serializers.ModelSerializer):
-    download_url = serializers.URLField(read_only=True)
+    download_url = serializers.URLField(source='get_download_url', read_only=True)
     file_url = serializers.FileField(source='file', read_only=True)
     
     class Meta:
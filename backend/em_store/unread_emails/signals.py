@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from em_store.crypto import credential_cache
+from .models import UnreadEmail
+
+
+@receiver([post_save, post_delete], sender=UnreadEmail)
+def invalidate_cached_credentials(sender, instance, **kwargs):
+    """Forget the decrypted password of a saved or deleted UnreadEmail."""
+    credential_cache.invalidate(instance)
@@ -1,3 +1,418 @@
-from django.test import TestCase
+import asyncio
+import re
+import threading
+import unittest
+from unittest import mock
+from email.utils import format_datetime
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework.throttling import UserRateThrottle
+
+from em_store.crypto import credential_cache
+from em_store.testing import QueryBudgetMixin
+
+from .models import InboxMessage, MailboxSyncState, UnreadEmail, UnreadEmailAttachment
+
+try:
+    import aioimaplib
+except ImportError:  # aioimaplib is only needed by the sync service
+    aioimaplib = None
+
+
+TOKEN_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+
+
+class StandInMailbox:
+    """An account's INBOX on the stand-in server."""
+
+    def __init__(self, password, uidvalidity=1):
+        self.password = password
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.messages = []
+
+    def deliver(self, subject, sender='sender@example.com'):
+        uid = self.uidnext
+        self.uidnext += 1
+        headers = (
+            f"Message-ID: <msg-{uid}@example.com>\r\n"
+            f"Subject: {subject}\r\n"
+            f"From: Sender <{sender}>\r\n"
+            f"To: inbox@example.com\r\n"
+            f"Date: {format_datetime(timezone.now())}\r\n\r\n"
+        ).encode()
+        self.messages.append((uid, headers))
+        return uid
+
+    def reset_uidvalidity(self):
+        """Renumber every message, as a server does after rebuilding the mailbox."""
+        self.uidvalidity += 1
+        self.uidnext = 1
+        renumbered, self.messages = self.messages, []
+        for _, headers in renumbered:
+            self.messages.append((self.uidnext, headers))
+            self.uidnext += 1
+
+
+class StandInIMAPServer:
+    """
+    Minimal IMAP4rev1 server for tests: LOGIN, SELECT, UID FETCH, IDLE.
+
+    It runs its own event loop in a background thread and records the UIDs
+    returned by every FETCH so tests can check nothing is downloaded twice.
+    """
+
+    def __init__(self, idle=True):
+        self.idle = idle
+        self.mailboxes = {}
+        self.fetched_uids = []
+        self.logins = 0
+        self._idlers = set()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._handle, '127.0.0.1', 0), self._loop
+        ).result()
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._server.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    def add_mailbox(self, user, password, uidvalidity=1):
+        self.mailboxes[user] = StandInMailbox(password, uidvalidity)
+        return self.mailboxes[user]
+
+    def deliver(self, user, subject):
+        """Add a message and notify connections idling on the mailbox."""
+        uid = self.mailboxes[user].deliver(subject)
+        self._loop.call_soon_threadsafe(self._notify, user)
+        return uid
+
+    def _notify(self, user):
+        mailbox = self.mailboxes[user]
+        for idle_user, writer in list(self._idlers):
+            if idle_user == user:
+                writer.write(f"* {len(mailbox.messages)} EXISTS\r\n".encode())
+
+    async def _handle(self, reader, writer):
+        user = None
+        writer.write(b"* OK IMAP4rev1 stand-in ready\r\n")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                tag, _, rest = line.decode().rstrip('\r\n').partition(' ')
+                command, _, args = rest.partition(' ')
+                command = command.upper()
+                if command == 'UID':
+                    command, _, args = args.partition(' ')
+                    command = 'UID ' + command.upper()
+                tokens = [
+                    match.group(1) if match.group(1) is not None else match.group(2)
+                    for match in TOKEN_RE.finditer(args)
+                ]
+
+                if command == 'CAPABILITY':
+                    capabilities = 'IMAP4rev1 IDLE' if self.idle else 'IMAP4rev1'
+                    writer.write(f"* CAPABILITY {capabilities}\r\n{tag} OK CAPABILITY completed\r\n".encode())
+                elif command == 'LOGIN':
+                    mailbox = self.mailboxes.get(tokens[0])
+                    if mailbox is None or mailbox.password != tokens[1]:
+                        writer.write(f"{tag} NO [AUTHENTICATIONFAILED] Invalid credentials\r\n".encode())
+                    else:
+                        user = tokens[0]
+                        self.logins += 1
+                        writer.write(f"{tag} OK LOGIN completed\r\n".encode())
+                elif command in ('SELECT', 'EXAMINE'):
+                    mailbox = self.mailboxes[user]
+                    writer.write(
+                        f"* {len(mailbox.messages)} EXISTS\r\n"
+                        f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid\r\n"
+                        f"* OK [UIDNEXT {mailbox.uidnext}] Predicted next UID\r\n"
+                        f"{tag} OK [READ-WRITE] {command} completed\r\n".encode()
+                    )
+                elif command == 'UID FETCH':
+                    self._fetch(writer, tag, self.mailboxes[user], tokens[0])
+                elif command == 'IDLE':
+                    writer.write(b"+ idling\r\n")
+                    await writer.drain()
+                    self._idlers.add((user, writer))
+                    done = await reader.readline()
+                    self._idlers.discard((user, writer))
+                    if done.strip().upper() == b'DONE':
+                        writer.write(f"{tag} OK IDLE terminated\r\n".encode())
+                elif command == 'NOOP':
+                    writer.write(f"{tag} OK NOOP completed\r\n".encode())
+                elif command == 'LOGOUT':
+                    writer.write(f"* BYE logging out\r\n{tag} OK LOGOUT completed\r\n".encode())
+                    await writer.drain()
+                    break
+                else:
+                    writer.write(f"{tag} BAD unsupported command\r\n".encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _fetch(self, writer, tag, mailbox, message_set):
+        first, colon, last = message_set.partition(':')
+        first = int(first)
+        if not colon:
+            last = first
+        else:
+            last = mailbox.uidnext - 1 if last == '*' else int(last)
+        matches = [
+            (seq, uid, headers) for seq, (uid, headers) in enumerate(mailbox.messages, start=1)
+            if first <= uid <= last
+        ]
+        if not matches and mailbox.messages and message_set.endswith('*'):
+            # "n:*" always matches the last message, even when n is past it
+            matches = [(len(mailbox.messages), *mailbox.messages[-1])]
+        for seq, uid, headers in matches:
+            self.fetched_uids.append(uid)
+            writer.write(
+                f'* {seq} FETCH (UID {uid} RFC822.SIZE {len(headers) + 100} FLAGS () '
+                f'INTERNALDATE "17-Oct-2026 10:00:00 +0000" '
+                f'BODY[HEADER.FIELDS (MESSAGE-ID SUBJECT FROM TO DATE)] {{{len(headers)}}}\r\n'.encode()
+                + headers + b")\r\n"
+            )
+        writer.write(f"{tag} OK UID FETCH completed\r\n".encode())
+
+
+FAST_SYNC = dict(
+    IMAP_SYNC_FLUSH_SECONDS=0.05,
+    IMAP_SYNC_TIMEOUT_SECONDS=5,
+    IMAP_SYNC_MAX_BACKOFF_SECONDS=1,
+)
+
+
+@unittest.skipIf(aioimaplib is None, "aioimaplib is not installed")
+@override_settings(**FAST_SYNC)
+class InboxSyncTests(TransactionTestCase):
+    def setUp(self):
+        self.server = StandInIMAPServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def _account(self, user='inbox@example.com', password='secret', server_password=None):
+        self.server.add_mailbox(user, server_password or password)
+        return UnreadEmail.objects.create(
+            name='Inbox', email=user, password=password, provider='other',
+            imap_host='127.0.0.1', imap_port=self.server.port, use_ssl=False,
+        )
+
+    def _sync(self, **kwargs):
+        from .imap_sync import InboxSyncService
+        return asyncio.run(InboxSyncService(**kwargs).run_once())
+
+    def test_incremental_sync_fetches_only_new_messages(self):
+        account = self._account()
+        for i in range(3):
+            self.server.deliver(account.email, f'Message {i}')
+
+        summary = self._sync()
+        self.assertEqual(summary, {'accounts': 1, 'synced': 1, 'failed': 0, 'messages': 3})
+        state = MailboxSyncState.objects.get(account=account)
+        self.assertEqual((state.uidvalidity, state.uidnext), (1, 4))
+        self.assertEqual(self.server.fetched_uids, [1, 2, 3])
+
+        self.server.deliver(account.email, 'Message 3')
+        self.server.deliver(account.email, 'Message 4')
+        self.assertEqual(self._sync()['messages'], 2)
+        self.assertEqual(self.server.fetched_uids, [1, 2, 3, 4, 5])
+
+        # Nothing new: UIDNEXT matches the checkpoint and no FETCH is issued
+        self.assertEqual(self._sync()['messages'], 0)
+        self.assertEqual(self.server.fetched_uids, [1, 2, 3, 4, 5])
+
+        message = InboxMessage.objects.get(account=account, uid=5)
+        self.assertEqual(message.subject, 'Message 4')
+        self.assertEqual(message.message_id, '<msg-5@example.com>')
+        self.assertEqual(message.from_address, 'Sender <sender@example.com>')
+        self.assertIsNotNone(message.sent_at)
+        self.assertIsNotNone(message.received_at)
+        self.assertEqual(InboxMessage.objects.filter(account=account).count(), 5)
+
+    @override_settings(IMAP_SYNC_INITIAL_MESSAGES=2)
+    def test_first_sync_fetches_only_the_newest_messages(self):
+        account = self._account()
+        for i in range(5):
+            self.server.deliver(account.email, f'Message {i}')
+
+        self.assertEqual(self._sync()['messages'], 2)
+        self.assertEqual(
+            list(InboxMessage.objects.filter(account=account).order_by('uid').values_list('uid', flat=True)),
+            [4, 5],
+        )
+
+    def test_uidvalidity_change_resets_the_checkpoint(self):
+        account = self._account()
+        for i in range(3):
+            self.server.deliver(account.email, f'Message {i}')
+        self._sync()
+
+        mailbox = self.server.mailboxes[account.email]
+        mailbox.reset_uidvalidity()
+        self.server.deliver(account.email, 'After reset')
+        self.assertEqual(self._sync()['messages'], 4)
+
+        state = MailboxSyncState.objects.get(account=account)
+        self.assertEqual((state.uidvalidity, state.uidnext), (2, 5))
+        self.assertEqual(InboxMessage.objects.filter(account=account, uidvalidity=2).count(), 4)
+        self.assertEqual(self._sync()['messages'], 0)
+
+    def test_login_failure_is_recorded(self):
+        account = self._account(password='wrong', server_password='secret')
+        summary = self._sync()
+        self.assertEqual((summary['synced'], summary['failed']), (0, 1))
+        state = MailboxSyncState.objects.get(account=account)
+        self.assertIn('Login failed', state.last_error)
+        self.assertIsNone(state.uidnext)
+
+    def test_many_accounts_sync_concurrently(self):
+        accounts = [self._account(user=f'user{i}@example.com') for i in range(40)]
+        for account in accounts:
+            self.server.deliver(account.email, 'Hello')
+            self.server.deliver(account.email, 'Again')
+
+        summary = self._sync(max_connecting=8)
+        self.assertEqual(summary, {'accounts': 40, 'synced': 40, 'failed': 0, 'messages': 80})
+        self.assertEqual(self.server.logins, 40)
+        self.assertEqual(MailboxSyncState.objects.filter(uidnext=3).count(), 40)
+
+        summary = self._sync(shard=1, shards=4)
+        self.assertEqual(summary['accounts'], sum(1 for a in accounts if a.pk % 4 == 1))
+
+    def _follow_until(self, expected_messages, timeout=10):
+        """Run the follow loop until the account has ``expected_messages`` stored messages."""
+        from asgiref.sync import sync_to_async
+        from .imap_sync import InboxSyncService
+
+        async def follow():
+            stop_event = asyncio.Event()
+            task = asyncio.ensure_future(InboxSyncService().run_forever(stop_event))
+            count = sync_to_async(InboxMessage.objects.count)
+            try:
+                deadline = asyncio.get_running_loop().time() + timeout
+                while await count() < 1 or (self.server.idle and not self.server._idlers):
+                    await asyncio.sleep(0.05)
+                for subject in ('While idle', 'Later'):
+                    self.server.deliver(self.account.email, subject)
+                while await count() < expected_messages:
+                    if asyncio.get_running_loop().time() > deadline:
+                        break
+                    await asyncio.sleep(0.05)
+                return await count()
+            finally:
+                stop_event.set()
+                await asyncio.wait_for(task, 10)
+
+        return asyncio.run(follow())
+
+    def test_idle_picks_up_new_messages(self):
+        self.account = self._account()
+        self.server.deliver(self.account.email, 'Before')
+        # Polling is effectively off, so only IDLE can notice the new messages
+        with override_settings(IMAP_SYNC_POLL_SECONDS=3600):
+            self.assertEqual(self._follow_until(3), 3)
+        self.assertTrue(MailboxSyncState.objects.get(account=self.account).supports_idle)
+        self.assertEqual(sorted(self.server.fetched_uids), [1, 2, 3])
+
+    def test_polls_when_server_has_no_idle(self):
+        self.server.idle = False
+        self.account = self._account()
+        self.server.deliver(self.account.email, 'Before')
+        with override_settings(IMAP_SYNC_POLL_SECONDS=0.1):
+            self.assertEqual(self._follow_until(3), 3)
+        self.assertFalse(MailboxSyncState.objects.get(account=self.account).supports_idle)
+
+
+class SubmissionQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Submission endpoints run the same queries for 10 or 1000 submissions/attachments."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='staff', password='x')
+        cls.submission = UnreadEmail.objects.create(name='Detail', email='detail@example.com', password='secret')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _attach(self, submission, count):
+        UnreadEmailAttachment.objects.bulk_create(
+            UnreadEmailAttachment(
+                unread_email=submission, file=f'unread_email_attachments/{submission.pk}/file-{i}.pdf',
+                original_filename=f'file-{i}.pdf', content_type='application/pdf', file_size=1024,
+            )
+            for i in range(count)
+        )
+
+    def populate_submissions(self, count):
+        existing = UnreadEmail.objects.count()
+        submissions = UnreadEmail.objects.bulk_create(
+            UnreadEmail(name=f'User {i}', email=f'user{i}@example.com', password='gAAencrypted')
+            for i in range(existing, count)
+        )
+        for submission in submissions:
+            self._attach(submission, 2)
+
+    def populate_attachments(self, count):
+        self._attach(self.submission, count - self.submission.attachments.count())
+
+    def test_submission_list(self):
+        self.assertQueryBudget(
+            self.client, '/api/unread-emails/submissions/?page_size=500', 2, self.populate_submissions,
+        )
+
+    def test_submission_detail(self):
+        self.assertQueryBudget(
+            self.client, f'/api/unread-emails/submissions/{self.submission.pk}/', 2, self.populate_attachments,
+        )
+
+
+class SubmissionThrottleTests(TestCase):
+    def test_request_history_is_kept_in_the_shared_cache(self):
+        user = get_user_model().objects.create_user(username='throttled', password='x')
+        client = APIClient()
+        client.force_authenticate(user)
+        with mock.patch.object(UserRateThrottle, 'THROTTLE_RATES', {'user': '2/min', 'anon': None}):
+            statuses = [client.get('/api/unread-emails/submissions/').status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        # Every worker reads the same history from CACHES['default']
+        self.assertEqual(len(cache.get(f'throttle_user_{user.pk}')), 2)
+
+
+class CredentialInvalidationTests(TestCase):
+    def setUp(self):
+        credential_cache.clear()
+        self.addCleanup(credential_cache.clear)
+
+    def cached(self, instance, pk):
+        return any(key[:2] == (instance._meta.label, pk) for key in credential_cache._entries)
+
+    def test_save_and_delete_drop_the_cached_password(self):
+        account = UnreadEmail.objects.create(name='Creds', email='creds@example.com', password='first')
+        pk = account.pk
+        self.assertEqual(account.get_decrypted_password(), 'first')
+        self.assertTrue(self.cached(account, pk))
+
+        account.password = 'second'
+        account.save()
+        self.assertFalse(self.cached(account, pk))
+        self.assertEqual(UnreadEmail.objects.get(pk=pk).get_decrypted_password(), 'second')
+
+        self.assertTrue(self.cached(account, pk))
+        account.delete()
+        self.assertFalse(self.cached(account, pk))
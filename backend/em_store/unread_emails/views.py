@@ -7,11 +7,12 @@ from typing import List, Dict, Any
 
 from django.conf import settings
 from django.db import transaction
+from django.db.models import Prefetch
 from django.core.exceptions import ValidationError
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 # Password hashing removed - storing in plaintext
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, Http404
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required, user_passes_test
 
@@ -26,9 +27,10 @@ from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
 from rest_framework.decorators import api_view
-from django.http import HttpResponse, Http404
 from django.shortcuts import get_object_or_404
 
+from em_store.downloads import serve_stored_file
+from em_store.storage_utils import upload_files_to_r2
 from .models import UnreadEmail, UnreadEmailAttachment
 from .serializers import (
     UnreadEmailSerializer, 
@@ -38,6 +40,12 @@ from .serializers import (
 
 logger = logging.getLogger(__name__)
 
+# Columns read by the nested attachment serializer
+ATTACHMENT_FIELDS = (
+    'id', 'unread_email', 'file', 'original_filename', 'content_type',
+    'file_size', 'download_url', 'created_at',
+)
+
 class TestAPIView(APIView):
     """
     Simple test API view to verify the API is working
@@ -81,12 +89,14 @@ def download_attachment(request, attachment_id):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Create the response with file data
-        response = HttpResponse(attachment.file.read(), content_type=attachment.content_type)
-        response['Content-Disposition'] = f'attachment; filename="{attachment.original_filename}"'
-        response['Content-Length'] = attachment.file_size
-        return response
+        # Stream the file from storage
+        return serve_stored_file(request, attachment.file, attachment.original_filename, attachment.content_type)
         
+    except FileNotFoundError:
+        return Response(
+            {'error': 'File not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
     except Exception as e:
         logger.error(f"Error downloading file {attachment_id}: {e}", exc_info=True)
         return Response(
@@ -135,10 +145,20 @@ class UnreadEmailViewSet(viewsets.ModelViewSet):
     """
     queryset = UnreadEmail.objects.all()
     serializer_class = UnreadEmailSerializer
+    ordering = ('-created_at', '-id')
     parser_classes = (MultiPartParser, FormParser, JSONParser)
     http_method_names = ['get', 'post', 'head']  # Disable put/patch/delete
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
     
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            # The serializer nests the attachments and never reads the password
+            queryset = queryset.defer('password').prefetch_related(
+                Prefetch('attachments', queryset=UnreadEmailAttachment.objects.only(*ATTACHMENT_FIELDS))
+            )
+        return queryset
+
     def get_permissions(self):
         """
         Instantiates and returns the list of permissions that this view requires.
@@ -348,12 +368,14 @@ class UnreadEmailViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            # Create the response with file data
-            response = HttpResponse(attachment.file.read(), content_type=attachment.content_type)
-            response['Content-Disposition'] = f'attachment; filename="{attachment.original_filename}"'
-            response['Content-Length'] = attachment.file_size
-            return response
+            # Stream the file from storage
+            return serve_stored_file(request, attachment.file, attachment.original_filename, attachment.content_type)
             
+        except FileNotFoundError:
+            return Response(
+                {'error': 'File not found'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
         except Exception as e:
             logger.error(f"Error downloading file {attachment_id}: {e}", exc_info=True)
             return Response(
@@ -438,6 +460,7 @@ class UnreadEmailViewSet(viewsets.ModelViewSet):
         """
         logger.info(f"Starting _handle_file_uploads for {len(files)} files")
         
+        accepted = []
         for i, uploaded_file in enumerate(files, 1):
             file_info = f"File {i}/{len(files)}: {uploaded_file.name} ({uploaded_file.size} bytes, {uploaded_file.content_type})"
             logger.info(f"Processing {file_info}")
@@ -447,32 +470,42 @@ class UnreadEmailViewSet(viewsets.ModelViewSet):
                 logger.debug(f"Validating {uploaded_file.name}")
                 self._validate_file(uploaded_file)
                 logger.debug(f"Validation passed for {uploaded_file.name}")
-                
-                # Create the attachment with the file
-                logger.debug(f"Creating UnreadEmailAttachment for {uploaded_file.name}")
-                attachment = UnreadEmailAttachment(
-                    unread_email=unread_email,
-                    file=uploaded_file,
-                    original_filename=uploaded_file.name,
-                    content_type=uploaded_file.content_type or 'application/octet-stream',
-                    file_size=uploaded_file.size
-                )
-                
-                # Save the attachment (this will trigger the save method which generates the Cloudflare URL)
-                logger.debug(f"Saving file {uploaded_file.name} to storage")
-                attachment.save()
-                
-                logger.info(f"Successfully saved file {uploaded_file.name} with ID {attachment.id}")
-                logger.debug(f"Cloudflare URL: {attachment.download_url}")
+                accepted.append(uploaded_file)
                 
             except ValidationError as e:
                 logger.warning(f"Skipping invalid file {uploaded_file.name}: {str(e)}")
                 logger.debug(f"Validation error details:", exc_info=True)
                 continue
-                
-            except Exception as e:
-                logger.error(f"Error processing file {uploaded_file.name}: {str(e)}", exc_info=True)
+        
+        # Stream the accepted files to Cloudflare R2 in parallel
+        results = upload_files_to_r2([
+            {
+                'file_obj': uploaded_file,
+                'file_name': os.path.basename(uploaded_file.name),
+                'content_type': uploaded_file.content_type or 'application/octet-stream',
+                'folder': f'unread_emails/{unread_email.id}/attachments',
+            }
+            for uploaded_file in accepted
+        ])
+        
+        # The files are already in R2; their rows are created with one INSERT
+        attachments = []
+        for uploaded_file, result in zip(accepted, results):
+            if not result['success']:
+                logger.error(f"Error processing file {uploaded_file.name}: {result.get('error')}")
                 continue
+            attachments.append(UnreadEmailAttachment(
+                unread_email=unread_email,
+                file=result['key'],
+                original_filename=uploaded_file.name,
+                content_type=uploaded_file.content_type or 'application/octet-stream',
+                file_size=uploaded_file.size,
+                download_url=result['url']
+            ))
+        if attachments:
+            UnreadEmailAttachment.objects.bulk_create(attachments)
+            for attachment in attachments:
+                logger.info(f"Successfully saved file {attachment.original_filename} with ID {attachment.id}")
                 
         logger.info(f"Completed processing {len(files)} files")
     
@@ -141,8 +141,8 @@ const Home: React.FC = () => {
     try {
       // Fetch campaigns for the current user
       const response = await api.get(ENDPOINTS.CAMPAIGNS.BASE);
-      const data = response.data;
-      if (Array.isArray(data) && data.length > 0) {
+      const campaigns = response.data?.results;
+      if (Array.isArray(campaigns) && campaigns.length > 0) {
         navigate("/email-dashboard");
       } else {
         navigate("/dashboard/upload");